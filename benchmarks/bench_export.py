@@ -0,0 +1,90 @@
+"""Benchmarks the inbox and cases commands end to end against a local fake MCX server
+
+Usage: python benchmarks/bench_export.py --cases 2000 --latency 0.05 --error-rate 0.01 [--async] [--stream]
+(with mcxapi installed, e.g. pip install -e .)
+
+Each command runs in a fresh process pointed at benchmarks/fake_mcx.py with --base-url. Reports rows per second,
+the p50/p99 request latency from --metrics-out and the peak RSS of the command's process.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_mcx import add_arguments, fake_from_arguments, serve
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = "from mcxapi.cli import cli; cli()"
+
+
+def run_command(base_url, args, command, command_args=()):
+    """ Runs an mcx command in a temporary directory, returns the seconds taken, peak RSS in MiB and the metrics
+    """
+    with tempfile.TemporaryDirectory() as cwd:
+        argv = [sys.executable, "-c", CLI, "-i", "bench", "-c", "company", "-u", "user", "-p", "password",
+                "--base-url", base_url, "--format", args.format, "--page-window", str(args.page_window),
+                "--metrics-out", "metrics"]
+        argv.extend(args.cli_args)
+        argv.append(command)
+        argv.extend(command_args)
+        env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+
+        start = time.perf_counter()
+        process = subprocess.Popen(argv, cwd=cwd, env=env, stdout=subprocess.DEVNULL)
+        # wait4 returns the resource usage of this child alone
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            raise SystemExit("{} failed with exit code {}".format(command, process.returncode))
+
+        with open(os.path.join(cwd, "metrics.json")) as metrics_file:
+            metrics = json.load(metrics_file)
+
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak_rss = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return elapsed, peak_rss, metrics
+
+
+def report(name, rows, endpoint, elapsed, peak_rss, metrics):
+    latency = metrics["endpoints"].get(endpoint, {}).get("latency_seconds", {})
+    retries = metrics["endpoints"].get(endpoint, {}).get("retries", 0)
+    print("{:<8} {:>8} {:>9.2f} {:>10.1f} {:>9} {:>9} {:>8} {:>9.1f}".format(name, rows, elapsed, rows / elapsed,
+                                                                          _ms(latency.get("p50")), _ms(latency.get("p99")),
+                                                                          retries, peak_rss))
+
+
+def _ms(seconds):
+    return "-" if seconds is None else "{:.1f}".format(seconds * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--format", default="jsonl", choices=["xlsx", "csv", "json", "jsonl", "parquet", "arrow"])
+    parser.add_argument("--page-window", type=int, default=4)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="run cases with --async")
+    parser.add_argument("--stream", action="store_true", help="run cases with --stream")
+    parser.add_argument("cli_args", nargs="*", help="extra mcx options, after --, e.g. -- --max-workers 100")
+    args = parser.parse_args()
+
+    fake = fake_from_arguments(args)
+    httpd, base_url = serve(fake)
+    cases_args = [flag for flag, enabled in (("--async", args.use_async), ("--stream", args.stream)) if enabled]
+    try:
+        print("{} cases, {} items, root cause depth {}, {}s latency, {:.1%} errors".format(args.cases, args.items, args.depth,
+                                                                                          args.latency, args.error_rate))
+        print("{:<8} {:>8} {:>9} {:>10} {:>9} {:>9} {:>8} {:>9}".format("command", "rows", "seconds", "rows/s", "p50 ms",
+                                                                      "p99 ms", "retries", "RSS MiB"))
+        report("inbox", args.cases, "getMobileCaseInboxItems", *run_command(base_url, args, "inbox"))
+        report("cases", args.cases, "getCaseView", *run_command(base_url, args, "cases", cases_args))
+        print("server: {} requests, {} errors injected".format(fake.requests, fake.errors))
+    finally:
+        httpd.shutdown()
+
+
+if __name__ == '__main__':
+    main()
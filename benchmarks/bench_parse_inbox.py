@@ -0,0 +1,46 @@
+"""Benchmarks McxApiBase.parse_case_inbox for inboxes of 1k to 100k rows
+
+Usage: python benchmarks/bench_parse_inbox.py (with mcxapi installed, e.g. pip install -e .)
+
+Parsing is linear in the number of rows if the time per row stays flat as the inbox grows.
+"""
+import time
+
+from mcxapi.api import McxApiBase, InboxBuilder
+
+COLUMNS = 20
+ROW_COUNTS = [1000, 10000, 100000]
+
+
+def inbox_pages(row_count, page_size=McxApiBase.PAGE_SIZE):
+    for start in range(0, row_count, page_size):
+        rows = []
+        for case_id in range(start, min(start + page_size, row_count)):
+            columns = [{"ColumnName": "Column {}".format(c), "ColumnValue": "{}-{}".format(case_id, c)} for c in range(COLUMNS)]
+            rows.append({"CaseId": case_id, "Columns": columns})
+        yield {"GetMobileCaseInboxItemsResult": {"caseMobileInboxData": {"Rows": rows}}}
+
+
+def bench(row_count):
+    api = McxApiBase("bench", "company", "user", "password")
+    pages = list(inbox_pages(row_count))
+    inbox = InboxBuilder()
+    start = time.perf_counter()
+    for page in pages:
+        api.parse_case_inbox(page, inbox)
+    result = inbox.build()
+    elapsed = time.perf_counter() - start
+    assert len(result.ids) == row_count
+
+    return elapsed
+
+
+def main():
+    print("{:>8} {:>10} {:>12}".format("rows", "seconds", "us/row"))
+    for row_count in ROW_COUNTS:
+        elapsed = bench(row_count)
+        print("{:>8} {:>10.3f} {:>12.2f}".format(row_count, elapsed, elapsed / row_count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""A local stand-in for CaseManagement.svc serving synthetic cases
+
+Usage: python benchmarks/fake_mcx.py --cases 5000 --latency 0.05 --error-rate 0.01
+
+Serves authenticate, paged getMobileCaseInboxItems and getCaseView on http://127.0.0.1:<port>/CaseManagement.svc,
+point the CLI at it with --base-url. Cases are generated from their id so every run sees the same data.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mcxapi.api import Item
+
+INBOX_COLUMNS = 10
+ROOT_CAUSE_BRANCHES = 2
+TOKEN = "fake-token"
+
+
+class FakeMcx:
+    """ Synthetic cases with items text, dropdown and root cause items, each root cause tree depth levels deep
+
+    Every user's inbox has cases 1 to cases, unless inboxes maps users to the case ids in their inbox.
+    """
+
+    def __init__(self, cases=1000, items=20, depth=3, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, inboxes=None):
+        self.cases = cases
+        self.inboxes = inboxes
+        self.items = items
+        self.depth = depth
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        # getCaseView requests per case id
+        self.case_requests = Counter()
+        self._lock = threading.Lock()
+
+    def delay(self):
+        return self.latency + self.random.uniform(0, self.jitter)
+
+    def should_fail(self):
+        with self._lock:
+            self.requests += 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def inbox_page(self, start_page, page_size, user=None):
+        if self.inboxes is None:
+            case_ids = range(1, self.cases + 1)
+        else:
+            case_ids = self.inboxes.get(user, [])
+        rows = []
+        for case_id in case_ids[start_page * page_size:(start_page + 1) * page_size]:
+            columns = [{"ColumnName": "Status", "ColumnValue": "Open"},
+                       {"ColumnName": "Modified", "ColumnValue": "/Date({}+0000)/".format(1486742990423 + case_id)}]
+            columns.extend({"ColumnName": "Column {}".format(c), "ColumnValue": "{}-{}".format(case_id, c)}
+                           for c in range(INBOX_COLUMNS - len(columns)))
+            rows.append({"CaseId": case_id, "Columns": columns})
+
+        return {"GetMobileCaseInboxItemsResult": {"caseMobileInboxData": {"Rows": rows}}}
+
+    def case_view(self, case_id):
+        items = [_item(1, Item.STATUS, "Status", dropdowns=["Open", "Closed"]),
+                 _item(2, Item.PRIORITY, "Priority", dropdowns=["Low", "High"])]
+        item_answers = []
+        root_cause_answers = []
+        for case_item_id in range(3, self.items + 3):
+            kind = case_item_id % 3
+            if kind == 0:
+                items.append(_item(case_item_id, Item.SHORT_TEXT_BOX, "Text {}".format(case_item_id)))
+                item_answers.append(_answer(case_item_id, Item.SHORT_TEXT_BOX, text_value="Answer {} {}".format(case_id, case_item_id)))
+            elif kind == 1:
+                items.append(_item(case_item_id, Item.DROPDOWN, "Dropdown {}".format(case_item_id), dropdowns=["A", "B", "C"]))
+                item_answers.append(_answer(case_item_id, Item.DROPDOWN, int_value=case_id % 3 + 1))
+            else:
+                root_causes = _root_causes(case_item_id, self.depth)
+                items.append(_item(case_item_id, Item.ROOT_CAUSE, "Root Cause {}".format(case_item_id), root_causes=root_causes))
+                # answer one path from a root to a leaf
+                tree_id = "0"
+                for _ in range(self.depth):
+                    root_cause_answers.append({"CaseItemId": case_item_id, "CaseRootCauseId": 0, "TreeId": tree_id})
+                    tree_id += str(case_id % ROOT_CAUSE_BRANCHES)
+
+        return {"GetCaseViewResult": {
+            "viewValues": {
+                "CaseId": case_id,
+                "AlertName": "Alert",
+                "OwnerFullName": "Bench Owner",
+                "TimeToCloseDisplay": "1d",
+                "TimeToCloseGoalDisplay": "2d",
+                "TimeToRespondDisplay": "1h",
+                "TimeToRespondGoalDisplay": "2h",
+                "CaseStatusId": 1,
+                "CasePriorityId": case_id % 2 + 1,
+                "RespondentId": 1000 + case_id,
+                "SurveyId": 10,
+                "SurveyName": "Survey 10",
+                "ItemAnswers": item_answers,
+                "CaseRootCauseAnswers": root_cause_answers,
+                "ActivityNotes": [{"ActivityNote": "Note {}".format(case_id), "ActivityNoteDate": "/Date(1486742990423-0600)/",
+                                   "FullName": "Bench Owner"}],
+                "SourceResponses": [{"Key": 50, "Value": {"QuestionText": "Score", "AnswerText": str(case_id % 11)}}],
+            },
+            "caseView": {"CaseViewItems": items},
+        }}
+
+    def handle(self, endpoint, body):
+        """ Returns the status and JSON response for a request
+        """
+        if endpoint == "authenticate":
+            # the token is the user's, e.g. fake-token:alice
+            return 200, {"AuthenticateResult": {"token": "{}:{}".format(TOKEN, body.get("userName"))}}
+        token, _, user = body.get("token", "").partition(":")
+        if token != TOKEN:
+            return 401, {}
+        if self.should_fail():
+            return 503, {}
+        if endpoint == "getMobileCaseInboxItems":
+            return 200, self.inbox_page(body["startPage"], body["pageSize"], user)
+        if endpoint == "getCaseView":
+            with self._lock:
+                self.case_requests[body["caseId"]] += 1
+            return 200, self.case_view(body["caseId"])
+
+        return 404, {}
+
+
+def _item(case_item_id, question_type_id, text, dropdowns=(), root_causes=()):
+    return {"CaseItemId": case_item_id, "CaseQuestionTypeId": question_type_id, "CaseItemText": text,
+            "DropdownValues": [{"Id": i + 1, "Text": t} for i, t in enumerate(dropdowns)],
+            "RootCauseValues": list(root_causes)}
+
+
+def _answer(case_item_id, question_type_id, text_value=None, int_value=None):
+    return {"CaseItemAnswerId": case_item_id * 10, "CaseItemId": case_item_id, "CaseQuestionTypeId": question_type_id,
+            "IsEmpty": False, "BoolValue": None, "DoubleValue": None, "IntValue": int_value, "TextValue": text_value,
+            "TimeValue": None}
+
+
+def _root_causes(case_item_id, depth):
+    """ A tree with one root and ROOT_CAUSE_BRANCHES children per node, tree ids are the path from the root, e.g. 001
+    """
+    root_causes = []
+    level = [("0", "#")]
+    for _ in range(depth):
+        next_level = []
+        for tree_id, parent_tree_id in level:
+            root_causes.append({"CaseItemId": case_item_id, "CaseRootCauseId": len(root_causes), "RootCauseName": "Cause " + tree_id,
+                                "ParentTreeId": parent_tree_id, "TreeId": tree_id})
+            next_level.extend((tree_id + str(b), tree_id) for b in range(ROOT_CAUSE_BRANCHES))
+        level = next_level
+
+    return root_causes
+
+
+def serve(fake, port=0):
+    """ Starts serving fake on a background thread, returns the server and the --base-url to use
+    """
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, like the real service
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+            status, response = fake.handle(self.path.rsplit('/', 1)[-1], body)
+            time.sleep(fake.delay())
+            data = json.dumps(response).encode()
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except OSError:
+                # the client went away, e.g. a hedged request that lost
+                self.close_connection = True
+
+    ThreadingHTTPServer.request_queue_size = 1024
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    return httpd, "http://127.0.0.1:{}/CaseManagement.svc".format(httpd.server_address[1])
+
+
+def add_arguments(parser):
+    parser.add_argument("--cases", type=int, default=1000, help="number of cases in the inbox")
+    parser.add_argument("--items", type=int, default=20, help="items per case, a third of them root cause trees")
+    parser.add_argument("--depth", type=int, default=3, help="depth of each root cause tree")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many random seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of inbox and case requests answered with a 503")
+
+
+def fake_from_arguments(args):
+    return FakeMcx(cases=args.cases, items=args.items, depth=args.depth, latency=args.latency, jitter=args.jitter,
+                   error_rate=args.error_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    httpd, base_url = serve(fake_from_arguments(args), args.port)
+    print("Serving {} cases on {}".format(args.cases, base_url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        httpd.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+
+from collections import deque
+from itertools import islice
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - optional dependency
+    aiohttp = None
+
+from . import decoding
+from .api import McxApiBase, InboxBuilder, LazyFormat
+from .exceptions import McxAuthError, McxCircuitOpenError, McxNetworkError
+from .resilience import parse_retry_after
+
+
+class AsyncMcxApi(McxApiBase):
+    """ asyncio client for the MCX API
+
+    Parses responses into the same Case and Inbox models as McxApi but keeps all requests on a single event loop,
+    so hundreds of requests can be in flight without a thread per request. Use it as an async context manager so
+    the underlying aiohttp session is closed:
+
+        async with AsyncMcxApi(instance, company, user, password) as api:
+            await api.auth()
+            case = await api.get_case(case_id)
+    """
+
+    def __init__(self, instance, company, user, password, headers=None, concurrency=200, case_store=None, token_manager=None,
+                 retry_policy=None, metrics=None, archive=None, item_definitions=None, fields=None, single_flight=None,
+                 hedge_policy=None):
+        if aiohttp is None:
+            raise ImportError("AsyncMcxApi requires aiohttp, install it with: pip install mcxapi[async]")
+        super().__init__(instance, company, user, password, case_store, token_manager, retry_policy, metrics, archive,
+                         item_definitions, fields, single_flight, hedge_policy)
+        self.headers = headers
+        self.concurrency = concurrency
+        self.session = None
+        self._refresh_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            timeout = aiohttp.ClientTimeout(total=self.TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _post(self, url, json, raw=False):
+        token = self.token
+        try:
+            return await self._send(url, json, token, raw)
+        except McxAuthError:
+            if token is None:
+                raise
+            # the token has expired, the first request to notice refreshes it and the others wait for the new one
+            async with self._refresh_lock:
+                if self.token == token:
+                    self.token = await self._authenticate()
+                    self.token_manager.put(self._token_key, self.token)
+            return await self._send(url, json, self.token, raw)
+
+    async def _send(self, url, json, token, raw=False):
+        await self.open()
+        json = dict(json)
+        if token:
+            json[self.TOKEN_KEY] = token
+
+        logging.info("POST: url: %s json: %s", url, LazyFormat(self._sanitize_json_for_logging, json))
+        # retries follow the same RetryPolicy as McxApi._post_with_retries
+        policy = self.retry_policy
+        endpoint = self._endpoint(url)
+        breaker = self._breaker(url)
+        policy.budget.deposit()
+        attempt = 0
+        while True:
+            if not breaker.allow_request():
+                raise McxCircuitOpenError(url, json=self._sanitize_json_for_logging(json))
+            retry_after = None
+            # None until the attempt has an outcome
+            failed = None
+            start = time.perf_counter()
+            try:
+                r, body = await self._hedged_post(url, json)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.metrics.observe_request(endpoint, time.perf_counter() - start)
+                failed = True
+                error = e
+            except aiohttp.ClientError as e:
+                self.metrics.observe_request(endpoint, time.perf_counter() - start)
+                failed = True
+                raise McxNetworkError(url, json=self._sanitize_json_for_logging(json)) from e
+            else:
+                self.metrics.observe_request(endpoint, time.perf_counter() - start, len(body), r.status)
+                failed = r.status in policy.RETRY_STATUSES
+                if not failed:
+                    if r.status in self.AUTH_ERROR_STATUSES:
+                        raise McxAuthError(url, json=self._sanitize_json_for_logging(json))
+                    try:
+                        r.raise_for_status()
+                    except aiohttp.ClientResponseError as e:
+                        raise McxNetworkError(url, json=self._sanitize_json_for_logging(json)) from e
+                    return body if raw else decoding.loads(body)
+                error = aiohttp.ClientResponseError(r.request_info, r.history, status=r.status, message=r.reason)
+                retry_after = parse_retry_after(r.headers.get('Retry-After'))
+            finally:
+                self._record_attempt(breaker, failed)
+
+            if attempt >= policy.retries or not policy.budget.withdraw():
+                raise McxNetworkError(url, json=self._sanitize_json_for_logging(json)) from error
+            self.metrics.record_retry(endpoint)
+            await asyncio.sleep(policy.backoff(attempt, retry_after))
+            attempt += 1
+
+    async def _hedged_post(self, url, json):
+        """ Posts, and with a hedge_policy posts again if the first response is slow, see McxApi._hedged_post
+
+        Returns the first response and its body, the slower request is cancelled.
+        """
+        endpoint = self._endpoint(url)
+        delay = self._hedge_delay(endpoint)
+        if delay is None:
+            return await self._read_post(url, json)
+
+        first = asyncio.ensure_future(self._read_post(url, json))
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done or not self.hedge_policy.budget.withdraw():
+            return await first
+
+        logging.info("Hedging %s after %.2f seconds", url, delay)
+        hedge = asyncio.ensure_future(self._read_post(url, json))
+        pending = {first, hedge}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                answered = [t for t in done if t.exception() is None]
+                if answered or not pending:
+                    winner = (answered or list(done))[0]
+                    self.metrics.record_hedge(endpoint, won=winner is hedge)
+                    return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _read_post(self, url, json):
+        async with self.session.post(url, json=json) as r:
+            return r, await r.read()
+
+    async def _authenticate(self):
+        url = self._url("authenticate")
+        json = await self._send(url, self._auth_payload(), None)
+        self._parse_auth(json)
+
+        return self.token
+
+    async def auth(self):
+        """ Authenticates the user, reusing a token from the token_manager if it has one
+        """
+        token = self.token_manager.get(self._token_key)
+        if token is None:
+            token = await self._authenticate()
+            self.token_manager.put(self._token_key, token)
+        self.token = token
+
+    async def get_case_inbox(self, window=1):
+        """ Fetches active cases assigned to the user
+
+        With a window greater than 1, up to window pages are requested concurrently ahead of the page being parsed.
+        """
+        inbox = InboxBuilder()
+        url = self._url("getMobileCaseInboxItems")
+        pages = iter(range(0, self.PAGES))
+        in_flight = deque(asyncio.ensure_future(self._post(url, json=self._inbox_payload(p), raw=True)) for p in islice(pages, window))
+        try:
+            while in_flight:
+                body = await in_flight.popleft()
+                start_count = len(inbox)
+                row_count = self.parse_case_inbox_body(body, inbox)
+                if self._is_last_inbox_page(row_count, len(inbox) - start_count, window):
+                    break
+                for p in islice(pages, 1):
+                    in_flight.append(asyncio.ensure_future(self._post(url, json=self._inbox_payload(p), raw=True)))
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+        return inbox.build()
+
+    async def get_case(self, case_id, marker=None):
+        """ Fetches detailed information about a case, see McxApi.get_case
+        """
+        if self.single_flight is not None:
+            return await self.single_flight.do_async(case_id, self._get_case, case_id, marker)
+
+        return await self._get_case(case_id, marker)
+
+    async def _get_case(self, case_id, marker):
+        return self._build_case(await self.get_case_view(case_id, marker), case_id)
+
+    async def get_case_view(self, case_id, marker=None, raw=False):
+        """ Fetches the getCaseView response for a case without parsing it, see McxApi.get_case_view
+        """
+        json = self._stored_case(case_id, marker, raw)
+        if json is None:
+            url = self._url("getCaseView")
+            payload = {'caseId': case_id}
+            json = await self._post(url, json=payload, raw=raw)
+            self._store_case(case_id, marker, json)
+        self._record_case_view(case_id, json, raw)
+
+        return json
@@ -1,14 +1,22 @@
 import logging
 import requests
 import re
+import threading
+import time
 
 from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 from datetime import datetime, timezone, timedelta
-from collections import namedtuple
+from collections import namedtuple, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from anytree import RenderTree, NodeMixin
 
-from .exceptions import McxNetworkError, McxParsingError
+from . import decoding
+from .auth import TokenManager
+from .concurrency import DaemonThreadPool
+from .exceptions import McxAuthError, McxCircuitOpenError, McxNetworkError, McxParsingError
+from .metrics import Metrics
+from .resilience import RetryPolicy, parse_retry_after
 
 Inbox = namedtuple('Inbox', 'ids fieldnames cases')
 
@@ -21,22 +29,76 @@ def ordinal(n):
 
 
 def parse_date(date):
+    timestamp = parse_timestamp(date)
+    if timestamp is None:
+        return "Unknown Date Format"
+    else:
+        return timestamp.strftime('%Y-%m-%d %H:%M%z')
+
+
+def parse_timestamp(date):
+    """ Returns the timezone aware datetime of a date in the API's date format, or None if date isn't one
+    """
     # Weird date format /Date(milliseconds-since-epoch-+tzoffset)/
     # /Date(1486742990423-0600)/
     # /Date(1486664366563+0100)/
     r = re.compile(r'/Date\((\d+)([-+])(\d{2,2})(\d{2,2})\)/')
     m = r.match(date)
     if m is None:
-        return "Unknown Date Format"
-    else:
-        milliseconds, sign, tzhours, tzminutes = m.groups()
-        seconds = int(milliseconds) / 1000.0
-        sign = -1 if sign == '-' else 1
-        tzinfo = timezone(sign * timedelta(hours=int(tzhours), minutes=int(tzminutes)))
-        return datetime.fromtimestamp(seconds, tzinfo).strftime('%Y-%m-%d %H:%M%z')
+        return None
+    milliseconds, sign, tzhours, tzminutes = m.groups()
+    seconds = int(milliseconds) / 1000.0
+    sign = -1 if sign == '-' else 1
+    tzinfo = timezone(sign * timedelta(hours=int(tzhours), minutes=int(tzminutes)))
+    return datetime.fromtimestamp(seconds, tzinfo)
+
+
+class LazyFormat:
+    """ Defers calling func(*args) until a log record is formatted, so nothing is computed for disabled levels
+    """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
+class InboxBuilder:
+    """ Accumulates inbox rows across pages into an Inbox
+
+    Case ids and fieldnames are tracked in sets so adding a row is independent of the size of the inbox.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.cases = []
+        self.fieldnames = set()
+        self._seen_ids = set()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, case_id, case):
+        """ Adds a case row, returns False if the case_id has already been added
+        """
+        self.fieldnames.update(case)
+        # Dedupes the cases in case the same case_id is exported multiple times because of paging
+        if case_id in self._seen_ids:
+            return False
+        self._seen_ids.add(case_id)
+        self.ids.append(case_id)
+        self.cases.append(case)
+        return True
+
+    def build(self):
+        return Inbox(ids=self.ids, fieldnames=sorted(self.fieldnames), cases=self.cases)
 
 
-class McxApi:
+class McxApiBase:
+    """ Configuration and response parsing shared by the synchronous and asynchronous clients
+    """
     BASE_URL = "https://{}.mcxplatform.de/CaseManagement.svc/{}"
     TIMEOUT = 45
     RETRY_COUNT = 3
@@ -44,25 +106,30 @@ class McxApi:
     TOKEN_KEY = "token"
     PAGE_SIZE = 500
     PAGES = 199
+    # 401 Unauthorized
+    # 403 Forbidden
+    AUTH_ERROR_STATUSES = (401, 403)
 
-    def __init__(self, instance, company, user, password, headers=None, pool_connections=50):
+    def __init__(self, instance, company, user, password, case_store=None, token_manager=None, retry_policy=None,
+                 metrics=None, archive=None, item_definitions=None, fields=None, single_flight=None, hedge_policy=None):
         self.instance = instance
         self.company = company
         self.user = user
         self.password = password
-        self.session = requests.Session()
-        # 500 Internal Service Error
-        # 501 Not Implemented
-        # 502 Bad Gateway
-        # 503 Service Unavailable
-        # 504 Gateway Timeout
-        retries = Retry(total=self.RETRY_COUNT, backoff_factor=1, status_forcelist=[500, 501, 502, 503, 504], method_whitelist=['GET', 'POST'])
-        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_connections, max_retries=retries)
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
-        self.session.headers = headers
+        self.case_store = case_store
+        self.token_manager = token_manager or TokenManager()
+        self.retry_policy = retry_policy or RetryPolicy(retries=self.RETRY_COUNT)
+        self.metrics = metrics or Metrics()
+        self.archive = archive
+        self.item_definitions = item_definitions
+        self.fields = fields
+        self.single_flight = single_flight
+        self.hedge_policy = hedge_policy
         self.token = None
-        print("HTTP connection timeout: {}, retry count: {}".format(self.TIMEOUT, self.RETRY_COUNT))
+
+    @property
+    def _token_key(self):
+        return TokenManager.key(self.instance, self.company, self.user)
 
     def _sanitize_json_for_logging(self, json):
         json_copy = json.copy()
@@ -76,94 +143,442 @@ class McxApi:
     def _url(self, endpoint):
         return self.BASE_URL.format(self.instance, endpoint)
 
-    def _post(self, url, params=None, json={}):
-        if self.token:
-            json[self.TOKEN_KEY] = self.token
+    def _endpoint(self, url):
+        # e.g. getCaseView
+        return url.rsplit('/', 1)[-1]
+
+    def _hedge_delay(self, endpoint):
+        # seconds to wait before hedging a request to endpoint, None if it isn't hedged
+        policy = self.hedge_policy
+        if policy is None or endpoint not in policy.endpoints:
+            return None
+        policy.budget.deposit()
+
+        return policy.delay(endpoint, self.metrics)
+
+    def _breaker(self, url):
+        # one circuit per endpoint
+        return self.retry_policy.breaker(self._endpoint(url))
+
+    def _record_attempt(self, breaker, failed):
+        # every attempt has to reach the breaker however it ended, or a half-open circuit whose trial request
+        # raised would stay half-open and fail every later request
+        if failed is None:
+            # ended without an outcome, e.g. cancelled
+            breaker.release_trial()
+        elif failed:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def _auth_payload(self):
+        return {'userName': self.user, self.PASSWORD_KEY: self.password, 'companyName': self.company}
+
+    def _parse_auth(self, json):
+        result = json["AuthenticateResult"]
+        if "token" in result:
+            self.token = result["token"]
+
+    def _inbox_payload(self, page):
+        print("Fetching {} {} case_ids from inbox".format(ordinal(page + 1), self.PAGE_SIZE))
+        return {'startPage': page, 'pageSize': self.PAGE_SIZE}
+
+    def _is_last_inbox_page(self, row_count, new_count, window):
+        # The serial walk only stops once a page adds no new case ids. Windowed pagination prefetches pages ahead,
+        # so it also stops on the first short page to avoid waiting on pages beyond the end of the inbox.
+        if new_count == 0:
+            return True
+        return window > 1 and row_count < self.PAGE_SIZE
 
-        logging.info("POST: url: {} json: {}".format(url, self._sanitize_json_for_logging(json)))
+    def parse_case_inbox(self, json, inbox, fieldnames=None, cases=None):
+        """ Parses an inbox page into an InboxBuilder, returns the number of rows in the page
+
+        The old parse_case_inbox(json, case_ids, fieldnames, cases) form, which appends to the three lists, is still
+        accepted.
+        """
+        if fieldnames is not None:
+            return self._parse_case_inbox_lists(json, inbox, fieldnames, cases)
+        self._record("getMobileCaseInboxItems", json)
+        rows = json["GetMobileCaseInboxItemsResult"]["caseMobileInboxData"]["Rows"]
+        try:
+            with self.metrics.time_parse("inbox_page"):
+                return self._parse_inbox_rows(rows, inbox)
+        except Exception as e:
+            raise McxParsingError(json, "Unable to parse inbox") from e
+
+    def _parse_case_inbox_lists(self, json, case_ids, fieldnames, cases):
+        inbox = InboxBuilder()
+        inbox._seen_ids.update(case_ids)
+        row_count = self.parse_case_inbox(json, inbox)
+        case_ids.extend(inbox.ids)
+        cases.extend(inbox.cases)
+        seen_fieldnames = set(fieldnames)
+        for case in inbox.cases:
+            for key in case:
+                if key not in seen_fieldnames:
+                    seen_fieldnames.add(key)
+                    fieldnames.append(key)
+        # columns only seen on rows of cases that were already added
+        fieldnames.extend(sorted(inbox.fieldnames - seen_fieldnames))
+
+        return row_count
+
+    def parse_case_inbox_body(self, body, inbox):
+        """ Parses the undecoded body of an inbox page into an InboxBuilder, returns the number of rows in the page
+
+        The body is decoded whole with decoding.loads, which is faster than decoding the rows of a body that is
+        already in memory one at a time.
+        """
+        try:
+            json = decoding.loads(body)
+        except ValueError as e:
+            raise McxParsingError(body, "Unable to parse inbox") from e
+
+        return self.parse_case_inbox(json, inbox)
+
+    def _parse_inbox_rows(self, rows, inbox):
+        row_count = 0
+        for row in rows:
+            row_count += 1
+            case = {}
+            case_id = None
+            row["Inbox Owner"] = self.user
+            for key, val in row.items():
+                # special case for the nested list of n columns
+                if key == "Columns":
+                    for column in val:
+                        case[column["ColumnName"]] = column["ColumnValue"]
+                else:
+                    if key == "CaseId":
+                        case_id = val
+                    case[key] = val
+            inbox.add(case_id, case)
+
+        return row_count
+
+    def _stored_case(self, case_id, marker, raw=False):
+        if self.case_store is None:
+            return None
+        json = self.case_store.get(case_id, marker, raw)
+        if json is not None:
+            logging.info("Case %s unchanged, using stored copy", case_id)
+
+        return json
+
+    def _store_case(self, case_id, marker, json):
+        if self.case_store is not None:
+            self.case_store.put(case_id, marker, json)
+
+    def _record(self, endpoint, json, case_id=None):
+        # recorded before parsing, which adds the Inbox Owner to inbox rows
+        if self.archive is not None:
+            self.archive.record(endpoint, self.user, json, case_id)
+
+    def _record_case_view(self, case_id, response, raw):
+        # the archive holds decoded responses, an undecoded body is only decoded when it is being recorded
+        if self.archive is None:
+            return
+        if raw:
+            try:
+                response = decoding.loads(response)
+            except ValueError as e:
+                raise McxParsingError(response, "Unable to parse case {}".format(case_id)) from e
+        self._record("getCaseView", response, case_id)
+
+    def parse_case(self, json, case_id):
+        self._record("getCaseView", json, case_id)
+        return self._build_case(json, case_id)
+
+    def _build_case(self, json, case_id):
+        with self.metrics.time_parse("case"):
+            return build_case(json, case_id, self.item_definitions, self.fields)
+
+
+# runs hedged requests for every McxApi
+_hedge_threads = DaemonThreadPool()
+
+
+class McxApi(McxApiBase):
+
+    def __init__(self, instance, company, user, password, headers=None, pool_connections=50, case_store=None, token_manager=None,
+                 limiter=None, retry_policy=None, metrics=None, archive=None, item_definitions=None, fields=None,
+                 single_flight=None, hedge_policy=None):
+        super().__init__(instance, company, user, password, case_store, token_manager, retry_policy, metrics, archive,
+                         item_definitions, fields, single_flight, hedge_policy)
+        self.limiter = limiter
+        if limiter is not None:
+            # every request the limiter allows needs a pooled connection
+            pool_connections = limiter.max_limit
+        self.session = requests.Session()
+        # retries are done by _send with the shared retry_policy rather than by urllib3 in each thread
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_connections, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers = headers
+        print("HTTP connection timeout: {}, retry count: {}".format(self.TIMEOUT, self.retry_policy.retries))
+
+    def _post(self, url, params=None, json={}, raw=False):
+        """ Posts json and returns the decoded response, or with raw the undecoded body
+        """
+        token = self.token
+        try:
+            return self._send(url, params, json, token, raw)
+        except McxAuthError:
+            if token is None:
+                raise
+            # the token has expired, retry once with a new one
+            self.token = self.token_manager.refresh(self._token_key, token, self._authenticate)
+            return self._send(url, params, json, self.token, raw)
+
+    def _send(self, url, params, json, token, raw=False):
+        if token:
+            json[self.TOKEN_KEY] = token
+
+        logging.info("POST: url: %s json: %s", url, LazyFormat(self._sanitize_json_for_logging, json))
+        r = self._post_with_retries(url, params, json)
+        if r.status_code in self.AUTH_ERROR_STATUSES:
+            raise McxAuthError(url, json=self._sanitize_json_for_logging(json))
         try:
-            r = self.session.post(url, params=params, json=json, timeout=self.TIMEOUT)
             r.raise_for_status()
         except requests.exceptions.RequestException as e:
             raise McxNetworkError(url, json=self._sanitize_json_for_logging(json)) from e
 
-        return r.json()
+        return r.content if raw else decoding.loads(r.content)
 
-    def auth(self):
+    def _post_with_retries(self, url, params, json):
+        """ Posts until the response is not a server error, as long as the endpoint's circuit and the retry budget allow
+        """
+        policy = self.retry_policy
+        endpoint = self._endpoint(url)
+        breaker = self._breaker(url)
+        policy.budget.deposit()
+        attempt = 0
+        while True:
+            if not breaker.allow_request():
+                raise McxCircuitOpenError(url, json=self._sanitize_json_for_logging(json))
+            retry_after = None
+            # None until the attempt has an outcome
+            failed = None
+            try:
+                r = self._hedged_post(url, params, json)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                failed = True
+                error = e
+            except requests.exceptions.RequestException as e:
+                failed = True
+                raise McxNetworkError(url, json=self._sanitize_json_for_logging(json)) from e
+            else:
+                failed = r.status_code in policy.RETRY_STATUSES
+                if not failed:
+                    return r
+                error = requests.exceptions.HTTPError("{} Server Error for url: {}".format(r.status_code, url), response=r)
+                retry_after = parse_retry_after(r.headers.get('Retry-After'))
+            finally:
+                self._record_attempt(breaker, failed)
+
+            if attempt >= policy.retries or not policy.budget.withdraw():
+                raise McxNetworkError(url, json=self._sanitize_json_for_logging(json)) from error
+            self.metrics.record_retry(endpoint)
+            delay = policy.backoff(attempt, retry_after)
+            logging.info("Retrying %s in %.2f seconds after %s", url, delay, error)
+            policy.sleep(delay)
+            attempt += 1
+
+    def _hedged_post(self, url, params, json):
+        """ Posts, and with a hedge_policy posts again if the first response is slow, returning the first response
+        """
+        endpoint = self._endpoint(url)
+        delay = self._hedge_delay(endpoint)
+        if delay is None:
+            return self._limited_post(url, params, json)
+
+        # both requests run on pooled daemon threads, a request that loses can't hold up this one or the exit
+        first_request = self._limiter_request()
+        first = _hedge_threads.submit(self._limited_post, url, params, json, first_request)
+        # the delay starts once the first request is sent, time spent waiting for a limiter slot isn't slowness
+        if first_request is not None:
+            first_request.held.wait()
+        done, _ = wait([first], timeout=delay)
+        if done or not self.hedge_policy.budget.withdraw():
+            return first.result()
+
+        logging.info("Hedging %s after %.2f seconds", url, delay)
+        hedge_request = self._limiter_request()
+        hedge = _hedge_threads.submit(self._limited_post, url, params, json, hedge_request)
+        limiter_requests = {first: first_request, hedge: hedge_request}
+        pending = {first, hedge}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # the first response wins, an error only if both requests fail
+            answered = [f for f in done if f.exception() is None]
+            if answered or not pending:
+                winner = (answered or list(done))[0]
+                for loser in pending:
+                    # its slot is freed now, and how slow it was says nothing more about the server
+                    if limiter_requests[loser] is not None:
+                        limiter_requests[loser].abandon()
+                # a hedge abandoned while it waited for a slot is never sent
+                if hedge_request is None or hedge_request.held.is_set():
+                    self.metrics.record_hedge(endpoint, won=winner is hedge)
+                return winner.result()
+
+    def _limiter_request(self):
+        return self.limiter.request() if self.limiter is not None else None
+
+    def _limited_post(self, url, params, json, request=None):
+        # request is the limiter request to hold the slot with, so that it can be abandoned
+        endpoint = self._endpoint(url)
+        if self.limiter is None:
+            return self._timed_post(endpoint, url, params, json)
+
+        queued = time.perf_counter()
+        with self.limiter.slot(request) as request:
+            self.metrics.observe_queue_wait(endpoint, time.perf_counter() - queued)
+            r = self._timed_post(endpoint, url, params, json)
+            request.failed = r.status_code in self.retry_policy.RETRY_STATUSES
+
+        return r
+
+    def _timed_post(self, endpoint, url, params, json):
+        # only the request itself is timed, time spent waiting for a limiter slot is the queue wait
+        start = time.perf_counter()
+        try:
+            r = self.session.post(url, params=params, json=json, timeout=self.TIMEOUT)
+        except requests.exceptions.RequestException:
+            self.metrics.observe_request(endpoint, time.perf_counter() - start)
+            raise
+        self.metrics.observe_request(endpoint, time.perf_counter() - start, len(r.content), r.status_code)
+
+        return r
+
+    def _authenticate(self):
         url = self._url("authenticate")
-        payload = {'userName': self.user, self.PASSWORD_KEY: self.password, 'companyName': self.company}
-        json = self._post(url, json=payload)
-        result = json["AuthenticateResult"]
-        if "token" in result:
-            self.token = result["token"]
+        json = self._send(url, None, self._auth_payload(), None)
+        self._parse_auth(json)
+
+        return self.token
 
-    def get_case_inbox(self):
+    def auth(self):
+        """ Authenticates the user, reusing a token from the token_manager if it has one
+        """
+        self.token = self.token_manager.token(self._token_key, self._authenticate)
+
+    def get_case_inbox(self, window=1):
         """ Fetches active cases assigned to the user
+
+        With a window greater than 1, up to window pages are requested concurrently ahead of the page being parsed.
+        Pages are still parsed in order and fetching stops at the first short or empty page.
         """
-        case_ids = []
-        fieldnames = []
-        cases = []
+        inbox = InboxBuilder()
         url = self._url("getMobileCaseInboxItems")
-        # Fetches 50 at a time up to a maximum of 100,000 cases
-        for p in range(0, self.PAGES):
-            start_count = len(case_ids)
-            payload = {'startPage': p, 'pageSize': self.PAGE_SIZE}
-            print("Fetching {} {} case_ids from inbox".format(ordinal(p + 1), self.PAGE_SIZE))
-            json = self._post(url, json=payload)
-            self.parse_case_inbox(json, case_ids, fieldnames, cases)
-            if len(case_ids) == start_count:
-                break
-
-        fieldnames.sort()
-        return Inbox(ids=case_ids, fieldnames=fieldnames, cases=cases)
-
-    def parse_case_inbox(self, json, case_ids, fieldnames, cases):
-        rows = json["GetMobileCaseInboxItemsResult"]["caseMobileInboxData"]["Rows"]
-        try:
-            for row in rows:
-                case = {}
-                case_id = None
-                row["Inbox Owner"] = self.user
-                for key, val in row.items():
-                    # special case for the nested list of n columns
-                    if key == "Columns":
-                        for column in val:
-                            column_name = column["ColumnName"]
-                            if column_name not in fieldnames:
-                                fieldnames.append(column_name)
-                            case[column_name] = column["ColumnValue"]
-                    else:
-                        if key not in fieldnames:
-                            fieldnames.append(key)
-                        if key == "CaseId":
-                            case_id = val
-                        case[key] = val
-                if case_id not in case_ids:
-                    # Dedupes the cases in case the same case_id is exported multiple times because of paging
-                    case_ids.append(case_id)
-                    cases.append(case)
-        except Exception as e:
-            raise McxParsingError(json, "Unable to parse inbox") from e
-
-    def get_case(self, case_id):
+        pages = iter(range(0, self.PAGES))
+        # Fetches 500 at a time up to a maximum of 99,500 cases
+        with ThreadPoolExecutor(max_workers=window) as executor:
+            in_flight = deque(executor.submit(self._post, url, json=self._inbox_payload(p), raw=True) for p in islice(pages, window))
+            try:
+                while in_flight:
+                    body = in_flight.popleft().result()
+                    start_count = len(inbox)
+                    row_count = self.parse_case_inbox_body(body, inbox)
+                    if self._is_last_inbox_page(row_count, len(inbox) - start_count, window):
+                        break
+                    for p in islice(pages, 1):
+                        in_flight.append(executor.submit(self._post, url, json=self._inbox_payload(p), raw=True))
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+        return inbox.build()
+
+    def get_case(self, case_id, marker=None):
         """ Fetches detailed information about a case
+
+        With a case_store, a case requested with the same change marker it was stored with is read from the store
+        instead of the network. With a SingleFlight, concurrent requests for a case from any of the McxApis sharing it
+        share one fetch and one Case.
         """
-        url = self._url("getCaseView")
-        payload = {'caseId': case_id}
-        json = self._post(url, json=payload)
-        try:
-            case = Case(json["GetCaseViewResult"])
-        except Exception as e:
-            raise McxParsingError(json, "Unable to parse case {}".format(case_id)) from e
+        if self.single_flight is not None:
+            return self.single_flight.do(case_id, self._get_case, case_id, marker)
 
-        return case
+        return self._get_case(case_id, marker)
+
+    def _get_case(self, case_id, marker):
+        return self._build_case(self.get_case_view(case_id, marker), case_id)
+
+    def get_case_view(self, case_id, marker=None, raw=False):
+        """ Fetches the getCaseView response for a case without parsing it, see get_case
+
+        With raw the response's undecoded JSON body is returned, as bytes or str, so that it can be decoded elsewhere,
+        e.g. in a CaseParser's worker process.
+        """
+        json = self._stored_case(case_id, marker, raw)
+        if json is None:
+            url = self._url("getCaseView")
+            payload = {'caseId': case_id}
+            json = self._post(url, json=payload, raw=raw)
+            self._store_case(case_id, marker, json)
+        self._record_case_view(case_id, json, raw)
+
+        return json
+
+
+def build_case(json, case_id, item_definitions=None, fields=None):
+    """ Builds a Case from a getCaseView response, raises McxParsingError if it can't be parsed
+    """
+    try:
+        return Case(json["GetCaseViewResult"], item_definitions, fields)
+    except Exception as e:
+        raise McxParsingError(json, "Unable to parse case {}".format(case_id)) from e
+
+
+class CaseFields:
+    """ The columns of Case.dict to export, a Case built with them only parses the parts of its case view they need
+
+    Columns are named as in Case.dict. An item's column is its text and only that item is parsed, Status and Priority
+    parse the status and priority items. "Activity Notes" selects every Activity Note column and "Source Responses"
+    every source response column. Case ID is always exported.
+    """
+    CASE_ID = "Case ID"
+    STATUS = "Status"
+    PRIORITY = "Priority"
+    ACTIVITY_NOTE = "Activity Note {}"
+    ACTIVITY_NOTES = "Activity Notes"
+    SOURCE_RESPONSES = "Source Responses"
+
+    def __init__(self, columns):
+        self.columns = frozenset(columns) | {self.CASE_ID}
+        self.all_activity_notes = self.ACTIVITY_NOTES in self.columns
+        self.all_source_responses = self.SOURCE_RESPONSES in self.columns
+        self.activity_notes = self.all_activity_notes or any(c.startswith(self.ACTIVITY_NOTE.format("")) for c in self.columns)
+
+    @classmethod
+    def parse(cls, text):
+        """ Returns the CaseFields of a comma separated list of columns
+        """
+        return cls(column.strip() for column in text.split(",") if column.strip())
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def wants_item(self, values):
+        case_question_type_id = values["CaseQuestionTypeId"]
+        return (values["CaseItemText"] in self.columns
+                or (case_question_type_id == Item.STATUS and self.STATUS in self.columns)
+                or (case_question_type_id == Item.PRIORITY and self.PRIORITY in self.columns))
+
+    def wants_source_response(self, values):
+        return (self.all_source_responses
+                or (values["Value"]["QuestionText"] or str(values["Key"])) in self.columns)
 
 
 class Case:
     """ A Case
+
+    With an ItemDefinitionCache the definitions of its items are shared with the other cases of its survey. With
+    CaseFields only the items, activity notes and source responses that dict returns are parsed.
     """
 
-    def __init__(self, case_view):
+    def __init__(self, case_view, item_definitions=None, fields=None):
         values = case_view["viewValues"]
         self.case_id = values["CaseId"]
         self.alert_name = values["AlertName"]
@@ -177,18 +592,23 @@ class Case:
         self.respondent_id = values["RespondentId"]
         self.survey_id = values["SurveyId"]
         self.survey_name = values["SurveyName"]
+        self.fields = fields
         self.status = ""
         self.priority = ""
         self.activity_notes = []
         self.items = []
         self.source_responses = []
+        self._items_by_id = {}
+        self._items_by_type = {}
 
         items = case_view["caseView"]["CaseViewItems"]
-        self._parse_items(items)
+        self._parse_items(items, item_definitions)
 
+        # answers to items that weren't parsed are skipped
         self._parse_item_answers(values["ItemAnswers"])
         self._parse_root_cause_answers(values["CaseRootCauseAnswers"])
-        self._parse_activity_notes(values["ActivityNotes"])
+        if fields is None or fields.activity_notes:
+            self._parse_activity_notes(values["ActivityNotes"])
         self._parse_source_responses(values["SourceResponses"])
         self.status = self._lookup_item_dropdown_value(Item.STATUS, self.status_id)
         self.priority = self._lookup_item_dropdown_value(Item.PRIORITY, self.priority_id)
@@ -233,18 +653,22 @@ class Case:
                 COL_RESPONDEND_ID: self.respondent_id,
                 COL_SURVEY_ID: self.survey_id,
                 COL_SURVEY_NAME: self.survey_name}
+        fields = self.fields
+        if fields is not None:
+            case = {column: value for column, value in case.items() if column in fields}
 
         for item in self.items:
-            if item.answer or item.root_cause_answers:
+            if (item.answer or item.root_cause_answers) and (fields is None or item.case_item_text in fields):
                 case[item.case_item_text] = item.display_answer
 
         # Activity notes are exported one per column
         i = 1
         COL_ACTIVITY_NOTES = "Activity Note {}"
         for activity_note in self.activity_notes:
-            case[COL_ACTIVITY_NOTES.format(i)] = "{} @ {}: {}".format(activity_note.full_name,
-                                                                      parse_date(activity_note.date),
-                                                                      activity_note.note)
+            column = COL_ACTIVITY_NOTES.format(i)
+            if fields is None or fields.all_activity_notes or column in fields:
+                case[column] = "{} @ {}: {}".format(activity_note.full_name, parse_date(activity_note.date),
+                                                    activity_note.note)
             i += 1
 
         for source_response in self.source_responses:
@@ -265,10 +689,15 @@ class Case:
 
         return None
 
-    def _parse_items(self, items):
+    def _parse_items(self, items, item_definitions=None):
         for item_dict in items:
-            item = Item(item_dict)
+            if self.fields is not None and not self.fields.wants_item(item_dict):
+                continue
+            item = Item(item_dict, item_definitions.get(self.survey_id, item_dict) if item_definitions is not None else None)
             self.items.append(item)
+            # keep the first item for an id or type, like the linear scan these indexes replace
+            self._items_by_id.setdefault(item.case_item_id, item)
+            self._items_by_type.setdefault(item.case_question_type_id, item)
 
     def _parse_activity_notes(self, activity_notes):
         for note_dict in activity_notes:
@@ -281,23 +710,59 @@ class Case:
                 item.add_answer(item_answer_dict)
 
     def _parse_root_cause_answers(self, root_cause_answers):
+        answered_items = {}
         for root_cause_answer_dict in root_cause_answers:
             item = self._find_item(root_cause_answer_dict["CaseItemId"])
             if item:
-                item.add_root_cause_answer(root_cause_answer_dict)
+                item._add_root_cause_answer(root_cause_answer_dict)
+                answered_items[id(item)] = item
+
+        # draw each answered item once rather than after every answer
+        for item in answered_items.values():
+            item.display_answer = item._draw_root_cause_answers()
 
     def _parse_source_responses(self, source_responses):
         for source_response_dict in source_responses:
-            self.source_responses.append(SourceResponse(source_response_dict))
+            if self.fields is None or self.fields.wants_source_response(source_response_dict):
+                self.source_responses.append(SourceResponse(source_response_dict))
 
     def _find_item(self, case_item_id):
-        return next((x for x in self.items if x.case_item_id == case_item_id), None)
+        return self._items_by_id.get(case_item_id)
 
     def _find_item_by_type(self, case_question_type_id):
-        return next((x for x in self.items if x.case_question_type_id == case_question_type_id), None)
+        return self._items_by_type.get(case_question_type_id)
 
 
-class Item:
+class ItemDefinitionCache:
+    """ Item definitions shared by the cases of a survey, safe to share between threads and McxApi instances
+
+    Definitions are keyed by survey and case item, along with the item's type, text and number of dropdown and root
+    cause values so that an item that changes during an export gets a new definition.
+    """
+
+    def __init__(self):
+        self._definitions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._definitions)
+
+    def get(self, survey_id, values):
+        key = (survey_id, values["CaseItemId"], values["CaseQuestionTypeId"], values["CaseItemText"],
+               len(values["DropdownValues"]), len(values["RootCauseValues"]))
+        definition = self._definitions.get(key)
+        if definition is None:
+            # parsed outside the lock, if two threads race the first definition stored wins
+            definition = ItemDefinition(values)
+            with self._lock:
+                definition = self._definitions.setdefault(key, definition)
+
+        return definition
+
+
+class ItemDefinition:
+    """ The parts of an item that are the same for every case: its text, dropdown values and root cause tree
+    """
 
     def __init__(self, values):
         self.case_item_id = values["CaseItemId"]
@@ -305,14 +770,77 @@ class Item:
         self.case_item_text = values["CaseItemText"]
         self.dropdown_values = []
         self.root_cause_values = []
-        self.root_cause_answers = []
-        self.answer = None
-        self.display_answer = ""
+        self._dropdowns_by_id = {}
+        self._root_causes_by_tree_id = {}
 
         self._parse_dropdown_values(values["DropdownValues"])
         self._parse_root_cause_values(values["RootCauseValues"])
         self._build_root_cause_tree()
 
+    def _draw_root_cause_tree(self):
+        roots = [r for r in self.root_cause_values if r.is_root is True]
+        tree = ""
+        for root in roots:
+            for pre, _, node in RenderTree(root):
+                tree = "{}{}{}\n".format(tree, pre, node.root_cause_name)
+
+        return tree
+
+    def _parse_dropdown_values(self, dropdown_values):
+        for dropdown_dict in dropdown_values:
+            dropdown = Dropdown(dropdown_dict)
+            self.dropdown_values.append(dropdown)
+            self._dropdowns_by_id.setdefault(dropdown.id, dropdown)
+
+    def _parse_root_cause_values(self, root_cause_values):
+        for root_cause_dict in root_cause_values:
+            root_cause = RootCause(root_cause_dict)
+            self.root_cause_values.append(root_cause)
+            self._root_causes_by_tree_id.setdefault(root_cause.tree_id, root_cause)
+
+    def _build_root_cause_tree(self):
+        # assign parents
+        for root_cause in self.root_cause_values:
+            if root_cause.parent_tree_id != "#":
+                root_cause.parent = self._find_root_cause(root_cause.parent_tree_id)
+
+    def _find_root_cause(self, tree_id):
+        return self._root_causes_by_tree_id.get(tree_id)
+
+    def _find_dropdown(self, value):
+        return self._dropdowns_by_id.get(value)
+
+
+class Item:
+    """ An item of a case, its answers are the case's own and its definition may be shared with other cases
+    """
+
+    def __init__(self, values, definition=None):
+        self.definition = definition or ItemDefinition(values)
+        self.root_cause_answers = []
+        self.answer = None
+        self.display_answer = ""
+
+    @property
+    def case_item_id(self):
+        return self.definition.case_item_id
+
+    @property
+    def case_question_type_id(self):
+        return self.definition.case_question_type_id
+
+    @property
+    def case_item_text(self):
+        return self.definition.case_item_text
+
+    @property
+    def dropdown_values(self):
+        return self.definition.dropdown_values
+
+    @property
+    def root_cause_values(self):
+        return self.definition.root_cause_values
+
     def __str__(self):
         dropdowns = ", ".join([str(d) for d in self.dropdown_values])
         root_causes = self._draw_root_cause_tree()
@@ -332,42 +860,20 @@ answer:\n{}""".format(self.case_item_id,
                       self.answer)
 
     def _draw_root_cause_tree(self):
-        roots = [r for r in self.root_cause_values if r.is_root is True]
-        tree = ""
-        for root in roots:
-            for pre, _, node in RenderTree(root):
-                tree = "{}{}{}\n".format(tree, pre, node.root_cause_name)
-
-        return tree
+        return self.definition._draw_root_cause_tree()
 
     def _draw_root_cause_answers(self):
         answers = ""
         leaf_answers = [a for a in self.root_cause_answers if a.root_cause.is_leaf]
         for leaf_answer in leaf_answers:
             leaf = leaf_answer.root_cause.root_cause_name
-            ancestors = " > ".join([c.root_cause_name for c in leaf_answer.root_cause.anchestors])
+            ancestors = " > ".join([c.root_cause_name for c in leaf_answer.root_cause.ancestors])
             answers = "{}{} > {}\n".format(answers, ancestors, leaf)
 
         return answers
 
-    def _parse_dropdown_values(self, dropdown_values):
-        for dropdown_dict in dropdown_values:
-            dropdown = Dropdown(dropdown_dict)
-            self.dropdown_values.append(dropdown)
-
-    def _parse_root_cause_values(self, root_cause_values):
-        for root_cause_dict in root_cause_values:
-            root_cause = RootCause(root_cause_dict)
-            self.root_cause_values.append(root_cause)
-
-    def _build_root_cause_tree(self):
-        # assign parents
-        for root_cause in self.root_cause_values:
-            if root_cause.parent_tree_id != "#":
-                root_cause.parent = self._find_root_cause(root_cause.parent_tree_id)
-
     def _find_root_cause(self, tree_id):
-        return next((r for r in self.root_cause_values if r.tree_id == tree_id), None)
+        return self.definition._find_root_cause(tree_id)
 
     # case_question_type_ids
     CASE_ID = 1
@@ -395,7 +901,7 @@ answer:\n{}""".format(self.case_item_id,
     NUMERIC = 27
 
     def _find_dropdown(self, value):
-        return next((x for x in self.dropdown_values if x.id == value), None)
+        return self.definition._find_dropdown(value)
 
     def add_answer(self, values):
         self.answer = Answer(values)
@@ -411,10 +917,13 @@ answer:\n{}""".format(self.case_item_id,
                 self.display_answer = dropdown.text
 
     def add_root_cause_answer(self, values):
+        self._add_root_cause_answer(values)
+        self.display_answer = self._draw_root_cause_answers()
+
+    def _add_root_cause_answer(self, values):
         answer = RootCauseAnswer(values)
         answer.root_cause = self._find_root_cause(answer.tree_id)
         self.root_cause_answers.append(answer)
-        self.display_answer = self._draw_root_cause_answers()
 
 
 class ActivityNote:
@@ -0,0 +1,159 @@
+import gzip
+import json
+import tempfile
+import threading
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from .api import McxApiBase, InboxBuilder
+from .exceptions import McxReplayError
+
+INBOX_ENDPOINT = "getMobileCaseInboxItems"
+CASE_ENDPOINT = "getCaseView"
+# the endpoint of the line that starts each run's records
+RUN_MARKER = "run"
+
+
+class ResponseArchive:
+    """ An append-only gzip JSON lines archive of raw inbox pages and case views
+
+    Each line holds the endpoint, the user it was fetched for, the case id for case views and the response exactly as
+    the API returned it. Opening an existing archive appends to it, gzip readers see the appended members as one
+    stream, and every opening starts with a run marker line so that a replay can tell the runs apart. The archive is
+    safe to share between threads and McxApi instances.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'at', encoding='utf8')
+        self._file.write(json.dumps({"endpoint": RUN_MARKER, "started_at": datetime.now(timezone.utc).isoformat()}) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def record(self, endpoint, user, response, case_id=None):
+        line = json.dumps({"endpoint": endpoint, "user": user, "case_id": case_id, "response": response})
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ArchiveReplay:
+    """ The responses in a ResponseArchive indexed for replay
+
+    The archive is decompressed once into a temporary file, only the offset of each response is kept in memory and
+    responses are read back as they are replayed, so replaying doesn't need memory for the whole archive. Each user's
+    inbox is replayed from the last run that recorded it, with its pages in the order they were recorded, so an archive
+    recorded more than once doesn't replay the union of its runs' inboxes. A case recorded more than once is replayed
+    from its last recording. The replay is safe to share between threads, close() it to delete the temporary file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._users = OrderedDict()
+        # (offset, length) of the records in _file, and for inbox pages the run they were recorded in
+        self._inbox_pages = {}
+        self._cases = {}
+        self._lock = threading.Lock()
+        self._file = tempfile.TemporaryFile()
+        # archives recorded before run markers are one run
+        run = 0
+        with gzip.open(path, 'rb') as archive:
+            for line in archive:
+                record = json.loads(line)
+                if record["endpoint"] == RUN_MARKER:
+                    run += 1
+                    continue
+                self._users[record["user"]] = None
+                if record["endpoint"] == INBOX_ENDPOINT:
+                    pages_run, pages = self._inbox_pages.get(record["user"], (None, None))
+                    if pages_run != run:
+                        # a later run's inbox replaces the earlier one
+                        pages = []
+                        self._inbox_pages[record["user"]] = (run, pages)
+                    pages.append(self._append(line))
+                elif record["endpoint"] == CASE_ENDPOINT:
+                    self._cases[record["case_id"]] = self._append(line)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _append(self, line):
+        offset = self._file.tell()
+        self._file.write(line)
+        return offset, len(line)
+
+    def _read(self, location):
+        offset, length = location
+        with self._lock:
+            self._file.seek(offset)
+            line = self._file.read(length)
+
+        return json.loads(line)["response"]
+
+    @property
+    def users(self):
+        """ The users responses were recorded for, in the order they were first recorded
+        """
+        return list(self._users)
+
+    def inbox_pages(self, user):
+        _, pages = self._inbox_pages.get(user, (None, []))
+        for location in pages:
+            yield self._read(location)
+
+    def case(self, case_id):
+        location = self._cases.get(case_id)
+        if location is None:
+            return None
+
+        return self._read(location)
+
+    def close(self):
+        self._file.close()
+
+
+class ReplayMcxApi(McxApiBase):
+    """ Serves the inbox and cases recorded in an archive through the same parsing as McxApi, without any network access
+    """
+
+    def __init__(self, replay, instance, company, user, password=None, case_store=None, metrics=None, item_definitions=None,
+                 fields=None):
+        super().__init__(instance, company, user, password, case_store, metrics=metrics, item_definitions=item_definitions,
+                         fields=fields)
+        self.replay = replay
+
+    def auth(self):
+        pass
+
+    def get_case_inbox(self, window=1):
+        """ Parses the user's recorded inbox pages, window is ignored
+        """
+        inbox = InboxBuilder()
+        for page in self.replay.inbox_pages(self.user):
+            self.parse_case_inbox(page, inbox)
+
+        return inbox.build()
+
+    def get_case(self, case_id, marker=None):
+        return self._build_case(self.get_case_view(case_id, marker), case_id)
+
+    def get_case_view(self, case_id, marker=None, raw=False):
+        """ Returns the recorded getCaseView response for a case, always decoded as the archive holds it decoded
+        """
+        case_view = self.replay.case(case_id)
+        if case_view is None:
+            raise McxReplayError("Case {} is not in {}".format(case_id, self.replay.path))
+
+        return case_view
@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+class TokenManager:
+    """ Shares authentication tokens between McxApi instances and threads
+
+    Tokens are cached per (instance, company, user) key and, with a cache_file, across runs. The cache file is only
+    readable by the current user. When a token expires, refresh() re-authenticates exactly once: other threads that
+    hit the same expired token wait for that refresh and then use the new token.
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._key_locks = {}
+        self._tokens = self._load()
+
+    @staticmethod
+    def key(instance, company, user):
+        return "{}|{}|{}".format(instance, company, user)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _load(self):
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r') as cache:
+                return json.load(cache)
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable token cache {}: {}".format(self.cache_file, e))
+            return {}
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+        # one save at a time, so an older set of tokens never replaces a newer one
+        with self._save_lock:
+            with self._lock:
+                tokens = dict(self._tokens)
+            # mkstemp creates the file readable only by the current user
+            fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(self.cache_file) or None, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w') as cache:
+                    json.dump(tokens, cache)
+                os.replace(temp_file, self.cache_file)
+            except OSError as e:
+                logging.warning("Unable to write token cache {}: {}".format(self.cache_file, e))
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+
+    def get(self, key):
+        with self._lock:
+            return self._tokens.get(key)
+
+    def put(self, key, token):
+        with self._lock:
+            self._tokens[key] = token
+        self._save()
+
+    def token(self, key, authenticate):
+        """ Returns the cached token for key, calling authenticate() for a new one if there isn't one
+        """
+        with self._key_lock(key):
+            token = self.get(key)
+            if token is None:
+                token = authenticate()
+                self.put(key, token)
+
+            return token
+
+    def refresh(self, key, stale_token, authenticate):
+        """ Replaces stale_token with a new one from authenticate()
+
+        If another thread has already replaced stale_token its new token is returned without authenticating again.
+        """
+        with self._key_lock(key):
+            token = self.get(key)
+            if token is None or token == stale_token:
+                logging.info("Refreshing token for {}".format(key))
+                token = authenticate()
+                self.put(key, token)
+
+            return token
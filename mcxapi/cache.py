@@ -0,0 +1,75 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# Inbox columns that differ between users for the same case and so are left out of the change marker
+MARKER_EXCLUDED_COLUMNS = ("Inbox Owner",)
+
+
+def row_marker(row):
+    """ Returns a change marker for an inbox row
+
+    The marker is a hash of every column of the row, so it changes whenever the case's modified date, status or any
+    other inbox column changes.
+    """
+    values = {k: v for k, v in row.items() if k not in MARKER_EXCLUDED_COLUMNS}
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+
+class CaseStore:
+    """ A local SQLite store of raw GetCaseViewResult payloads keyed by CaseId
+
+    Each payload is saved with the change marker of the inbox row it was fetched for. A case is only served from
+    the store when the marker it is requested with matches the stored one. The store is safe to share between
+    threads and McxApi instances.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS cases ("
+                                     "case_id INTEGER PRIMARY KEY, "
+                                     "marker TEXT, "
+                                     "payload TEXT NOT NULL, "
+                                     "fetched_at REAL NOT NULL)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get(self, case_id, marker, raw=False):
+        """ Returns the stored payload for case_id, or None if it is missing or was stored with a different marker
+
+        With raw the payload's JSON text is returned undecoded.
+        """
+        if marker is None:
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT marker, payload FROM cases WHERE case_id = ?", (case_id,)).fetchone()
+        if row is None or row[0] != marker:
+            return None
+
+        return row[1] if raw else json.loads(row[1])
+
+    def put(self, case_id, marker, payload):
+        """ Stores a payload, either decoded or as the undecoded JSON body of the response
+        """
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf8')
+        elif not isinstance(payload, str):
+            payload = json.dumps(payload)
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO cases (case_id, marker, payload, fetched_at) VALUES (?, ?, ?, ?)",
+                                     (case_id, marker, payload, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
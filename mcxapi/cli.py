@@ -1,19 +1,38 @@
 import sys
 import click
 import csv
-import xlsxwriter
 import logging
-import json
 import time
+import asyncio
+import queue
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from collections import namedtuple
+from contextlib import AsyncExitStack, contextmanager
+from logging.handlers import QueueHandler, QueueListener
 
 from .exceptions import McxError
-from .api import McxApi
+from .api import McxApi, CaseFields, ItemDefinitionCache
+from .aio import AsyncMcxApi
+from .auth import TokenManager
+from .concurrency import AdaptiveLimiter, SingleFlight
+from .resilience import HedgePolicy, RetryPolicy
+from .archive import ArchiveReplay, ReplayMcxApi, ResponseArchive
+from .cache import CaseStore, row_marker
+from .metrics import Metrics
+from .journal import CaseJournal
+from .pipeline import CaseParser, CasePipeline
+from .snapshot import InboxSnapshot, CHANGE_COLUMN, change_rows
+from .writers import (FORMAT_EXCEL, FORMAT_CSV, FORMAT_JSON, FORMAT_JSONL, FORMAT_PARQUET, FORMAT_ARROW, FORMAT_SQLITE, COLUMNAR_FORMATS,
+                      open_stream_writer, write_to_columnar, write_to_csv, write_to_excel, write_to_json, write_to_jsonl)
 
 
 def configure_logging():
+    """Logs through a queue so worker threads never wait on the log files, returns a function that stops logging
+
+    The listener's thread does all of the file and stderr I/O. Stopping removes the queue's handler from the root
+    logger, flushes the remaining records and closes the log files.
+    """
     formatter = logging.Formatter("mcx: %(asctime)s - %(levelname)s - %(message)s")
     logger = logging.getLogger()
     logger.level = logging.INFO
@@ -21,27 +40,42 @@ def configure_logging():
     info_file_handler = logging.FileHandler("mcx_info.log")
     info_file_handler.setFormatter(formatter)
     info_file_handler.setLevel(logging.INFO)
-    logger.addHandler(info_file_handler)
 
     error_file_handler = logging.FileHandler("mcx_error.log")
     error_file_handler.setFormatter(formatter)
     error_file_handler.setLevel(logging.ERROR)
-    logger.addHandler(error_file_handler)
 
     error_stream_handler = logging.StreamHandler(sys.stderr)
     error_stream_handler.setFormatter(formatter)
     error_stream_handler.setLevel(logging.ERROR)
-    logger.addHandler(error_stream_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, info_file_handler, error_file_handler, error_stream_handler, respect_handler_level=True)
+    listener.start()
+
+    def stop():
+        logger.removeHandler(queue_handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+    return stop
 
 
 # A tuple containing a list of unique, sorted fieldnames and a list of rows (dicts), that contains the data
 ColumnarFormat = namedtuple('ColumnarFormat', 'fieldnames rows')
 User = namedtuple('User', 'user password')
+# An authenticated api for a user, inbox is None when explicit case_ids are exported
+Account = namedtuple('Account', 'user api inbox')
+# A case to fetch for an account, marker is the change marker of the case's inbox row if there is one
+CaseFetch = namedtuple('CaseFetch', 'account case_id marker')
 
-FORMAT_EXCEL = 'xlsx'
-FORMAT_CSV = 'csv'
-FORMAT_JSON = 'json'
-WORKERS = 50 # don't go above 50 or it will exhaust the urllib connection pool in requests which is set to 50
+WORKERS = 50 # initial number of concurrent requests, adjusted by the AdaptiveLimiter between 1 and --max-workers
+MAX_WORKERS = 200
+ASYNC_WORKERS = 200 # concurrent requests on the single asyncio event loop used by --async
+ACCOUNT_WORKERS = 8 # accounts authenticating and fetching their inbox at the same time
 
 class McxCli():
     """ Context object for command line arguments
@@ -57,7 +91,34 @@ class McxCli():
         self.password = None
         self.config = {}
         self.debug = False
+        self.quiet = False
         self.format = FORMAT_EXCEL
+        self.page_window = 1
+        self.constant_memory = False
+        self.accounts_in_flight = ACCOUNT_WORKERS
+        self.case_store = None
+        self.snapshot = None
+        # a CaseParser when cases are parsed in worker processes
+        self.parser = None
+        self.journal = None
+        # the TokenManager of --token-cache and the AdaptiveLimiter bounded by --max-workers, set by cli()
+        self.token_manager = None
+        self.limiter = None
+        # one retry budget and set of circuit breakers for every account and worker
+        self.retry_policy = RetryPolicy()
+        # a HedgePolicy when slow case requests are hedged
+        self.hedge_policy = None
+        self.metrics = Metrics()
+        # item definitions parsed once per survey for every account
+        self.item_definitions = ItemDefinitionCache()
+        # the CaseFields of --fields, None exports every column
+        self.fields = None
+        # concurrent fetches of the same case by any account share one request
+        self.single_flight = SingleFlight()
+        self.metrics_out = None
+        self.base_url = None
+        self.archive = None
+        self.replay = None
 
     def set_config(self, key, value):
         self.config[key] = value
@@ -65,6 +126,9 @@ class McxCli():
             click.echo('  config[%s] = %s' % (key, value), file=sys.stderr)
 
     def validate(self):
+        if self.replay and self.credentials is None and self.user is None:
+            # every user in the archive is exported
+            return
         if self.credentials is None and (self.user is None or self.password is None):
             raise click.UsageError("If a --credentials file is not being used --user and --password are required.")
         if self.credentials and (self.user or self.password):
@@ -83,106 +147,434 @@ pass_mcxcli = click.make_pass_decorator(McxCli)
 @click.option('--credentials', '-m', help="Use a file to loop over multiple accounts. File should be one user per line and tab separated, e.g., username<tab>password", type=click.Path(exists=True, readable=True, resolve_path=True, dir_okay=False, file_okay=True))
 @click.option('--user', '-u', envvar='MCX_USERNAME', help='Usename.',)
 @click.option('--password', '-p', envvar='MCX_PASSWORD', help='Password.',)
-@click.option('--format', '-f', help='Output file format', type=click.Choice([FORMAT_EXCEL, FORMAT_CSV, FORMAT_JSON]), default=FORMAT_EXCEL)
+@click.option('--format', '-f', help='Output file format, parquet and arrow (Arrow IPC) require pyarrow. sqlite exports to normalised tables, updating an existing database in place', type=click.Choice([FORMAT_EXCEL, FORMAT_CSV, FORMAT_JSON, FORMAT_JSONL, FORMAT_PARQUET, FORMAT_ARROW, FORMAT_SQLITE]), default=FORMAT_EXCEL)
+@click.option('--page-window', '-w', help='Number of inbox pages to fetch concurrently, stops at the first short page', type=click.IntRange(1, McxApi.PAGES), default=1)
+@click.option('--constant-memory', is_flag=True, help='Stream xlsx rows to disk for large exports, splitting into extra worksheets at the Excel row limit')
+@click.option('--accounts-in-flight', help='Number of --credentials accounts to log in and fetch inboxes for concurrently', type=click.IntRange(1), default=ACCOUNT_WORKERS)
+@click.option('--token-cache', type=click.Path(dir_okay=False, writable=True, resolve_path=True), help='File to reuse authentication tokens from across runs, created readable only by you')
+@click.option('--max-workers', help='Upper bound for the adaptive number of concurrent requests', type=click.IntRange(1), default=MAX_WORKERS)
+@click.option('--metrics-out', type=click.Path(dir_okay=False, writable=True, resolve_path=True), help='Write request latency, retry and throughput metrics to <path>.json and a Prometheus textfile <path>.prom')
+@click.option('--base-url', envvar='MCX_BASE_URL', help='Root URL of CaseManagement.svc to use instead of https://<instance>.mcxplatform.de/CaseManagement.svc, e.g. a local test server')
+@click.option('--record', type=click.Path(dir_okay=False, writable=True, resolve_path=True), help='Append the raw inbox and case responses to a gzip JSON lines archive that can be exported again with --replay, which replays each user\'s inbox from the last run that recorded it')
+@click.option('--replay', type=click.Path(exists=True, dir_okay=False, readable=True, resolve_path=True), help='Export from a --record archive instead of the API, without network access. Without --user or --credentials every user in the archive is exported')
+@click.option('--quiet', '-q', is_flag=True, help='Skip the progress line for every case')
 @click.option('--debug', '-d', is_flag=True, help='Output stack trace for any errors')
 @click.version_option('1.0')
 @click.pass_context
-def cli(ctx, instance, company, credentials, user, password, format, debug):
+def cli(ctx, instance, company, credentials, user, password, format, page_window, constant_memory, accounts_in_flight, token_cache, max_workers, metrics_out,
+        base_url, record, replay, quiet, debug):
     """Command line entry point
     """
-    configure_logging()
+    ctx.call_on_close(configure_logging())
     ctx.obj = McxCli(instance, company)
     ctx.obj.credentials = credentials
     ctx.obj.user = user
     ctx.obj.password = password
     ctx.obj.format = format
+    ctx.obj.page_window = page_window
+    ctx.obj.constant_memory = constant_memory
+    ctx.obj.accounts_in_flight = accounts_in_flight
+    ctx.obj.token_manager = TokenManager(token_cache)
+    ctx.obj.limiter = AdaptiveLimiter(initial_limit=WORKERS, max_limit=max_workers)
+    ctx.obj.metrics_out = metrics_out
+    ctx.obj.base_url = base_url
+    ctx.obj.quiet = quiet
     ctx.obj.debug = debug
+    if replay:
+        ctx.obj.replay = ArchiveReplay(replay)
+        ctx.call_on_close(ctx.obj.replay.close)
 
     ctx.obj.validate()
+    if record:
+        if replay:
+            raise click.UsageError("--record and --replay can't be used together.")
+        ctx.obj.archive = ResponseArchive(record)
+        ctx.call_on_close(ctx.obj.archive.close)
 
 
 @cli.command()
 @click.argument('case_ids', nargs=-1, type=click.INT)
+@click.option('--async', 'use_async', is_flag=True, help='Fetch cases concurrently on a single thread with asyncio (requires aiohttp)')
+@click.option('--stream', is_flag=True, help='Write cases to the output file as they are fetched instead of holding them in memory')
+@click.option('--cache', type=click.Path(dir_okay=False, writable=True, resolve_path=True), help='SQLite file of previously fetched cases, only new or changed cases are fetched from the API')
+@click.option('--since-snapshot', type=click.Path(dir_okay=False, writable=True, resolve_path=True), help='Inbox snapshot file from the last run, only cases added or changed since then are exported')
+@click.option('--parse-workers', help='Parse cases in this many worker processes, leaving the fetch threads to only download them', type=click.IntRange(0), default=0)
+@click.option('--resume', is_flag=True, help='Continue an export that was interrupted or had errors from its journal, only fetching the cases it has not completed. Every export journals its progress to cases.<format>.journal, which is deleted once an export has no errors')
+@click.option('--hedge-ratio', help='Send a second request for cases that take longer than the p95 latency so far and use the first response, adding at most this fraction of extra requests, e.g. 0.05', type=click.FloatRange(0, 1), default=0)
+@click.option('--fields', help='Comma separated columns to export, e.g. "Status,Priority,Owner,Root Cause", only the parts of each case they need are parsed. "Activity Notes" and "Source Responses" select all of those columns, Case ID is always exported')
 @pass_mcxcli
-def cases(mcxcli, case_ids):
+def cases(mcxcli, case_ids, use_async, stream, cache, since_snapshot, parse_workers, resume, hedge_ratio, fields):
     """Exports detailed information about active cases assigned to users
     """
     start_time = time.time()
     file = "cases.{}".format(mcxcli.format)
     users = __users_from_options(mcxcli)
     if len(users) == 1:
-        click.echo('Exporting cases assigned to {} from {} to {}'.format(mcxcli.user, mcxcli.company, file))
+        click.echo('Exporting cases assigned to {} from {} to {}'.format(users[0].user, mcxcli.company, file))
     else:
         click.echo('Exporting cases assigned to users in {} from {} to {}'.format(mcxcli.credentials, mcxcli.company, file))
 
+    if since_snapshot:
+        if case_ids:
+            raise click.UsageError("--since-snapshot exports cases from the inbox and can't be used with case ids")
+        mcxcli.snapshot = InboxSnapshot(since_snapshot)
+    if cache:
+        mcxcli.case_store = CaseStore(cache)
+    if fields:
+        if mcxcli.format == FORMAT_SQLITE:
+            raise click.UsageError("--fields can't be used with the sqlite format, its tables hold every part of a case")
+        mcxcli.fields = CaseFields.parse(fields)
+    if hedge_ratio:
+        mcxcli.hedge_policy = HedgePolicy(max_ratio=hedge_ratio)
+    # the sqlite tables are built from Case objects rather than Case.dict, the other formats only need the rows
+    flatten = mcxcli.format != FORMAT_SQLITE
+    if parse_workers:
+        mcxcli.parser = CaseParser(parse_workers, flatten, mcxcli.metrics, mcxcli.fields)
+    # every run is journaled so that a failed or interrupted one can be resumed, the journal is removed once no case
+    # has failed
+    journal = mcxcli.journal = CaseJournal("{}.journal".format(file), resume)
+    if resume:
+        click.echo('Resuming from {}: {} cases already exported, {} failed cases to retry'.format(journal.path,
+                                                                                              len(journal.completed),
+                                                                                              len(journal.errors)))
+    try:
+        # sqlite is always streamed
+        if stream or mcxcli.format == FORMAT_SQLITE:
+            with __open_stream_writer(mcxcli, file) as writer:
+                if flatten:
+                    # the output is rewritten, starting with the cases the journal already has
+                    with mcxcli.metrics.time_write(len(journal.rows)):
+                        for _, row in journal.rows:
+                            writer.write(row)
+
+                    def on_case(case_id, case):
+                        row = __case_row(mcxcli, case)
+                        __write_case(mcxcli, writer.write, row)
+                        journal.add(case_id, row)
+                else:
+                    # the database is updated in place and already has the journal's cases, they are only journaled
+                    # once it has committed them
+                    journal.before_flush = writer.flush
+
+                    def on_case(case_id, case):
+                        __write_case(mcxcli, writer.write_case, case)
+                        journal.add(case_id)
+
+                errors = __fetch(mcxcli, users, case_ids, use_async, on_case)
+                journal.flush()
+        else:
+            rows = [row for _, row in journal.rows]
+
+            def on_case(case_id, case):
+                row = __case_row(mcxcli, case)
+                rows.append(row)
+                journal.add(case_id, row)
+
+            errors = __fetch(mcxcli, users, case_ids, use_async, on_case)
+            journal.flush()
+            output = __rows_to_columnar_format(rows)
+            __write_to_file(mcxcli, file, output.fieldnames, output.rows)
+    finally:
+        journal.close()
+        if mcxcli.parser:
+            mcxcli.parser.close()
+        if mcxcli.case_store:
+            mcxcli.case_store.close()
+
+    if not errors:
+        # nothing left to resume
+        journal.remove()
+
+    if mcxcli.snapshot:
+        # failed cases keep their previous marker so they are exported again next run
+        mcxcli.snapshot.save(exclude=errors)
+    if mcxcli.hedge_policy:
+        click.echo('Hedged {} slow case requests, {} answered first'.format(mcxcli.metrics.hedges.get("getCaseView", 0),
+                                                                           mcxcli.metrics.hedges_won.get("getCaseView", 0)))
+    if len(errors):
+        logging.error("Could not fetch case for the following case_ids (see error log for details): {}".format(errors))
+    __write_metrics(mcxcli)
+
+    end_time = time.time()
+    time_elapsed = end_time-start_time
+    click.echo('Time taken: {} seconds'.format(int(time_elapsed)))
+
+
+def __fetch(mcxcli, users, case_ids, use_async, on_case):
+    """Fetches cases and passes each one's id and case to on_case as it completes, returns the case_ids that failed
+
+    With a parser on_case is passed what the parser returns, the case's row when it flattens.
+    """
+    # a replay is read from disk, there are no requests for asyncio to overlap
+    if use_async and not mcxcli.replay:
+        return asyncio.run(__fetch_cases_async(mcxcli, users, case_ids, on_case))
+    elif mcxcli.parser:
+        return __fetch_cases_pipelined(mcxcli, users, case_ids, on_case)
+    else:
+        return __fetch_cases(mcxcli, users, case_ids, on_case)
+
+
+@contextmanager
+def __open_stream_writer(mcxcli, file):
+    """Opens a stream writer for the output format, timing its close() as part of writing
+
+    csv, xlsx, parquet and arrow rows are only written to file when the writer is closed, until then they are spilled
+    to a temporary file.
+    """
+    writer = open_stream_writer(mcxcli.format, file, mcxcli.constant_memory)
+    try:
+        yield writer
+    finally:
+        with mcxcli.metrics.time_write(0):
+            writer.close()
+
+
+def __write_case(mcxcli, write, case):
+    with mcxcli.metrics.time_write():
+        write(case)
+
+
+def __case_row(mcxcli, case):
+    # a parser that flattens has already turned the case into its row
+    return case if mcxcli.parser else case.dict
+
+
+def __case_failed(mcxcli, errors, case_id, error):
+    errors.append(case_id)
+    mcxcli.journal.add_error(case_id, error)
+    logging.error(error, exc_info=mcxcli.debug)
+
+
+def __write_metrics(mcxcli):
+    """Writes the metrics report if --metrics-out was given
+    """
+    if mcxcli.metrics_out:
+        mcxcli.metrics.set_gauge("concurrency_limit", mcxcli.limiter.limit)
+        mcxcli.metrics.set_gauge("concurrency_limit_peak", mcxcli.limiter.peak_limit)
+        mcxcli.metrics.set_gauge("case_requests_coalesced", mcxcli.single_flight.shared)
+        mcxcli.metrics.write(mcxcli.metrics_out)
+        click.echo('Metrics written to {0}.json and {0}.prom'.format(mcxcli.metrics_out))
+
+
+def __open_accounts(mcxcli, users, fetch_inbox=True):
+    """Authenticates users and fetches their inboxes concurrently, with at most accounts_in_flight accounts at a time
+    """
+    def open_account(user):
+        click.echo('Opening account {}'.format(user.user))
+        api = __init_api(mcxcli, user)
+        inbox = api.get_case_inbox(mcxcli.page_window) if fetch_inbox else None
+        return Account(user=user.user, api=api, inbox=inbox)
+
     try:
-        for user in users:
-            click.echo('Exporting cases assigned to {}'.format(user.user))
-            api = __init_api(mcxcli.instance, mcxcli.company, user.user, user.password)
-            ids = case_ids
-            if not ids:
-                ids = api.get_case_inbox().ids
-            click.echo('CaseIDs to export: {}'.format(ids))
+        with ThreadPoolExecutor(max_workers=mcxcli.accounts_in_flight) as executor:
+            return list(executor.map(open_account, users))
     except McxError as e:
         logging.error(e, exc_info=mcxcli.debug)
         raise click.Abort()
 
-    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-        click.echo('Scheduling case fetching on {} workers'.format(WORKERS))
-        future_to_case = {executor.submit(api.get_case, case_id): case_id for case_id in ids}
-        cases = []
-        errors = []
+
+def __case_fetches(mcxcli, accounts, case_ids):
+    """Returns a CaseFetch for every case to fetch across all accounts
+
+    With a snapshot only the cases that were added or changed since the snapshot are fetched. Cases a resumed journal
+    has completed are skipped. A case in several accounts' inboxes is only fetched for the first of them, explicit
+    case_ids are fetched once with the first account.
+    """
+    completed = mcxcli.journal.completed if mcxcli.journal else set()
+    snapshot = mcxcli.snapshot
+    if snapshot:
+        changes = snapshot.diff(row for account in accounts for row in account.inbox.cases)
+        wanted = {row["CaseId"] for row in changes.added + changes.changed}
+        click.echo('Inbox changes since snapshot: {} added, {} changed, {} removed'.format(len(changes.added),
+                                                                                          len(changes.changed),
+                                                                                          len(changes.removed)))
+
+    fetches = []
+    scheduled = set()
+    duplicates = 0
+    for account in accounts[:1] if case_ids else accounts:
+        if case_ids:
+            account_fetches = [CaseFetch(account=account, case_id=case_id, marker=None) for case_id in case_ids
+                               if case_id not in completed]
+        else:
+            account_fetches = [CaseFetch(account=account, case_id=row["CaseId"], marker=row_marker(row)) for row in account.inbox.cases
+                               if (not snapshot or row["CaseId"] in wanted) and row["CaseId"] not in completed]
+        unique_fetches = []
+        for fetch in account_fetches:
+            if fetch.case_id not in scheduled:
+                scheduled.add(fetch.case_id)
+                unique_fetches.append(fetch)
+        duplicates += len(account_fetches) - len(unique_fetches)
+        account_fetches = unique_fetches
+        if mcxcli.quiet:
+            click.echo('CaseIDs to export for {}: {}'.format(account.user, len(account_fetches)))
+        else:
+            click.echo('CaseIDs to export for {}: {}'.format(account.user, [f.case_id for f in account_fetches]))
+        fetches.extend(account_fetches)
+    if duplicates:
+        click.echo('Skipped {} CaseIDs already scheduled for another account'.format(duplicates))
+    mcxcli.metrics.set_gauge("duplicate_case_ids_skipped", duplicates)
+
+    return fetches
+
+
+def __fetch_cases(mcxcli, users, case_ids, on_case):
+    """Fetches cases for all accounts on one shared pool of worker threads
+    """
+    accounts = __open_accounts(mcxcli, users, fetch_inbox=not case_ids)
+    fetches = __case_fetches(mcxcli, accounts, case_ids)
+
+    errors = []
+    limiter = mcxcli.limiter
+    # the limiter decides how many of the workers have a request in flight
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+        click.echo('Scheduling case fetching for {} accounts on up to {} workers, starting with {}'.format(len(accounts),
+                                                                                                           limiter.max_limit,
+                                                                                                           limiter.limit))
+        future_to_fetch = {executor.submit(f.account.api.get_case, f.case_id, f.marker): f for f in fetches}
         i = 1
-        for future in as_completed(future_to_case):
+        for future in as_completed(future_to_fetch):
+            fetch = future_to_fetch[future]
             try:
-                case_id = future_to_case[future]
                 case = future.result()
-                cases.append(case)
-                click.echo('Exporting CaseId: {} ({} of {})'.format(case.case_id, i, len(ids)))
+                on_case(fetch.case_id, case)
+                if not mcxcli.quiet:
+                    click.echo('Exporting CaseId: {} for {} ({} of {})'.format(case.case_id, fetch.account.user, i, len(fetches)))
             except McxError as e:
-                errors.append(case_id)
-                logging.error(e, exc_info=mcxcli.debug)
+                __case_failed(mcxcli, errors, fetch.case_id, e)
             i = i + 1
 
-    output = __cases_to_columnar_format(file, cases)
-    __write_to_file(mcxcli, file, output.fieldnames, output.rows)
-    if len(errors):
-        logging.error("Could not fetch case for the following case_ids (see error log for details): {}".format(errors))
+    click.echo('Concurrency limit finished at {} (peak {})'.format(limiter.limit, limiter.peak_limit))
+    return errors
 
-    end_time = time.time()
-    time_elapsed = end_time-start_time
-    click.echo('Time taken: {} seconds'.format(int(time_elapsed)))
+
+def __fetch_cases_pipelined(mcxcli, users, case_ids, on_case):
+    """Fetches cases for all accounts on a shared pool of threads that only download them, parsing them in mcxcli.parser
+    """
+    accounts = __open_accounts(mcxcli, users, fetch_inbox=not case_ids)
+    fetches = __case_fetches(mcxcli, accounts, case_ids)
+
+    errors = []
+    limiter = mcxcli.limiter
+    pipeline = CasePipeline(mcxcli.parser, fetch_workers=limiter.max_limit)
+    click.echo('Scheduling case fetching for {} accounts on up to {} workers, starting with {}, parsing on {} processes'.format(
+        len(accounts), limiter.max_limit, limiter.limit, mcxcli.parser.workers))
+    i = 1
+    # the fetch threads only download, the responses are decoded and parsed in the parser's processes
+    for fetch, case, error in pipeline.run(fetches, lambda f: f.account.api.get_case_view(f.case_id, f.marker, raw=True)):
+        if error:
+            __case_failed(mcxcli, errors, fetch.case_id, error)
+        else:
+            on_case(fetch.case_id, case)
+            if not mcxcli.quiet:
+                click.echo('Exporting CaseId: {} for {} ({} of {})'.format(fetch.case_id, fetch.account.user, i, len(fetches)))
+        i = i + 1
+
+    click.echo('Concurrency limit finished at {} (peak {})'.format(limiter.limit, limiter.peak_limit))
+    return errors
+
+
+async def __fetch_cases_async(mcxcli, users, case_ids, on_case):
+    """Fetches cases for all accounts with the asyncio client, with at most ASYNC_WORKERS requests in flight
+    """
+    async with AsyncExitStack() as stack:
+        accounts_in_flight = asyncio.Semaphore(mcxcli.accounts_in_flight)
+
+        async def open_account(user):
+            async with accounts_in_flight:
+                click.echo('Opening account {}'.format(user.user))
+                api = AsyncMcxApi(mcxcli.instance, mcxcli.company, user.user, user.password, concurrency=ASYNC_WORKERS,
+                                  case_store=mcxcli.case_store, token_manager=mcxcli.token_manager,
+                                  retry_policy=mcxcli.retry_policy, metrics=mcxcli.metrics, archive=mcxcli.archive,
+                                  item_definitions=mcxcli.item_definitions, fields=mcxcli.fields,
+                                  single_flight=mcxcli.single_flight, hedge_policy=mcxcli.hedge_policy)
+                __set_base_url(mcxcli, api)
+                await stack.enter_async_context(api)
+                await api.auth()
+                inbox = None if case_ids else await api.get_case_inbox(mcxcli.page_window)
+                return Account(user=user.user, api=api, inbox=inbox)
+
+        try:
+            accounts = await asyncio.gather(*[open_account(user) for user in users])
+        except McxError as e:
+            logging.error(e, exc_info=mcxcli.debug)
+            raise click.Abort()
+        fetches = __case_fetches(mcxcli, accounts, case_ids)
+
+        requests_in_flight = asyncio.Semaphore(ASYNC_WORKERS)
+        parser = mcxcli.parser
+
+        async def fetch(f):
+            try:
+                if parser is None:
+                    async with requests_in_flight:
+                        return f, await f.account.api.get_case(f.case_id, f.marker), None
+                async with requests_in_flight:
+                    body = await f.account.api.get_case_view(f.case_id, f.marker, raw=True)
+                # decoded and parsed in a worker process without holding one of the requests
+                future = parser.submit(body, f.case_id)
+                await asyncio.wrap_future(future)
+                return f, parser.result(future), None
+            except McxError as e:
+                return f, None, e
+
+        click.echo('Scheduling case fetching for {} accounts on {} concurrent requests'.format(len(accounts), ASYNC_WORKERS))
+        errors = []
+        i = 1
+        for result in asyncio.as_completed([fetch(f) for f in fetches]):
+            f, case, error = await result
+            if error:
+                __case_failed(mcxcli, errors, f.case_id, error)
+            else:
+                on_case(f.case_id, case)
+                if not mcxcli.quiet:
+                    click.echo('Exporting CaseId: {} for {} ({} of {})'.format(f.case_id, f.account.user, i, len(fetches)))
+            i = i + 1
+
+    return errors
 
 
 @cli.command()
+@click.option('--since-snapshot', type=click.Path(dir_okay=False, writable=True, resolve_path=True), help='Inbox snapshot file from the last run, only added, changed and removed cases are exported to case_inbox_changes')
 @pass_mcxcli
-def inbox(mcxcli):
+def inbox(mcxcli, since_snapshot):
     """Exports summary information about active cases assigned to users
     """
-    file = "case_inbox.{}".format(mcxcli.format)
+    file = "case_inbox{}.{}".format("_changes" if since_snapshot else "", mcxcli.format)
     users = __users_from_options(mcxcli)
     if len(users) == 1:
-        click.echo('Exporting case inbox for {} in {} to {}'.format(mcxcli.user, mcxcli.company, file))
+        click.echo('Exporting case inbox for {} in {} to {}'.format(users[0].user, mcxcli.company, file))
     else:
         click.echo('Exporting case inbox for users in {} from {} to {}'.format(mcxcli.credentials, mcxcli.company, file))
 
-    try:
-        cases = []
-        for user in users:
-            click.echo('Exporting case inbox for {}'.format(user.user))
-            api = __init_api(mcxcli.instance, mcxcli.company, user.user, user.password)
-            inbox = api.get_case_inbox()
-            cases.extend(inbox.cases)
-    except McxError as e:
-        logging.error(e, exc_info=mcxcli.debug)
-        raise click.Abort()
-    else:
-        __write_to_file(mcxcli, file, inbox.fieldnames, cases)
+    cases = []
+    fieldnames = set()
+    for account in __open_accounts(mcxcli, users):
+        cases.extend(account.inbox.cases)
+        fieldnames.update(account.inbox.fieldnames)
+
+    if since_snapshot:
+        snapshot = InboxSnapshot(since_snapshot)
+        changes = snapshot.diff(cases)
+        click.echo('Inbox changes since snapshot: {} added, {} changed, {} removed'.format(len(changes.added),
+                                                                                          len(changes.changed),
+                                                                                          len(changes.removed)))
+        cases = change_rows(changes)
+        fieldnames.add(CHANGE_COLUMN)
+
+    __write_to_file(mcxcli, file, sorted(fieldnames), cases)
+    if since_snapshot:
+        snapshot.save()
+    __write_metrics(mcxcli)
 
 
 def __users_from_options(mcxcli):
     users = []
-    if mcxcli.credentials:
+    if mcxcli.replay and mcxcli.credentials is None and mcxcli.user is None:
+        users = [User(user=user, password=None) for user in mcxcli.replay.users]
+        if not len(users):
+            raise click.UsageError("Archive {} is empty".format(mcxcli.replay.path))
+    elif mcxcli.credentials:
         users = __read_from_credentials_file(mcxcli.credentials)
         if not len(users):
             raise click.UsageError("Credentials file {} is empty".format(mcxcli.credentials))
@@ -193,28 +585,37 @@ def __users_from_options(mcxcli):
     return users
 
 
-def __init_api(instance, company, user, password):
+def __init_api(mcxcli, user):
     """Initiates the api session and authenticates the user
     """
-    api = McxApi(instance, company, user, password)
+    if mcxcli.replay:
+        return ReplayMcxApi(mcxcli.replay, mcxcli.instance, mcxcli.company, user.user, case_store=mcxcli.case_store,
+                            metrics=mcxcli.metrics, item_definitions=mcxcli.item_definitions, fields=mcxcli.fields)
+
+    api = McxApi(mcxcli.instance, mcxcli.company, user.user, user.password, case_store=mcxcli.case_store,
+                 token_manager=mcxcli.token_manager, limiter=mcxcli.limiter, retry_policy=mcxcli.retry_policy,
+                 metrics=mcxcli.metrics, archive=mcxcli.archive, item_definitions=mcxcli.item_definitions,
+                 fields=mcxcli.fields, single_flight=mcxcli.single_flight, hedge_policy=mcxcli.hedge_policy)
+    __set_base_url(mcxcli, api)
     api.auth()
 
     return api
 
 
-def __cases_to_columnar_format(file, cases):
-    """Converts a list of cases to the ColumnarFormat named tuple
-    """
-    # convert each case to a dict
-    rows = [case.dict for case in cases]
+def __set_base_url(mcxcli, api):
+    if mcxcli.base_url:
+        # BASE_URL is formatted with the instance and the endpoint, the instance is already part of --base-url
+        api.BASE_URL = mcxcli.base_url.rstrip('/') + "/{1}"
+
 
+def __rows_to_columnar_format(rows):
+    """Converts a list of case rows (Case.dict) to the ColumnarFormat named tuple
+    """
     # Generate a set of unique fieldnames across all cases
     fieldnames = set()
     for row in rows:
-        row_fieldnames = list(row.keys())
-        fieldnames = fieldnames | set(row_fieldnames)
-    fieldnames = list(fieldnames)
-    fieldnames.sort()
+        fieldnames.update(row)
+    fieldnames = sorted(fieldnames)
 
     return ColumnarFormat(fieldnames=fieldnames, rows=rows)
 
@@ -230,51 +631,18 @@ def __read_from_credentials_file(file):
 
 
 def __write_to_file(mcxcli, file, fieldnames, rows):
-    if mcxcli.format == FORMAT_CSV:
-        write_to_csv(file, fieldnames, rows)
-    elif mcxcli.format == FORMAT_JSON:
-        write_to_json(file, rows)
-    else:
-        write_to_excel(file, fieldnames, rows)
-
-
-def write_to_json(file, data):
-    with open(file, 'w') as jsonfile:
-        json.dump(data, jsonfile, sort_keys=True, indent=4)
-
-
-def write_to_excel(file, fieldnames, rows):
-    workbook = xlsxwriter.Workbook(file)
-    worksheet = workbook.add_worksheet('Cases')
-
-    r = 0
-    c = 0
-    try:
-        # header row
-        for fieldname in fieldnames:
-            worksheet.write(r, c, fieldname)
-            c += 1
-
-        # data
-        r = 1
-        c = 0
-        for row in rows:
-            for fieldname in fieldnames:
-                cell = row.get(fieldname, None)
-                worksheet.write(r, c, cell)
-                c += 1
-            r += 1
-            c = 0
-    finally:
-        workbook.close()
-
-
-def write_to_csv(filename, fieldnames, rows):
-    # write out the BOM. Using a BOM to help Excel recognize the encoding of the CSV
-    with open(filename, 'wb') as csvfile:
-        csvfile.write(u'\ufeff'.encode('utf8'))
-
-    with open(filename, 'a') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
+    with mcxcli.metrics.time_write(len(rows)):
+        if mcxcli.format == FORMAT_CSV:
+            write_to_csv(file, fieldnames, rows)
+        elif mcxcli.format == FORMAT_JSON:
+            write_to_json(file, rows)
+        elif mcxcli.format == FORMAT_JSONL:
+            write_to_jsonl(file, rows)
+        elif mcxcli.format in COLUMNAR_FORMATS:
+            write_to_columnar(file, rows, mcxcli.format)
+        elif mcxcli.format == FORMAT_SQLITE:
+            with open_stream_writer(FORMAT_SQLITE, file) as writer:
+                for row in rows:
+                    writer.write(row)
+        else:
+            write_to_excel(file, fieldnames, rows, mcxcli.constant_memory)
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+class AdaptiveLimiter:
+    """ Limits the number of requests in flight with additive increase, multiplicative decrease (AIMD)
+
+    Every time a full limit's worth of requests completes in good health the limit grows by one. When at least
+    error_threshold of the last window responses were server errors, timeouts or much slower than the long term average
+    latency, the limit is cut by decrease_factor, so an occasional failed request doesn't halve the throughput. Each cut
+    starts a new window, and requests started before the limit was cut don't count towards cutting it again.
+
+        limiter = AdaptiveLimiter()
+        with limiter.slot() as request:
+            r = session.post(...)
+            request.failed = r.status_code >= 500
+    """
+    # A response slower than this multiple of the average latency counts as congestion
+    LATENCY_FACTOR = 2.0
+    # Weight of each new latency sample in the long term average
+    LATENCY_SMOOTHING = 0.05
+    # Responses faster than this in seconds never count as slow, so jitter on a fast server doesn't cut the limit
+    LATENCY_FLOOR = 1.0
+
+    def __init__(self, initial_limit=50, min_limit=1, max_limit=200, decrease_factor=0.5, window=50, error_threshold=0.1):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.error_threshold = error_threshold
+        self.limit = max(min_limit, min(initial_limit, max_limit))
+        self.peak_limit = self.limit
+        self.in_flight = 0
+        self.average_latency = None
+        self._successes = 0
+        # True for each unhealthy response among the last window responses of the current generation
+        self._outcomes = deque(maxlen=window)
+        self._generation = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """ Blocks until a request may start, returns a token to pass to release
+        """
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+            return self._generation
+
+    def release(self, generation, latency, failed=False):
+        with self._condition:
+            self.in_flight -= 1
+            slow = (self.average_latency is not None and latency > self.LATENCY_FLOOR
+                    and latency > self.average_latency * self.LATENCY_FACTOR)
+            if not failed:
+                if self.average_latency is None:
+                    self.average_latency = latency
+                else:
+                    self.average_latency += (latency - self.average_latency) * self.LATENCY_SMOOTHING
+
+            unhealthy = failed or slow
+            if generation == self._generation:
+                self._outcomes.append(unhealthy)
+                errors = sum(self._outcomes)
+                if (unhealthy and len(self._outcomes) == self._outcomes.maxlen
+                        and errors >= self.error_threshold * len(self._outcomes)):
+                    reason = "{} of the last {} responses failing or slow".format(errors, len(self._outcomes))
+                    self._set_limit(int(self.limit * self.decrease_factor), reason)
+            if not unhealthy:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self._set_limit(self.limit + 1, None)
+            self._condition.notify_all()
+
+    def _set_limit(self, limit, reason):
+        limit = max(self.min_limit, min(limit, self.max_limit))
+        self._successes = 0
+        if limit == self.limit:
+            return
+        if limit < self.limit:
+            # requests already in flight were started under the old limit and must not cut it again
+            self._generation += 1
+            self._outcomes.clear()
+            logging.warning("Concurrency limit lowered from {} to {} with {}".format(self.limit, limit, reason))
+        else:
+            logging.info("Concurrency limit raised from {} to {}".format(self.limit, limit))
+        self.limit = limit
+        self.peak_limit = max(self.peak_limit, limit)
+
+    def _give_back(self):
+        # frees a slot without recording anything about the request that held it
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def request(self):
+        """ Returns a request to hold a slot() with, which can be abandoned from another thread
+        """
+        return _Request(self)
+
+    @contextmanager
+    def slot(self, request=None):
+        """ Holds a slot for one request, the request is recorded as failed if the block raises or sets failed
+
+        A request that is abandoned, e.g. a hedged request that lost, gives its slot back straight away and its
+        latency and failure aren't recorded. A request abandoned while waiting for a slot raises RequestAbandoned.
+        """
+        request = request or _Request(self)
+        generation = self.acquire()
+        if not request._hold():
+            self._give_back()
+            raise RequestAbandoned()
+        start = time.monotonic()
+        try:
+            yield request
+        except BaseException:
+            request.failed = True
+            raise
+        finally:
+            if request._finish():
+                self.release(generation, time.monotonic() - start, request.failed)
+
+
+class RequestAbandoned(Exception):
+    """ Raised by AdaptiveLimiter.slot for a request that was abandoned before it got a slot
+    """
+
+
+class _Request:
+    WAITING = "waiting"
+    HOLDING = "holding"
+    DONE = "done"
+
+    def __init__(self, limiter):
+        self.failed = False
+        # set once the request has a slot, after which it is sent even if it is abandoned
+        self.held = threading.Event()
+        self._limiter = limiter
+        self._state = self.WAITING
+        self._lock = threading.Lock()
+
+    def _hold(self):
+        with self._lock:
+            if self._state != self.WAITING:
+                return False
+            self._state = self.HOLDING
+            self.held.set()
+            return True
+
+    def _finish(self):
+        # True if the request still held its slot
+        with self._lock:
+            holding = self._state == self.HOLDING
+            self._state = self.DONE
+            return holding
+
+    def abandon(self):
+        with self._lock:
+            holding = self._state == self.HOLDING
+            self._state = self.DONE
+        if holding:
+            self._limiter._give_back()
+
+
+class DaemonThreadPool:
+    """ Runs calls on daemon threads that are reused, a new thread is only started when every thread is busy
+
+    Unlike a ThreadPoolExecutor the number of threads isn't bounded and they aren't waited for at exit, so a call
+    that is no longer needed, like a hedged request that lost, can't hold up other calls or the exit. A thread that
+    has been idle for idle_timeout seconds exits.
+    """
+
+    def __init__(self, idle_timeout=60.0):
+        self.idle_timeout = idle_timeout
+        self._calls = queue.SimpleQueue()
+        # idle threads that no queued call has been promised to
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        """ Calls func(*args) on a pooled thread, returns a Future of its result
+        """
+        future = Future()
+        with self._lock:
+            start = self._idle == 0
+            if not start:
+                self._idle -= 1
+        self._calls.put((future, func, args))
+        if start:
+            threading.Thread(target=self._work, daemon=True).start()
+        return future
+
+    def _work(self):
+        while True:
+            try:
+                future, func, args = self._calls.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if self._idle:
+                        self._idle -= 1
+                        return
+                # a call was promised to an idle thread just as this one timed out
+                continue
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            with self._lock:
+                self._idle += 1
+
+
+class SingleFlight:
+    """ Coalesces concurrent calls for the same key into one, like Go's singleflight
+
+    While a call for a key is in flight, other calls for the key wait for it and share its result or exception. Once
+    it completes the key is forgotten and the next call runs again. do() is for threads and do_async() for coroutines
+    on one event loop, shared counts the calls that were served by another call.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return call.result()
+
+        try:
+            result = func(*args)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, func, *args):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(func(*args))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.shared += 1
+        # a waiter that is cancelled leaves the call running for the others
+        return await asyncio.shield(task)
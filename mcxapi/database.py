@@ -0,0 +1,201 @@
+import sqlite3
+import time
+
+from .api import parse_timestamp
+
+# Each table is keyed by case_id first, so the primary keys double as the case_id indexes
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS cases ("
+    "case_id INTEGER PRIMARY KEY, "
+    "alert_name TEXT, "
+    "owner TEXT, "
+    "status_id INTEGER, "
+    "status TEXT, "
+    "priority_id INTEGER, "
+    "priority TEXT, "
+    "respondent_id INTEGER, "
+    "survey_id INTEGER, "
+    "survey_name TEXT, "
+    "time_to_close TEXT, "
+    "time_to_close_goal TEXT, "
+    "time_to_respond TEXT, "
+    "time_to_respond_goal TEXT, "
+    "exported_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS cases_survey_id ON cases (survey_id)",
+    "CREATE INDEX IF NOT EXISTS cases_status ON cases (status)",
+    "CREATE TABLE IF NOT EXISTS items ("
+    "case_id INTEGER NOT NULL, "
+    "case_item_id INTEGER NOT NULL, "
+    "case_question_type_id INTEGER, "
+    "case_item_text TEXT, "
+    "display_answer TEXT, "
+    "exported_at REAL NOT NULL, "
+    "PRIMARY KEY (case_id, case_item_id))",
+    "CREATE TABLE IF NOT EXISTS answers ("
+    "case_id INTEGER NOT NULL, "
+    "case_item_id INTEGER NOT NULL, "
+    "case_item_answer_id INTEGER, "
+    "case_question_type_id INTEGER, "
+    "is_empty INTEGER, "
+    "bool_value INTEGER, "
+    "double_value REAL, "
+    "int_value INTEGER, "
+    "text_value TEXT, "
+    "time_value TEXT, "
+    "exported_at REAL NOT NULL, "
+    "PRIMARY KEY (case_id, case_item_id))",
+    "CREATE TABLE IF NOT EXISTS root_cause_answers ("
+    "case_id INTEGER NOT NULL, "
+    "case_item_id INTEGER NOT NULL, "
+    "tree_id TEXT NOT NULL, "
+    "case_root_cause_id INTEGER, "
+    "root_cause_name TEXT, "
+    "path TEXT, "
+    "is_leaf INTEGER, "
+    "exported_at REAL NOT NULL, "
+    "PRIMARY KEY (case_id, case_item_id, tree_id))",
+    "CREATE TABLE IF NOT EXISTS activity_notes ("
+    "case_id INTEGER NOT NULL, "
+    "position INTEGER NOT NULL, "
+    "full_name TEXT, "
+    "note_date TEXT, "
+    "note TEXT, "
+    "exported_at REAL NOT NULL, "
+    "PRIMARY KEY (case_id, position))",
+    "CREATE TABLE IF NOT EXISTS source_responses ("
+    "case_id INTEGER NOT NULL, "
+    "case_item_id TEXT NOT NULL, "
+    "question_text TEXT, "
+    "answer_text TEXT, "
+    "exported_at REAL NOT NULL, "
+    "PRIMARY KEY (case_id, case_item_id))",
+    "CREATE TABLE IF NOT EXISTS inbox ("
+    "case_id INTEGER NOT NULL, "
+    "inbox_owner TEXT NOT NULL, "
+    "column_name TEXT NOT NULL, "
+    "column_value, "
+    "exported_at REAL NOT NULL, "
+    "PRIMARY KEY (case_id, inbox_owner, column_name))",
+)
+
+# table: (key columns, value columns)
+TABLES = {
+    "cases": (("case_id",), ("alert_name", "owner", "status_id", "status", "priority_id", "priority", "respondent_id",
+                             "survey_id", "survey_name", "time_to_close", "time_to_close_goal", "time_to_respond",
+                             "time_to_respond_goal")),
+    "items": (("case_id", "case_item_id"), ("case_question_type_id", "case_item_text", "display_answer")),
+    "answers": (("case_id", "case_item_id"), ("case_item_answer_id", "case_question_type_id", "is_empty", "bool_value",
+                                              "double_value", "int_value", "text_value", "time_value")),
+    "root_cause_answers": (("case_id", "case_item_id", "tree_id"), ("case_root_cause_id", "root_cause_name", "path", "is_leaf")),
+    "activity_notes": (("case_id", "position"), ("full_name", "note_date", "note")),
+    "source_responses": (("case_id", "case_item_id"), ("question_text", "answer_text")),
+    "inbox": (("case_id", "inbox_owner", "column_name"), ("column_value",)),
+}
+
+
+class CaseDatabase:
+    """ Exports cases to a SQLite database with a table per part of a case
+
+    The tables are cases, items, answers, root_cause_answers (with the path from the root of the tree), activity_notes,
+    source_responses and inbox (one row per inbox column). Rows are buffered and upserted batch_size cases at a time in
+    one transaction, so exporting into an existing database updates it in place. Rows of an exported case that are
+    no longer part of it, e.g. a removed activity note, are deleted.
+
+    It has the interface of a StreamWriter, write() adds an inbox row and write_case() adds a case.
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self, file, batch_size=BATCH_SIZE):
+        self.file = file
+        self.batch_size = batch_size
+        self._rows = {table: [] for table in TABLES}
+        self._case_ids = {"cases": set(), "inbox": set()}
+        self._connection = sqlite3.connect(file)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, row):
+        """ Adds an inbox row
+        """
+        case_id = row["CaseId"]
+        owner = row.get("Inbox Owner", "")
+        self._case_ids["inbox"].add((case_id, owner))
+        for column_name, column_value in row.items():
+            self._rows["inbox"].append((case_id, owner, column_name, column_value))
+        self._flush_if_full("inbox")
+
+    def write_case(self, case):
+        case_id = case.case_id
+        self._case_ids["cases"].add(case_id)
+        self._rows["cases"].append((case_id, case.alert_name, case.owner, case.status_id, case.status, case.priority_id,
+                                    case.priority, case.respondent_id, case.survey_id, case.survey_name, case.time_to_close,
+                                    case.time_to_close_goal, case.time_to_respond, case.time_to_respond_goal))
+        for item in case.items:
+            self._rows["items"].append((case_id, item.case_item_id, item.case_question_type_id, item.case_item_text,
+                                        item.display_answer))
+            answer = item.answer
+            if answer:
+                self._rows["answers"].append((case_id, item.case_item_id, answer.case_item_answer_id, answer.case_question_type_id,
+                                              answer.is_empty, answer.bool_value, answer.double_value, answer.int_value,
+                                              answer.text_value, answer.time_value))
+            for root_cause_answer in item.root_cause_answers:
+                root_cause = root_cause_answer.root_cause
+                path = " > ".join(c.root_cause_name for c in root_cause.path) if root_cause else None
+                self._rows["root_cause_answers"].append((case_id, item.case_item_id, root_cause_answer.tree_id,
+                                                         root_cause_answer.case_root_cause_id,
+                                                         root_cause.root_cause_name if root_cause else None, path,
+                                                         root_cause.is_leaf if root_cause else None))
+        for position, note in enumerate(case.activity_notes, 1):
+            note_date = parse_timestamp(note.date)
+            self._rows["activity_notes"].append((case_id, position, note.full_name,
+                                                 note_date.isoformat() if note_date else note.date, note.note))
+        for source_response in case.source_responses:
+            self._rows["source_responses"].append((case_id, str(source_response.case_item_id), source_response.question_text,
+                                                   source_response.answer_text))
+        self._flush_if_full("cases")
+
+    def _flush_if_full(self, kind):
+        if len(self._case_ids[kind]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Upserts the buffered rows in one transaction
+        """
+        exported_at = time.time()
+        with self._connection:
+            for table, (keys, values) in TABLES.items():
+                rows = self._rows[table]
+                if rows:
+                    self._connection.executemany(_upsert_statement(table, keys, values), [row + (exported_at,) for row in rows])
+                    rows.clear()
+            # rows of the exported cases that weren't upserted in this batch have been removed from the case
+            case_ids = [(case_id, exported_at) for case_id in self._case_ids["cases"]]
+            for table in TABLES:
+                if table not in ("cases", "inbox"):
+                    self._connection.executemany("DELETE FROM {} WHERE case_id = ? AND exported_at < ?".format(table), case_ids)
+            self._connection.executemany("DELETE FROM inbox WHERE case_id = ? AND inbox_owner = ? AND exported_at < ?",
+                                         [key + (exported_at,) for key in self._case_ids["inbox"]])
+        for case_ids in self._case_ids.values():
+            case_ids.clear()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._connection.close()
+
+
+def _upsert_statement(table, keys, values):
+    columns = keys + values + ("exported_at",)
+    updates = ", ".join("{0} = excluded.{0}".format(column) for column in values + ("exported_at",))
+    return "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO UPDATE SET {}".format(table, ", ".join(columns),
+                                                                                   ", ".join("?" * len(columns)),
+                                                                                   ", ".join(keys), updates)
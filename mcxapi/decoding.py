@@ -0,0 +1,18 @@
+import json
+
+# orjson decodes responses when it is installed, otherwise the standard library is used. Install it with:
+# pip install mcxapi[fast]
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def loads(data):
+    """ Decodes a JSON document from bytes or str
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
@@ -9,9 +9,13 @@ class McxParsingError(McxError):
     def __init__(self, json, msg=None):
         if msg is None:
             msg = "Unable to parse"
-        super(McxParsingError, self).__init__(msg, original_exception)
+        super(McxParsingError, self).__init__(msg)
         self.json = json
 
+    def __reduce__(self):
+        # keeps the message when raised in a worker process and pickled back
+        return type(self), (self.json, str(self))
+
 
 class McxNetworkError(McxError):
     """Basic exception for network errors raised by McxApi"""
@@ -21,4 +25,25 @@ class McxNetworkError(McxError):
             msg = "Networking error for {} {}".format(url, json)
         super(McxNetworkError, self).__init__(msg)
         self.url = url
-        self.json = json
\ No newline at end of file
+        self.json = json
+
+
+class McxAuthError(McxNetworkError):
+    """Raised by McxApi when a request is rejected because the token is missing, invalid or expired"""
+    def __init__(self, url, msg=None, json=None):
+        if msg is None:
+            msg = "Authentication failed for {} {}".format(url, json)
+        super(McxAuthError, self).__init__(url, msg, json)
+
+
+class McxCircuitOpenError(McxNetworkError):
+    """Raised by McxApi instead of sending a request to an endpoint that is failing"""
+    def __init__(self, url, msg=None, json=None):
+        if msg is None:
+            msg = "Not sending request to {} {}, the endpoint is failing".format(url, json)
+        super(McxCircuitOpenError, self).__init__(url, msg, json)
+
+
+class McxReplayError(McxError):
+    """Raised by ReplayMcxApi when a response is not in the archive being replayed"""
+    pass
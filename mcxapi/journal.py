@@ -0,0 +1,91 @@
+import json
+import os
+import time
+
+
+class CaseJournal:
+    """ A checkpoint of the cases an export has completed or failed, appended to as the export runs
+
+    Each JSON line holds a case id and either the case's row or the error it failed with. Lines are buffered and
+    written every FLUSH_CASES cases or FLUSH_SECONDS, whichever comes first. before_flush is called before they are
+    written, e.g. to commit the database the cases went to, so the journal never lists a case the output doesn't
+    have. close() drops lines that haven't been flushed.
+
+    Opened with resume, the cases of the previous runs are read back and the journal is appended to. A line cut short
+    by a crash is skipped.
+    """
+    FLUSH_CASES = 500
+    FLUSH_SECONDS = 5.0
+
+    def __init__(self, path, resume=False, before_flush=None):
+        self.path = path
+        self.before_flush = before_flush
+        # (case_id, row) of the cases completed by previous runs, row is None when the output doesn't use rows
+        self.rows = []
+        self.errors = set()
+        ends_with_newline = True
+        if resume and os.path.exists(path):
+            ends_with_newline = self._read()
+        self._file = open(path, 'a' if resume else 'w', encoding='utf8')
+        if not ends_with_newline:
+            self._file.write("\n")
+        self._pending = []
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _read(self):
+        line = "\n"
+        with open(self.path, encoding='utf8') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if "error" in entry:
+                    self.errors.add(entry["case_id"])
+                else:
+                    self.rows.append((entry["case_id"], entry["row"]))
+        # a case that failed and was completed by a later run is complete
+        self.errors -= self.completed
+
+        return line.endswith("\n")
+
+    @property
+    def completed(self):
+        """ The ids of the cases completed by previous runs
+        """
+        return {case_id for case_id, _ in self.rows}
+
+    def add(self, case_id, row=None):
+        self._add({"case_id": case_id, "row": row})
+
+    def add_error(self, case_id, error):
+        self._add({"case_id": case_id, "error": str(error)})
+
+    def _add(self, entry):
+        self._pending.append(json.dumps(entry, default=str))
+        if len(self._pending) >= self.FLUSH_CASES or time.monotonic() - self._flushed_at >= self.FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        if self.before_flush is not None:
+            self.before_flush()
+        if self._pending:
+            self._file.write("\n".join(self._pending) + "\n")
+            self._pending.clear()
+        self._file.flush()
+        self._flushed_at = time.monotonic()
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        """ Closes and deletes the journal, once an export has completed every case
+        """
+        self.close()
+        os.remove(self.path)
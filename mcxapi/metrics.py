@@ -0,0 +1,232 @@
+import json
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class Histogram:
+    """ A fixed bucket histogram in the style of Prometheus, values above the last bucket only count towards +Inf
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        # counts are per bucket here and made cumulative when exported
+        i = bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+    def quantile(self, q):
+        """ Estimates the q quantile by interpolating within its bucket, like Prometheus' histogram_quantile
+
+        Quantiles in the overflow bucket are reported as the largest observation.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower, previous = 0.0, 0
+        for bound, total in zip(self.buckets, self.cumulative_counts()):
+            if total >= rank and total > previous:
+                return lower + (bound - lower) * (rank - previous) / (total - previous)
+            lower, previous = bound, total
+        return self.max
+
+    def summary(self):
+        return {"count": self.count,
+                "sum": self.sum,
+                "mean": self.sum / self.count if self.count else None,
+                "max": self.max,
+                "p50": self.quantile(0.5),
+                "p95": self.quantile(0.95),
+                "p99": self.quantile(0.99)}
+
+
+class Metrics:
+    """ Thread safe performance counters for an export
+
+    Records per endpoint request latency, time spent queued for a concurrency limiter slot, bytes received, status
+    codes, retries and hedged requests, the time taken to parse each case and inbox page, and the rows written. write() saves a JSON summary and a Prometheus textfile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.latency = {}
+        self.queue_wait = {}
+        self.bytes_received = {}
+        self.responses = {}
+        self.retries = {}
+        self.hedges = {}
+        self.hedges_won = {}
+        self.parse_time = {}
+        self.rows_written = 0
+        self.write_seconds = 0.0
+        self.gauges = {}
+
+    def observe_request(self, endpoint, seconds, bytes_received=0, status=None):
+        with self._lock:
+            self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.bytes_received[endpoint] = self.bytes_received.get(endpoint, 0) + bytes_received
+            key = (endpoint, str(status) if status is not None else "error")
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def observe_queue_wait(self, endpoint, seconds):
+        """ Records the time a request spent waiting for a concurrency limiter slot, which isn't part of its latency
+        """
+        with self._lock:
+            self.queue_wait.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def record_retry(self, endpoint):
+        with self._lock:
+            self.retries[endpoint] = self.retries.get(endpoint, 0) + 1
+
+    def record_hedge(self, endpoint, won):
+        """ Counts a hedged request, won if the hedge's response arrived before the original's
+        """
+        with self._lock:
+            self.hedges[endpoint] = self.hedges.get(endpoint, 0) + 1
+            if won:
+                self.hedges_won[endpoint] = self.hedges_won.get(endpoint, 0) + 1
+
+    def latency_quantile(self, endpoint, q, min_count=1):
+        """ Returns the estimated q quantile of endpoint's latency, or None before min_count requests
+        """
+        with self._lock:
+            histogram = self.latency.get(endpoint)
+            if histogram is None or histogram.count < min_count:
+                return None
+            return histogram.quantile(q)
+
+    def observe_parse(self, kind, seconds):
+        with self._lock:
+            self.parse_time.setdefault(kind, Histogram(PARSE_BUCKETS)).observe(seconds)
+
+    def observe_write(self, rows, seconds):
+        with self._lock:
+            self.rows_written += rows
+            self.write_seconds += seconds
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def time_parse(self, kind):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_parse(kind, time.perf_counter() - start)
+
+    @contextmanager
+    def time_write(self, rows=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_write(rows, time.perf_counter() - start)
+
+    def summary(self):
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            return {
+                "elapsed_seconds": elapsed,
+                "endpoints": {endpoint: {"latency_seconds": histogram.summary(),
+                                         "queue_wait_seconds": self.queue_wait[endpoint].summary() if endpoint in self.queue_wait else None,
+                                         "bytes_received": self.bytes_received.get(endpoint, 0),
+                                         "retries": self.retries.get(endpoint, 0),
+                                         "hedges": self.hedges.get(endpoint, 0),
+                                         "hedges_won": self.hedges_won.get(endpoint, 0),
+                                         "responses": {status: count for (e, status), count in self.responses.items() if e == endpoint}}
+                              for endpoint, histogram in self.latency.items()},
+                "parse_seconds": {kind: histogram.summary() for kind, histogram in self.parse_time.items()},
+                "rows_written": self.rows_written,
+                "write_seconds": self.write_seconds,
+                "rows_per_second": self.rows_written / self.write_seconds if self.write_seconds else None,
+                "gauges": dict(self.gauges),
+            }
+
+    def prometheus(self):
+        """ Returns the metrics in the Prometheus text exposition format, for the node_exporter textfile collector
+        """
+        lines = []
+        with self._lock:
+            lines.append("# TYPE mcx_request_duration_seconds histogram")
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines.extend(_histogram_lines("mcx_request_duration_seconds", {"endpoint": endpoint}, histogram))
+            lines.append("# TYPE mcx_queue_wait_seconds histogram")
+            for endpoint, histogram in sorted(self.queue_wait.items()):
+                lines.extend(_histogram_lines("mcx_queue_wait_seconds", {"endpoint": endpoint}, histogram))
+            lines.append("# TYPE mcx_response_bytes_total counter")
+            for endpoint, total in sorted(self.bytes_received.items()):
+                lines.append(_sample("mcx_response_bytes_total", {"endpoint": endpoint}, total))
+            lines.append("# TYPE mcx_responses_total counter")
+            for (endpoint, status), total in sorted(self.responses.items()):
+                lines.append(_sample("mcx_responses_total", {"endpoint": endpoint, "status": status}, total))
+            lines.append("# TYPE mcx_retries_total counter")
+            for endpoint, total in sorted(self.retries.items()):
+                lines.append(_sample("mcx_retries_total", {"endpoint": endpoint}, total))
+            lines.append("# TYPE mcx_hedges_total counter")
+            for endpoint, total in sorted(self.hedges.items()):
+                lines.append(_sample("mcx_hedges_total", {"endpoint": endpoint}, total))
+            lines.append("# TYPE mcx_hedges_won_total counter")
+            for endpoint, total in sorted(self.hedges_won.items()):
+                lines.append(_sample("mcx_hedges_won_total", {"endpoint": endpoint}, total))
+            lines.append("# TYPE mcx_parse_duration_seconds histogram")
+            for kind, histogram in sorted(self.parse_time.items()):
+                lines.extend(_histogram_lines("mcx_parse_duration_seconds", {"kind": kind}, histogram))
+            lines.append("# TYPE mcx_rows_written_total counter")
+            lines.append(_sample("mcx_rows_written_total", {}, self.rows_written))
+            lines.append("# TYPE mcx_write_duration_seconds_total counter")
+            lines.append(_sample("mcx_write_duration_seconds_total", {}, self.write_seconds))
+            for name, value in sorted(self.gauges.items()):
+                lines.append("# TYPE mcx_{} gauge".format(name))
+                lines.append(_sample("mcx_{}".format(name), {}, value))
+            lines.append("# TYPE mcx_export_duration_seconds gauge")
+            lines.append(_sample("mcx_export_duration_seconds", {}, time.time() - self.started_at))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, prefix):
+        """ Writes <prefix>.json and <prefix>.prom
+        """
+        with open("{}.json".format(prefix), 'w') as json_file:
+            json.dump(self.summary(), json_file, sort_keys=True, indent=4)
+        with open("{}.prom".format(prefix), 'w') as prom_file:
+            prom_file.write(self.prometheus())
+
+
+def _sample(name, labels, value):
+    if labels:
+        label_text = ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items())
+        return "{}{{{}}} {}".format(name, label_text, value)
+
+    return "{} {}".format(name, value)
+
+
+def _histogram_lines(name, labels, histogram):
+    for bound, total in zip(histogram.buckets, histogram.cumulative_counts()):
+        yield _sample(name + "_bucket", dict(labels, le=bound), total)
+    yield _sample(name + "_bucket", dict(labels, le="+Inf"), histogram.count)
+    yield _sample(name + "_sum", labels, histogram.sum)
+    yield _sample(name + "_count", labels, histogram.count)
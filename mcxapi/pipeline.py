@@ -0,0 +1,134 @@
+import multiprocessing
+import queue
+import time
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+from . import decoding
+from .api import ItemDefinitionCache, build_case
+from .exceptions import McxError, McxParsingError
+from .metrics import Metrics
+
+# the item definitions of each worker process, shared by the cases it parses
+_item_definitions = None
+
+
+def _init_worker():
+    global _item_definitions
+    _item_definitions = ItemDefinitionCache()
+
+
+def _parse_case_view(response, case_id, flatten, fields):
+    start = time.perf_counter()
+    json = response
+    if isinstance(response, (bytes, str)):
+        try:
+            json = decoding.loads(response)
+        except ValueError as e:
+            raise McxParsingError(response, "Unable to parse case {}".format(case_id)) from e
+    case = build_case(json, case_id, _item_definitions, fields)
+    return (case.dict if flatten else case), time.perf_counter() - start
+
+
+class CaseParser:
+    """ Builds cases from getCaseView responses in a pool of worker processes, so parsing scales across cores
+
+    Responses are best submitted undecoded (McxApi.get_case_view with raw), the workers decode them too and the bytes
+    are cheaper to send to a worker than the decoded response. With flatten the workers return each case's row (Case.dict) rather than the Case, which is cheaper to send back
+    and leaves nothing to do for the writer but write it. With CaseFields cases are built with them.
+    """
+
+    def __init__(self, workers, flatten=True, metrics=None, fields=None):
+        self.workers = workers
+        self.flatten = flatten
+        self.fields = fields
+        self.metrics = metrics or Metrics()
+        # spawned rather than forked, the exporting process has fetch and logging threads running
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def submit(self, response, case_id):
+        """ Schedules a response, decoded or its undecoded body, to be parsed, returns a Future to pass to result()
+        """
+        return self._pool.submit(_parse_case_view, response, case_id, self.flatten, self.fields)
+
+    def result(self, future):
+        """ Returns the case or row of a parsed response, raises McxParsingError if it couldn't be parsed
+        """
+        value, seconds = future.result()
+        self.metrics.observe_parse("case", seconds)
+        return value
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
+
+
+class CasePipeline:
+    """ Fetches cases on a pool of threads, parses them with a CaseParser and hands them to the caller to write
+
+    Rather than a bounded queue between each pair of stages, the whole pipeline is bounded: at most max_pending
+    cases are being fetched, parsed or waiting to be written at once. When parsing or writing falls behind no more
+    cases are fetched until it catches up.
+    """
+
+    def __init__(self, parser, fetch_workers, max_pending=None):
+        self.parser = parser
+        self.fetch_workers = fetch_workers
+        self.max_pending = max_pending or 2 * fetch_workers
+
+    def run(self, fetches, fetch_case_view):
+        """ Yields (fetch, case, error) for each fetch as it is parsed, case is a row when the parser flattens
+
+        fetch_case_view(fetch) returns the getCaseView response for a fetch, preferably undecoded, and fetch must have a
+        case_id. Errors other than McxError are raised.
+        """
+        results = queue.SimpleQueue()
+        fetches = iter(fetches)
+        pending = 0
+        fetchers = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        try:
+            while True:
+                for fetch in islice(fetches, self.max_pending - pending):
+                    future = fetchers.submit(fetch_case_view, fetch)
+                    future.add_done_callback(partial(self._fetched, results, fetch))
+                    pending += 1
+                if not pending:
+                    break
+
+                fetch, parsed, error = results.get()
+                pending -= 1
+                case = None
+                if parsed is not None:
+                    try:
+                        case = self.parser.result(parsed)
+                    except Exception as e:
+                        error = e
+                if error is not None and not isinstance(error, McxError):
+                    raise error
+                yield fetch, case, error
+        finally:
+            fetchers.shutdown(cancel_futures=True)
+
+    def _fetched(self, results, fetch, future):
+        # runs on the fetch thread, the response is parsed in a worker process
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            results.put((fetch, None, error))
+            return
+
+        try:
+            parsed = self.parser.submit(future.result(), fetch.case_id)
+        except Exception as e:
+            parsed = Future()
+            parsed.set_exception(e)
+        parsed.add_done_callback(lambda f: results.put((fetch, f, None)))
@@ -0,0 +1,171 @@
+import logging
+import random
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+
+class RetryBudget:
+    """ A retry allowance shared by every thread and client using the same RetryPolicy
+
+    Each request earns ratio of a retry and each retry spends one, so retries can add at most ratio extra load on top
+    of min_retries. When a server is struggling the budget runs dry and requests fail instead of retrying in lockstep.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10, max_retries=100):
+        self.ratio = ratio
+        self.max_retries = max_retries
+        self._balance = float(min_retries)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self._balance + self.ratio, self.max_retries)
+
+    def withdraw(self):
+        """ Spends one retry, returns False if the budget is exhausted
+        """
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+class CircuitBreaker:
+    """ Stops calling an endpoint after failure_threshold consecutive failures
+
+    While open every request fails fast. After reset_timeout seconds a single trial request is let through, its
+    success closes the circuit and its failure opens it again.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                logging.info("Circuit for {} half-open, sending a trial request".format(self.name))
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info("Circuit for {} closed".format(self.name))
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.failure_threshold):
+                logging.warning("Circuit for {} opened after {} failures".format(self.name, self._failures))
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        """ Records a request that ended without an outcome, e.g. cancelled, so another can be the trial request
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                # opened more than reset_timeout ago, the next request is let through
+                self.state = self.OPEN
+
+
+class RetryPolicy:
+    """ How McxApi retries failed requests, shared between clients so that the budget and breakers are global
+
+    Retries use full jitter backoff: a random delay between 0 and backoff_base * 2 ** attempt seconds, capped at
+    backoff_cap. A Retry-After header from the server is the minimum delay.
+    """
+    # 429 Too Many Requests
+    # 500 Internal Service Error
+    # 501 Not Implemented
+    # 502 Bad Gateway
+    # 503 Service Unavailable
+    # 504 Gateway Timeout
+    RETRY_STATUSES = (429, 500, 501, 502, 503, 504)
+
+    def __init__(self, retries=3, backoff_base=1.0, backoff_cap=30.0, budget=None, failure_threshold=5, reset_timeout=30.0):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.budget = budget or RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout)
+            return self._breakers[endpoint]
+
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_cap))
+
+        return delay
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class HedgePolicy:
+    """ When McxApi sends a second copy of a slow idempotent request, shared between clients like RetryPolicy
+
+    A request to one of endpoints that hasn't been answered after the endpoint's observed quantile latency is
+    hedged: the same request is sent again and the first response wins. Nothing is hedged until the endpoint has
+    min_samples latencies. Hedges are paid for from a RetryBudget of max_ratio per request, so they add at most
+    max_ratio extra requests.
+    """
+
+    def __init__(self, max_ratio=0.05, quantile=0.95, min_samples=20, min_delay=0.05, endpoints=("getCaseView",)):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.endpoints = endpoints
+        self.budget = RetryBudget(ratio=max_ratio, min_retries=0, max_retries=max(1, int(max_ratio * 100)))
+
+    def delay(self, endpoint, metrics):
+        """ Returns the seconds to wait for a response from endpoint before hedging, or None to not hedge it
+        """
+        if endpoint not in self.endpoints:
+            return None
+        latency = metrics.latency_quantile(endpoint, self.quantile, self.min_samples)
+        if latency is None:
+            return None
+
+        return max(latency, self.min_delay)
+
+
+def parse_retry_after(value):
+    """ Returns the delay in seconds of a Retry-After header, which is either a number of seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,80 @@
+import json
+import os
+
+from collections import namedtuple
+
+from .cache import row_marker
+
+# Inbox rows that are new or changed since the snapshot and the case ids that are no longer in the inbox
+ChangeSet = namedtuple('ChangeSet', 'added changed removed')
+
+CHANGE_COLUMN = "Change"
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+
+class InboxSnapshot:
+    """ A compact record of an inbox, one change marker per case id, used to export only what changed between runs
+
+    The snapshot file is JSON: {"cases": [[case_id, marker], ...]}. A missing file is an empty snapshot, so the first
+    run reports every case as added.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.previous = self._load()
+        self.current = None
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as snapshot_file:
+            return {case_id: marker for case_id, marker in json.load(snapshot_file)["cases"]}
+
+    def diff(self, rows):
+        """ Compares inbox rows with the previous snapshot, the first row for a case id wins
+        """
+        self.current = {}
+        added = []
+        changed = []
+        for row in rows:
+            case_id = row["CaseId"]
+            if case_id in self.current:
+                continue
+            marker = row_marker(row)
+            self.current[case_id] = marker
+            if case_id not in self.previous:
+                added.append(row)
+            elif self.previous[case_id] != marker:
+                changed.append(row)
+        removed = [case_id for case_id in self.previous if case_id not in self.current]
+
+        return ChangeSet(added=added, changed=changed, removed=removed)
+
+    def save(self, exclude=()):
+        """ Saves the inbox last passed to diff, cases in exclude keep their previous marker so they are reported again
+        """
+        exclude = set(exclude)
+        cases = []
+        for case_id, marker in self.current.items():
+            if case_id in exclude:
+                marker = self.previous.get(case_id)
+                if marker is None:
+                    continue
+            cases.append([case_id, marker])
+
+        temp_path = "{}.tmp".format(self.path)
+        with open(temp_path, 'w') as snapshot_file:
+            json.dump({"cases": cases}, snapshot_file, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+
+
+def change_rows(changes):
+    """ Flattens a ChangeSet into inbox rows with a Change column
+    """
+    rows = [dict(row, **{CHANGE_COLUMN: ADDED}) for row in changes.added]
+    rows.extend(dict(row, **{CHANGE_COLUMN: CHANGED}) for row in changes.changed)
+    rows.extend({"CaseId": case_id, CHANGE_COLUMN: REMOVED} for case_id in changes.removed)
+
+    return rows
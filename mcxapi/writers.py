@@ -0,0 +1,332 @@
+import csv
+import json
+import tempfile
+
+import xlsxwriter
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+from .api import parse_timestamp
+from .database import CaseDatabase
+
+FORMAT_EXCEL = 'xlsx'
+FORMAT_CSV = 'csv'
+FORMAT_JSON = 'json'
+FORMAT_JSONL = 'jsonl'
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+FORMAT_SQLITE = 'sqlite'
+COLUMNAR_FORMATS = (FORMAT_PARQUET, FORMAT_ARROW)
+EXCEL_MAX_ROWS = 1048576
+ROW_GROUP_SIZE = 10000
+
+
+def write_to_json(file, data):
+    with open(file, 'w') as jsonfile:
+        json.dump(data, jsonfile, sort_keys=True, indent=4)
+
+
+def write_to_jsonl(file, rows):
+    with JsonLinesWriter(file) as writer:
+        for row in rows:
+            writer.write(row)
+
+
+def write_to_excel(file, fieldnames, rows, constant_memory=False, max_rows=EXCEL_MAX_ROWS):
+    """Writes rows to a workbook, continuing on a new worksheet each time a sheet reaches max_rows
+
+    With constant_memory xlsxwriter flushes each row to disk once the next row is started, so memory stays flat
+    regardless of the number of rows.
+    """
+    workbook = xlsxwriter.Workbook(file, {'constant_memory': constant_memory})
+    try:
+        worksheet = None
+        r = max_rows
+        for row in rows:
+            if r == max_rows:
+                worksheet = __add_worksheet(workbook, fieldnames)
+                r = 1
+            worksheet.write_row(r, 0, [row.get(fieldname) for fieldname in fieldnames])
+            r += 1
+
+        if worksheet is None:
+            __add_worksheet(workbook, fieldnames)
+    finally:
+        workbook.close()
+
+
+def __add_worksheet(workbook, fieldnames):
+    sheet_number = len(workbook.worksheets()) + 1
+    worksheet = workbook.add_worksheet('Cases' if sheet_number == 1 else 'Cases {}'.format(sheet_number))
+    # header row
+    worksheet.write_row(0, 0, fieldnames)
+
+    return worksheet
+
+
+def write_to_csv(filename, fieldnames, rows):
+    # write out the BOM. Using a BOM to help Excel recognize the encoding of the CSV
+    with open(filename, 'wb') as csvfile:
+        csvfile.write(u'\ufeff'.encode('utf8'))
+
+    with open(filename, 'a') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_to_columnar(file, rows, format=FORMAT_PARQUET, column_types=None, row_group_size=ROW_GROUP_SIZE):
+    """Writes rows to a Parquet or Arrow IPC file with a typed column per fieldname, row_group_size rows at a time
+
+    Without column_types the types are inferred from the rows first, so rows must be iterable twice.
+    """
+    if pyarrow is None:
+        raise ImportError("The {} format requires pyarrow, install it with: pip install mcxapi[parquet]".format(format))
+    if column_types is None:
+        column_types = ColumnTypes()
+        for row in rows:
+            column_types.update(row)
+
+    schema = column_types.schema()
+    if format == FORMAT_PARQUET:
+        writer = pyarrow.parquet.ParquetWriter(file, schema, compression='zstd')
+    else:
+        writer = pyarrow.ipc.new_file(file, schema, options=pyarrow.ipc.IpcWriteOptions(compression='zstd'))
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == row_group_size:
+                writer.write_batch(column_types.record_batch(batch, schema))
+                batch = []
+        if batch:
+            writer.write_batch(column_types.record_batch(batch, schema))
+    finally:
+        writer.close()
+
+
+class ColumnTypes:
+    """ Infers a column type for each fieldname from the values written to it
+
+    Columns of bools, ints or floats keep their type, ints and floats together become floats, and strings that are
+    all dates in the API's /Date(...)/ format become UTC timestamps. Any other mix becomes a string column. Empty
+    strings are nulls in columns that aren't strings.
+    """
+    BOOL = 'bool'
+    INT = 'int'
+    FLOAT = 'float'
+    TIMESTAMP = 'timestamp'
+    STRING = 'string'
+
+    def __init__(self):
+        self.types = {}
+
+    @property
+    def fieldnames(self):
+        return sorted(self.types)
+
+    def update(self, row):
+        for fieldname, value in row.items():
+            current = self.types.get(fieldname)
+            if current == self.STRING:
+                continue
+            self.types[fieldname] = self._widen(current, self._type_of(value))
+
+    def _type_of(self, value):
+        if value is None or value == "":
+            return None
+        if isinstance(value, bool):
+            return self.BOOL
+        if isinstance(value, int):
+            return self.INT
+        if isinstance(value, float):
+            return self.FLOAT
+        if isinstance(value, str) and parse_timestamp(value) is not None:
+            return self.TIMESTAMP
+        return self.STRING
+
+    def _widen(self, current, new):
+        if current is None or current == new:
+            return new
+        if new is None:
+            return current
+        if {current, new} == {self.INT, self.FLOAT}:
+            return self.FLOAT
+        return self.STRING
+
+    def schema(self):
+        arrow_types = {self.BOOL: pyarrow.bool_(),
+                       self.INT: pyarrow.int64(),
+                       self.FLOAT: pyarrow.float64(),
+                       self.TIMESTAMP: pyarrow.timestamp('ms', tz='UTC'),
+                       # columns that were only ever null
+                       None: pyarrow.string(),
+                       self.STRING: pyarrow.string()}
+        return pyarrow.schema([(fieldname, arrow_types[self.types[fieldname]]) for fieldname in self.fieldnames])
+
+    def record_batch(self, rows, schema):
+        arrays = []
+        for field in schema:
+            column_type = self.types[field.name]
+            arrays.append(pyarrow.array([self._convert(column_type, row.get(field.name)) for row in rows], type=field.type))
+
+        return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def _convert(self, column_type, value):
+        if value is None:
+            return None
+        if column_type in (self.STRING, None):
+            return value if isinstance(value, str) else str(value)
+        if value == "":
+            return None
+        if column_type == self.TIMESTAMP:
+            return parse_timestamp(value)
+        if column_type == self.FLOAT:
+            return float(value)
+        return value
+
+
+def open_stream_writer(format, file, constant_memory=False):
+    """Returns a writer that writes rows to file in format as they are produced
+    """
+    if format == FORMAT_SQLITE:
+        return CaseDatabase(file)
+    elif format in COLUMNAR_FORMATS:
+        return ColumnarStreamWriter(file, format)
+    elif format == FORMAT_JSONL:
+        return JsonLinesWriter(file)
+    elif format == FORMAT_JSON:
+        return JsonArrayWriter(file)
+    elif format == FORMAT_CSV:
+        return CsvStreamWriter(file)
+    else:
+        return ExcelStreamWriter(file, constant_memory)
+
+
+class StreamWriter:
+    """ Base class for writers that are fed one row at a time
+
+    Writers are context managers, the output is complete once close() returns.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, row):
+        raise NotImplementedError
+
+    def write_case(self, case):
+        self.write(case.dict)
+
+    def close(self):
+        raise NotImplementedError
+
+
+class JsonLinesWriter(StreamWriter):
+    """ Writes each row as a JSON object on its own line
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self._out = open(file, 'w')
+
+    def write(self, row):
+        self._out.write(json.dumps(row, sort_keys=True))
+        self._out.write('\n')
+
+    def close(self):
+        self._out.close()
+
+
+class JsonArrayWriter(StreamWriter):
+    """ Writes rows as elements of a JSON array without holding the array in memory
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self._out = open(file, 'w')
+        self._out.write('[')
+        self._count = 0
+
+    def write(self, row):
+        self._out.write(',\n' if self._count else '\n')
+        self._out.write(json.dumps(row, sort_keys=True, indent=4))
+        self._count += 1
+
+    def close(self):
+        self._out.write('\n]' if self._count else ']')
+        self._out.close()
+
+
+class SpillingWriter(StreamWriter):
+    """ Base class for formats that need every fieldname before the first row is written
+
+    Rows are spilled to a temporary JSON lines file while the fieldnames are collected, so memory is bounded by the
+    number of distinct fieldnames rather than the number of rows. close() replays the spilled rows into
+    _write_all with the final, sorted fieldnames.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.fieldnames = set()
+        self._spill = tempfile.TemporaryFile('w+', encoding='utf8')
+
+    def write(self, row):
+        self.fieldnames.update(row)
+        self._spill.write(json.dumps(row))
+        self._spill.write('\n')
+
+    def _replay(self):
+        self._spill.seek(0)
+        for line in self._spill:
+            yield json.loads(line)
+
+    def _write_all(self, fieldnames, rows):
+        raise NotImplementedError
+
+    def close(self):
+        try:
+            self._write_all(sorted(self.fieldnames), self._replay())
+        finally:
+            self._spill.close()
+
+
+class CsvStreamWriter(SpillingWriter):
+
+    def _write_all(self, fieldnames, rows):
+        write_to_csv(self.file, fieldnames, rows)
+
+
+class ExcelStreamWriter(SpillingWriter):
+
+    def __init__(self, file, constant_memory=False):
+        super().__init__(file)
+        self.constant_memory = constant_memory
+
+    def _write_all(self, fieldnames, rows):
+        write_to_excel(self.file, fieldnames, rows, self.constant_memory)
+
+
+class ColumnarStreamWriter(SpillingWriter):
+    """ Writes Parquet or Arrow IPC files, column types are inferred while rows are spilled
+    """
+
+    def __init__(self, file, format=FORMAT_PARQUET, row_group_size=ROW_GROUP_SIZE):
+        super().__init__(file)
+        self.format = format
+        self.row_group_size = row_group_size
+        self.column_types = ColumnTypes()
+
+    def write(self, row):
+        super().write(row)
+        self.column_types.update(row)
+
+    def _write_all(self, fieldnames, rows):
+        write_to_columnar(self.file, rows, self.format, self.column_types, self.row_group_size)
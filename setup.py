@@ -25,14 +25,22 @@ setup(
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
+    python_requires='>=3.9',
     packages=find_packages(),
     include_package_data=True,
     install_requires=[
         'click', 'requests', 'anytree', 'xlsxwriter'
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'fast': ['orjson'],
+        'parquet': ['pyarrow'],
+    },
     entry_points='''
         [console_scripts]
         mcx=mcxapi.cli:cli
@@ -0,0 +1,80 @@
+from mcxapi.api import Item
+
+
+def make_case_view(case_id=1, survey_id=10, answers=True):
+    """Builds a GetCaseViewResult payload with a status, priority, text, dropdown and root cause item"""
+    items = [
+        {"CaseItemId": 1, "CaseQuestionTypeId": Item.STATUS, "CaseItemText": "Status",
+         "DropdownValues": [{"Id": 1, "Text": "Open"}, {"Id": 2, "Text": "Closed"}], "RootCauseValues": []},
+        {"CaseItemId": 2, "CaseQuestionTypeId": Item.PRIORITY, "CaseItemText": "Priority",
+         "DropdownValues": [{"Id": 1, "Text": "Low"}, {"Id": 2, "Text": "High"}], "RootCauseValues": []},
+        {"CaseItemId": 3, "CaseQuestionTypeId": Item.SHORT_TEXT_BOX, "CaseItemText": "Summary",
+         "DropdownValues": [], "RootCauseValues": []},
+        {"CaseItemId": 4, "CaseQuestionTypeId": Item.DROPDOWN, "CaseItemText": "Channel",
+         "DropdownValues": [{"Id": 7, "Text": "Phone"}, {"Id": 8, "Text": "Email"}], "RootCauseValues": []},
+        {"CaseItemId": 5, "CaseQuestionTypeId": Item.ROOT_CAUSE, "CaseItemText": "Root Cause",
+         "DropdownValues": [],
+         "RootCauseValues": [
+             {"CaseItemId": 5, "CaseRootCauseId": 100, "RootCauseName": "Product", "ParentTreeId": "#", "TreeId": "a"},
+             {"CaseItemId": 5, "CaseRootCauseId": 101, "RootCauseName": "Quality", "ParentTreeId": "a", "TreeId": "a1"},
+             {"CaseItemId": 5, "CaseRootCauseId": 102, "RootCauseName": "Broken", "ParentTreeId": "a1", "TreeId": "a1x"},
+             {"CaseItemId": 5, "CaseRootCauseId": 103, "RootCauseName": "Service", "ParentTreeId": "#", "TreeId": "b"},
+         ]},
+    ]
+    item_answers = []
+    root_cause_answers = []
+    if answers:
+        item_answers = [
+            make_answer(3, Item.SHORT_TEXT_BOX, text_value="Late delivery {}".format(case_id)),
+            make_answer(4, Item.DROPDOWN, int_value=8),
+        ]
+        root_cause_answers = [
+            {"CaseItemId": 5, "CaseRootCauseId": 100, "TreeId": "a"},
+            {"CaseItemId": 5, "CaseRootCauseId": 101, "TreeId": "a1"},
+            {"CaseItemId": 5, "CaseRootCauseId": 102, "TreeId": "a1x"},
+        ]
+
+    return {"GetCaseViewResult": {
+        "viewValues": {
+            "CaseId": case_id,
+            "AlertName": "Alert",
+            "OwnerFullName": "Jane Doe",
+            "TimeToCloseDisplay": "1d",
+            "TimeToCloseGoalDisplay": "2d",
+            "TimeToRespondDisplay": "1h",
+            "TimeToRespondGoalDisplay": "2h",
+            "CaseStatusId": 1,
+            "CasePriorityId": 2,
+            "RespondentId": 1000 + case_id,
+            "SurveyId": survey_id,
+            "SurveyName": "Survey {}".format(survey_id),
+            "ItemAnswers": item_answers,
+            "CaseRootCauseAnswers": root_cause_answers,
+            "ActivityNotes": [
+                {"ActivityNote": "Called customer", "ActivityNoteDate": "/Date(1486742990423-0600)/", "FullName": "Jane Doe"},
+            ],
+            "SourceResponses": [
+                {"Key": 50, "Value": {"QuestionText": "How likely are you to recommend us?", "AnswerText": "9"}},
+                {"Key": 51, "Value": {"QuestionText": "", "AnswerText": "Great"}},
+            ],
+        },
+        "caseView": {"CaseViewItems": items},
+    }}
+
+
+def make_answer(case_item_id, case_question_type_id, text_value=None, int_value=None, double_value=None):
+    return {"CaseItemAnswerId": case_item_id * 10, "CaseItemId": case_item_id,
+            "CaseQuestionTypeId": case_question_type_id, "IsEmpty": False, "BoolValue": None,
+            "DoubleValue": double_value, "IntValue": int_value, "TextValue": text_value, "TimeValue": None}
+
+
+def make_inbox_page(case_ids, extra_columns=()):
+    """Builds a getMobileCaseInboxItems payload with one row per case id"""
+    rows = []
+    for case_id in case_ids:
+        columns = [{"ColumnName": "Status", "ColumnValue": "Open"},
+                   {"ColumnName": "Modified", "ColumnValue": "/Date(1486742990423-0600)/"}]
+        columns.extend({"ColumnName": name, "ColumnValue": "{}-{}".format(name, case_id)} for name in extra_columns)
+        rows.append({"CaseId": case_id, "Columns": columns})
+
+    return {"GetMobileCaseInboxItemsResult": {"caseMobileInboxData": {"Rows": rows}}}
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from conftest import make_case_view, make_inbox_page
+from mcxapi.exceptions import McxNetworkError
+from mcxapi.resilience import HedgePolicy, RetryPolicy
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+from mcxapi.aio import AsyncMcxApi  # noqa: E402
+
+
+def fake_app(failures=0, delays=()):
+    state = {"failures": failures, "delays": list(delays), "requests": []}
+
+    async def authenticate(request):
+        return web.json_response({"AuthenticateResult": {"token": "secret"}})
+
+    async def inbox(request):
+        body = await request.json()
+        state["requests"].append(body)
+        ids = [1, 2, 3] if body["startPage"] == 0 else []
+        return web.json_response(make_inbox_page(ids))
+
+    async def case_view(request):
+        body = await request.json()
+        state["requests"].append(body)
+        if state["delays"]:
+            await asyncio.sleep(state["delays"].pop(0))
+        if state["failures"]:
+            state["failures"] -= 1
+            return web.Response(status=503)
+        return web.json_response(make_case_view(body["caseId"]))
+
+    app = web.Application()
+    app.router.add_post("/test/CaseManagement.svc/authenticate", authenticate)
+    app.router.add_post("/test/CaseManagement.svc/getMobileCaseInboxItems", inbox)
+    app.router.add_post("/test/CaseManagement.svc/getCaseView", case_view)
+    return app, state
+
+
+async def run_against(app, coro_fn):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        retry_policy = RetryPolicy(backoff_base=0)
+        async with AsyncMcxApi("test", "company", "user", "password", retry_policy=retry_policy) as api:
+            api.BASE_URL = "http://127.0.0.1:{}/".format(port) + "{}/CaseManagement.svc/{}"
+            return await coro_fn(api)
+    finally:
+        await runner.cleanup()
+
+
+def test_fetches_inbox_and_cases():
+    app, state = fake_app()
+
+    async def export(api):
+        await api.auth()
+        inbox = await api.get_case_inbox()
+        cases = await asyncio.gather(*[api.get_case(case_id) for case_id in inbox.ids])
+        return inbox, cases
+
+    inbox, cases = asyncio.run(run_against(app, export))
+    assert inbox.ids == [1, 2, 3]
+    assert inbox.fieldnames == sorted(["CaseId", "Inbox Owner", "Modified", "Status"])
+    assert [c.case_id for c in cases] == [1, 2, 3]
+    assert cases[0].status == "Open"
+    assert all(r["token"] == "secret" for r in state["requests"])
+
+
+def test_retries_server_errors():
+    app, state = fake_app(failures=2)
+    case = asyncio.run(run_against(app, lambda api: api.get_case(42)))
+    assert case.case_id == 42
+
+
+def test_raises_network_error_when_retries_exhausted():
+    app, state = fake_app(failures=10)
+    with pytest.raises(McxNetworkError):
+        asyncio.run(run_against(app, lambda api: api.get_case(42)))
+
+
+def test_hedged_case_request_uses_the_first_response():
+    app, state = fake_app(delays=[1])
+
+    async def hedged_case(api):
+        api.hedge_policy = HedgePolicy(max_ratio=1.0, min_samples=5)
+        for _ in range(5):
+            api.metrics.observe_request("getCaseView", 0.01)
+        case = await asyncio.wait_for(api.get_case(42), 0.8)
+        return case, api.metrics.summary()["endpoints"]["getCaseView"]
+
+    case, summary = asyncio.run(run_against(app, hedged_case))
+    assert case.case_id == 42
+    assert len(state["requests"]) == 2
+    assert (summary["hedges"], summary["hedges_won"]) == (1, 1)
+
+
+def test_circuit_reopens_when_the_trial_request_fails_without_a_response():
+    app, state = fake_app()
+
+    async def failed_trial(api):
+        api.retry_policy = RetryPolicy(retries=0, failure_threshold=1, reset_timeout=0.05)
+        breaker = api._breaker(api._url("getCaseView"))
+        breaker.record_failure()
+        read_post = api._read_post
+
+        async def broken_read_post(url, json):
+            raise aiohttp.ClientPayloadError("Response payload is not completed")
+
+        api._read_post = broken_read_post
+        await asyncio.sleep(0.1)
+        with pytest.raises(McxNetworkError):
+            await api.get_case(42)
+        state_after_trial = breaker.state
+
+        api._read_post = read_post
+        await asyncio.sleep(0.1)
+        return state_after_trial, await api.get_case(42)
+
+    state_after_trial, case = asyncio.run(run_against(app, failed_trial))
+    assert state_after_trial == "open"
+    assert case.case_id == 42
+
+
+def test_client_error_is_observed_once():
+    app, state = fake_app()
+
+    async def missing_endpoint(api):
+        with pytest.raises(McxNetworkError):
+            await api._post(api._url("getMissing"), {})
+        return api.metrics.summary()["endpoints"]["getMissing"]
+
+    summary = asyncio.run(run_against(app, missing_endpoint))
+    assert summary["responses"] == {"404": 1}
@@ -0,0 +1,168 @@
+import json as jsonlib
+import logging
+import threading
+import warnings
+
+import pytest
+
+from conftest import make_case_view, make_inbox_page
+from mcxapi import decoding
+from mcxapi.api import McxApi, Case, CaseFields, InboxBuilder, ItemDefinitionCache
+
+
+class FakeInboxApi(McxApi):
+    PAGE_SIZE = 3
+
+    def __init__(self, pages):
+        super().__init__("test", "company", "user", "password")
+        self.pages = pages
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def _post(self, url, params=None, json={}, raw=False):
+        page = json["startPage"]
+        with self.lock:
+            self.requested.append(page)
+        ids = self.pages[page] if page < len(self.pages) else []
+        response = make_inbox_page(ids)
+        return jsonlib.dumps(response).encode() if raw else response
+
+
+def test_serial_inbox_stops_when_no_new_cases():
+    api = FakeInboxApi([[1, 2, 3], [4, 5, 6], [7]])
+    inbox = api.get_case_inbox()
+    assert inbox.ids == [1, 2, 3, 4, 5, 6, 7]
+    assert api.requested == [0, 1, 2, 3]
+
+
+def test_windowed_inbox_stops_at_first_short_page():
+    api = FakeInboxApi([[1, 2, 3], [4, 5, 6], [7], [8, 9, 10]])
+    inbox = api.get_case_inbox(window=4)
+    assert inbox.ids == [1, 2, 3, 4, 5, 6, 7]
+    assert inbox.fieldnames == ["CaseId", "Inbox Owner", "Modified", "Status"]
+    assert [c["CaseId"] for c in inbox.cases] == inbox.ids
+    # never fetches more than a window past the last page
+    assert max(api.requested) <= 2 + 4
+
+
+def test_windowed_inbox_dedupes_repeated_cases():
+    api = FakeInboxApi([[1, 2, 3], [3, 4, 5], [1, 2, 3], [6]])
+    inbox = api.get_case_inbox(window=2)
+    assert inbox.ids == [1, 2, 3, 4, 5]
+
+
+def test_inbox_builder_dedupes_ids_and_sorts_fieldnames():
+    inbox = InboxBuilder()
+    assert inbox.add(2, {"Status": "Open", "CaseId": 2})
+    assert inbox.add(1, {"CaseId": 1})
+    assert not inbox.add(2, {"CaseId": 2, "Region": "EU"})
+    assert len(inbox) == 2
+    assert inbox.build() == ([2, 1], ["CaseId", "Region", "Status"], [{"Status": "Open", "CaseId": 2}, {"CaseId": 1}])
+
+
+def test_parse_case_inbox_still_appends_to_lists():
+    api = McxApi("test", "company", "user", "password")
+    case_ids, fieldnames, cases = [1], ["CaseId"], [{"CaseId": 1}]
+    assert api.parse_case_inbox(make_inbox_page([1, 2]), case_ids, fieldnames, cases) == 2
+    assert case_ids == [1, 2]
+    assert fieldnames == ["CaseId", "Status", "Modified", "Inbox Owner"]
+    assert [c["CaseId"] for c in cases] == [1, 2]
+
+
+def test_case_resolves_answers_and_root_causes():
+    case = Case(make_case_view(7)["GetCaseViewResult"])
+    row = case.dict
+    assert row["Status"] == "Open"
+    assert row["Priority"] == "High"
+    assert row["Channel"] == "Email"
+    assert row["Summary"] == "Late delivery 7"
+    assert row["Root Cause"] == "Product > Quality > Broken\n"
+    assert row["Activity Note 1"] == "Jane Doe @ 2017-02-10 10:09-0600: Called customer"
+    assert row["How likely are you to recommend us?"] == "9"
+    assert row["51"] == "Great"
+
+    root_cause_item = case._find_item(5)
+    assert [r.root_cause_name for r in root_cause_item._find_root_cause("a1x").path] == ["Product", "Quality", "Broken"]
+
+
+def test_root_causes_render_without_the_deprecated_anchestors():
+    case = Case(make_case_view(7)["GetCaseViewResult"])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        assert case._find_item(5)._draw_root_cause_answers() == "Product > Quality > Broken\n"
+
+
+def test_case_lookups_use_first_matching_item():
+    case_view = make_case_view(7)
+    items = case_view["GetCaseViewResult"]["caseView"]["CaseViewItems"]
+    items.append(dict(items[0], CaseItemId=99, DropdownValues=[{"Id": 1, "Text": "Duplicate"}]))
+    case = Case(case_view["GetCaseViewResult"])
+    assert case.status == "Open"
+
+
+def test_case_with_fields_only_parses_and_exports_their_columns():
+    case = Case(make_case_view(7)["GetCaseViewResult"], fields=CaseFields.parse("Status, Owner,Root Cause,51"))
+    assert case.dict == {"Case ID": 7, "Status": "Open", "Owner": "Jane Doe",
+                         "Root Cause": "Product > Quality > Broken\n", "51": "Great"}
+    assert [item.case_item_id for item in case.items] == [1, 5]
+    assert case.activity_notes == []
+    assert len(case.source_responses) == 1
+
+    case = Case(make_case_view(7)["GetCaseViewResult"], fields=CaseFields(["Activity Notes", "Source Responses"]))
+    assert sorted(case.dict) == ["51", "Activity Note 1", "Case ID", "How likely are you to recommend us?"]
+    assert case.items == []
+
+
+def test_cases_of_a_survey_share_item_definitions():
+    definitions = ItemDefinitionCache()
+    first = Case(make_case_view(1)["GetCaseViewResult"], definitions)
+    second = Case(make_case_view(2)["GetCaseViewResult"], definitions)
+    assert len(definitions) == 5
+    assert first._find_item(5).definition is second._find_item(5).definition
+    assert first._find_item(3).answer is not second._find_item(3).answer
+    assert (first.dict["Summary"], second.dict["Summary"]) == ("Late delivery 1", "Late delivery 2")
+    assert second.dict["Root Cause"] == "Product > Quality > Broken\n"
+
+    other_survey = Case(make_case_view(3, survey_id=11)["GetCaseViewResult"], definitions)
+    assert other_survey._find_item(5).definition is not first._find_item(5).definition
+
+    case_view = make_case_view(4)
+    items = case_view["GetCaseViewResult"]["caseView"]["CaseViewItems"]
+    items[3] = dict(items[3], DropdownValues=items[3]["DropdownValues"] + [{"Id": 9, "Text": "Chat"}])
+    changed = Case(case_view["GetCaseViewResult"], definitions)
+    assert changed._find_item(4).definition is not first._find_item(4).definition
+    assert len(definitions) == 11
+
+
+@pytest.mark.parametrize("backend", ["installed", "stdlib"])
+def test_inbox_body_parses_like_decoded_page(monkeypatch, backend):
+    if backend == "stdlib":
+        monkeypatch.setattr(decoding, "orjson", None)
+    page = make_inbox_page([1, 2, 3], extra_columns=["Region"])
+    api = McxApi("test", "company", "user", "password")
+
+    from_body, decoded = InboxBuilder(), InboxBuilder()
+    assert api.parse_case_inbox_body(jsonlib.dumps(page).encode(), from_body) == 3
+    assert api.parse_case_inbox(page, decoded) == 3
+    assert from_body.build() == decoded.build()
+
+
+def test_request_logging_only_sanitizes_enabled_records(monkeypatch, caplog):
+    class Sent(Exception):
+        pass
+
+    def post_with_retries(url, params, json):
+        raise Sent()
+
+    api = McxApi("test", "company", "user", "password")
+    calls = []
+    monkeypatch.setattr(api, "_sanitize_json_for_logging", lambda json: calls.append(json) or {"password": "*****"})
+    monkeypatch.setattr(api, "_post_with_retries", post_with_retries)
+
+    for level in (logging.WARNING, logging.INFO):
+        with caplog.at_level(level), pytest.raises(Sent):
+            api._send(api._url("authenticate"), None, {"password": "secret"}, None)
+        # the payload is only copied and masked when a record is emitted
+        assert bool(calls) == (level == logging.INFO)
+
+    assert "'password': '*****'" in caplog.text
@@ -0,0 +1,66 @@
+import pytest
+
+from conftest import make_case_view, make_inbox_page
+from mcxapi.api import InboxBuilder, McxApiBase
+from mcxapi.archive import ArchiveReplay, ReplayMcxApi, ResponseArchive
+from mcxapi.exceptions import McxReplayError
+
+
+def record(path, user, pages, case_ids):
+    with ResponseArchive(str(path)) as archive:
+        api = McxApiBase("test", "company", user, "password", archive=archive)
+        for page in pages:
+            api.parse_case_inbox(page, InboxBuilder())
+        for case_id in case_ids:
+            api.parse_case(make_case_view(case_id), case_id)
+
+
+def test_replays_recorded_inbox_and_cases_without_network(tmp_path):
+    path = tmp_path / "archive.jsonl.gz"
+    record(path, "alice", [make_inbox_page([1, 2]), make_inbox_page([3])], [1, 2, 3])
+    # a second run appends to the archive
+    record(path, "bob", [make_inbox_page([4])], [4])
+
+    with ArchiveReplay(str(path)) as replay:
+        assert replay.users == ["alice", "bob"]
+
+        api = ReplayMcxApi(replay, "test", "company", "alice")
+        api.auth()
+        inbox = api.get_case_inbox()
+        assert inbox.ids == [1, 2, 3]
+        assert {row["Inbox Owner"] for row in inbox.cases} == {"alice"}
+        assert api.get_case(4).case_id == 4
+
+        with pytest.raises(McxReplayError):
+            api.get_case(5)
+
+
+def test_replay_reads_cases_from_disk_as_they_are_replayed(tmp_path):
+    path = tmp_path / "archive.jsonl.gz"
+    record(path, "alice", [], [1, 2])
+    with ResponseArchive(str(path)) as archive:
+        archive.record("getCaseView", "alice", make_case_view(1, survey_id=11), 1)
+
+    with ArchiveReplay(str(path)) as replay:
+        # only where each response is, not the response
+        assert all(isinstance(location, tuple) for location in replay._cases.values())
+        assert replay.case(2) == make_case_view(2)
+        # the last recording of a case
+        assert replay.case(1) == make_case_view(1, survey_id=11)
+
+
+def test_replays_each_users_inbox_from_its_last_run(tmp_path):
+    path = tmp_path / "archive.jsonl.gz"
+    record(path, "alice", [make_inbox_page([1, 2, 3])], [1, 2, 3])
+    closed = make_inbox_page([2, 3])
+    for row in closed["GetMobileCaseInboxItemsResult"]["caseMobileInboxData"]["Rows"]:
+        row["Columns"][0]["ColumnValue"] = "Closed"
+    record(path, "alice", [closed], [2, 3])
+    record(path, "bob", [make_inbox_page([4])], [4])
+
+    with ArchiveReplay(str(path)) as replay:
+        inbox = ReplayMcxApi(replay, "test", "company", "alice").get_case_inbox()
+        assert inbox.ids == [2, 3]
+        assert [row["Status"] for row in inbox.cases] == ["Closed", "Closed"]
+        # other users keep the inbox of the run that recorded them
+        assert ReplayMcxApi(replay, "test", "company", "bob").get_case_inbox().ids == [4]
@@ -0,0 +1,87 @@
+import os
+import stat
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from mcxapi.api import McxApi
+from mcxapi.auth import TokenManager
+from mcxapi.exceptions import McxAuthError
+
+
+class ExpiringTokenApi(McxApi):
+    """Accepts only the most recently issued token"""
+
+    def __init__(self, token_manager):
+        super().__init__("test", "company", "user", "password", token_manager=token_manager)
+        self.logins = 0
+        self.valid_token = None
+        self.lock = threading.Lock()
+
+    def _send(self, url, params, json, token, raw=False):
+        if url.endswith("authenticate"):
+            with self.lock:
+                self.logins += 1
+                self.valid_token = "token-{}".format(self.logins)
+            time.sleep(0.01)
+            return {"AuthenticateResult": {"token": self.valid_token}}
+        if token != self.valid_token:
+            raise McxAuthError(url)
+        return {"ok": token}
+
+
+def test_refresh_authenticates_once_for_concurrent_callers():
+    manager = TokenManager()
+    key = TokenManager.key("test", "company", "user")
+    manager.put(key, "stale")
+    calls = []
+
+    def authenticate():
+        calls.append(1)
+        time.sleep(0.05)
+        return "fresh"
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        tokens = list(executor.map(lambda _: manager.refresh(key, "stale", authenticate), range(10)))
+
+    assert tokens == ["fresh"] * 10
+    assert len(calls) == 1
+
+
+def test_expired_token_is_refreshed_once_and_requests_retried():
+    api = ExpiringTokenApi(TokenManager())
+    api.auth()
+    assert api.logins == 1
+    # the server expires the token
+    api.valid_token = "token-new"
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        results = list(executor.map(lambda _: api._post(api._url("getCaseView"), json={}), range(20)))
+
+    assert api.logins == 2
+    assert all(r == {"ok": "token-2"} for r in results)
+
+
+def test_token_cache_file_is_private_and_reused(tmp_path):
+    cache_file = str(tmp_path / "tokens.json")
+    api = ExpiringTokenApi(TokenManager(cache_file))
+    api.auth()
+    assert stat.S_IMODE(os.stat(cache_file).st_mode) == 0o600
+
+    reused = ExpiringTokenApi(TokenManager(cache_file))
+    reused.auth()
+    assert reused.token == "token-1"
+    assert reused.logins == 0
+
+
+def test_concurrent_puts_all_reach_the_cache_file(tmp_path):
+    cache_file = str(tmp_path / "tokens.json")
+    manager = TokenManager(cache_file)
+    keys = [TokenManager.key("test", "company", "user{}".format(i)) for i in range(50)]
+
+    with ThreadPoolExecutor(max_workers=50) as executor:
+        list(executor.map(lambda key: manager.put(key, "token-" + key), keys))
+
+    assert TokenManager(cache_file)._tokens == {key: "token-" + key for key in keys}
+    assert os.listdir(str(tmp_path)) == ["tokens.json"]
@@ -0,0 +1,57 @@
+import json as jsonlib
+
+from conftest import make_case_view, make_inbox_page
+from mcxapi.api import McxApi
+from mcxapi.cache import CaseStore, row_marker
+
+
+class FakeCaseApi(McxApi):
+
+    def __init__(self, case_store):
+        super().__init__("test", "company", "user", "password", case_store=case_store)
+        self.fetched = []
+
+    def _post(self, url, params=None, json={}, raw=False):
+        self.fetched.append(json["caseId"])
+        response = make_case_view(json["caseId"])
+        return jsonlib.dumps(response).encode() if raw else response
+
+
+def test_store_only_returns_payload_for_matching_marker(tmp_path):
+    with CaseStore(str(tmp_path / "cases.db")) as store:
+        store.put(1, "m1", {"a": 1})
+        assert store.get(1, "m1") == {"a": 1}
+        assert store.get(1, "m2") is None
+        assert store.get(1, None) is None
+        assert store.get(2, "m1") is None
+
+
+def test_get_case_only_fetches_new_or_changed_cases(tmp_path):
+    path = str(tmp_path / "cases.db")
+    with CaseStore(path) as store:
+        api = FakeCaseApi(store)
+        api.get_case(1, "m1")
+        api.get_case(2, "m1")
+
+    with CaseStore(path) as store:
+        api = FakeCaseApi(store)
+        assert api.get_case(1, "m1").case_id == 1
+        assert api.get_case(2, "m2").case_id == 2
+        assert api.get_case(3, "m1").case_id == 3
+        assert api.fetched == [2, 3]
+
+
+def test_undecoded_case_views_are_stored_and_served_undecoded(tmp_path):
+    with CaseStore(str(tmp_path / "cases.db")) as store:
+        api = FakeCaseApi(store)
+        body = api.get_case_view(1, "m1", raw=True)
+        assert isinstance(body, bytes)
+        assert jsonlib.loads(api.get_case_view(1, "m1", raw=True)) == make_case_view(1)
+        assert api.get_case_view(1, "m1") == make_case_view(1)
+        assert api.fetched == [1]
+
+
+def test_row_marker_ignores_inbox_owner():
+    row = make_inbox_page([1])["GetMobileCaseInboxItemsResult"]["caseMobileInboxData"]["Rows"][0]
+    assert row_marker(dict(row, **{"Inbox Owner": "a"})) == row_marker(dict(row, **{"Inbox Owner": "b"}))
+    assert row_marker(row) != row_marker(dict(row, CaseId=2))
@@ -0,0 +1,145 @@
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from mcxapi import writers
+from mcxapi.cli import cli
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "benchmarks"))
+from fake_mcx import FakeMcx, serve  # noqa: E402
+
+INBOXES = {"alice": [1, 2, 3], "bob": [4, 5]}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeMcx(items=6, depth=2, inboxes=INBOXES)
+    httpd, base_url = serve(fake)
+    fake.base_url = base_url
+    yield fake
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def run(fake, tmp_path, monkeypatch):
+    """ Runs the cli for the accounts in INBOXES against the fake in tmp_path, returns the rows of the output file
+    """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "creds.tsv").write_text("".join("{}\tpassword\n".format(user) for user in INBOXES))
+
+    def run(*args, output="cases.jsonl", options=(), exit_code=0):
+        format = output.rsplit(".", 1)[-1]
+        result = CliRunner().invoke(cli, ["-i", "test", "-c", "company", "-m", "creds.tsv", "--base-url", fake.base_url,
+                                          "-f", format, "-q"] + list(options) + list(args))
+        assert result.exit_code == exit_code, result.output
+        run.output = result.output
+        with open(output, newline="") as rows:
+            if format == "csv":
+                return list(csv.DictReader(rows))
+            return [json.loads(line) for line in rows]
+
+    return run
+
+
+def fail_cases(fake, monkeypatch, case_ids):
+    """ Answers getCaseView for case_ids with a 404 until they are removed from the returned set
+    """
+    failing = set(case_ids)
+    handle = fake.handle
+
+    def handle_with_failures(endpoint, body):
+        if endpoint == "getCaseView" and body["caseId"] in failing:
+            return 404, {}
+        return handle(endpoint, body)
+
+    monkeypatch.setattr(fake, "handle", handle_with_failures)
+    return failing
+
+
+def test_inbox_exports_every_accounts_inbox(run):
+    rows = run("inbox", output="case_inbox.jsonl")
+    assert sorted((row["CaseId"], row["Inbox Owner"]) for row in rows) == [(1, "alice"), (2, "alice"), (3, "alice"),
+                                                                         (4, "bob"), (5, "bob")]
+
+
+@pytest.mark.parametrize("options", [[], ["--async"], ["--stream"]])
+def test_cases_exports_every_accounts_cases_once(run, fake, options):
+    rows = run("cases", *options)
+    assert sorted(row["Case ID"] for row in rows) == [1, 2, 3, 4, 5]
+    assert fake.case_requests == {case_id: 1 for case_id in range(1, 6)}
+
+
+def test_cases_fetches_explicit_case_ids_once_for_all_accounts(run, fake):
+    rows = run("cases", "2", "7")
+    assert sorted(row["Case ID"] for row in rows) == [2, 7]
+    assert fake.case_requests == {2: 1, 7: 1}
+    assert "CaseIDs to export for alice: 2" in run.output
+    assert "CaseIDs to export for bob" not in run.output
+
+
+def test_stream_write_time_includes_writing_spilled_rows(run, monkeypatch):
+    write_to_csv = writers.write_to_csv
+
+    def slow_write_to_csv(*args):
+        time.sleep(0.3)
+        write_to_csv(*args)
+
+    monkeypatch.setattr(writers, "write_to_csv", slow_write_to_csv)
+    rows = run("cases", "--stream", output="cases.csv", options=["--metrics-out", "metrics"])
+    assert len(rows) == 5
+    with open("metrics.json") as metrics:
+        summary = json.load(metrics)
+    assert summary["rows_written"] == 5
+    assert summary["write_seconds"] >= 0.3
+
+
+@pytest.mark.parametrize("options", [[], ["--stream"]])
+def test_resume_rewrites_journaled_cases_and_only_fetches_failed_ones(run, fake, tmp_path, monkeypatch, options):
+    failing = fail_cases(fake, monkeypatch, {2, 4})
+    rows = run("cases", *options)
+    assert sorted(row["Case ID"] for row in rows) == [1, 3, 5]
+    assert (tmp_path / "cases.jsonl.journal").exists()
+
+    failing.clear()
+    fake.case_requests.clear()
+    rows = run("cases", "--resume", *options)
+    assert "3 cases already exported, 2 failed cases to retry" in run.output
+    assert sorted(row["Case ID"] for row in rows) == [1, 2, 3, 4, 5]
+    assert fake.case_requests == {2: 1, 4: 1}
+    # nothing left to resume
+    assert not (tmp_path / "cases.jsonl.journal").exists()
+
+
+@pytest.mark.parametrize("options", [[], ["--async"]])
+def test_cases_in_several_inboxes_are_fetched_and_written_once(run, fake, monkeypatch, options):
+    monkeypatch.setattr(fake, "inboxes", {"alice": [1, 2, 3], "bob": [2, 3, 4, 5]})
+    failing = fail_cases(fake, monkeypatch, {5})
+    rows = run("cases", *options, options=["--metrics-out", "metrics"])
+    assert sorted(row["Case ID"] for row in rows) == [1, 2, 3, 4]
+    # the failed case 5 isn't counted
+    assert fake.case_requests == {case_id: 1 for case_id in range(1, 5)}
+    assert "Skipped 2 CaseIDs already scheduled for another account" in run.output
+    with open("metrics.json") as metrics:
+        assert json.load(metrics)["gauges"]["duplicate_case_ids_skipped"] == 2
+
+    # cases the journal has completed are neither fetched nor counted as duplicates
+    failing.clear()
+    fake.case_requests.clear()
+    rows = run("cases", "--resume", *options)
+    assert sorted(row["Case ID"] for row in rows) == [1, 2, 3, 4, 5]
+    assert fake.case_requests == {5: 1}
+    assert "Skipped" not in run.output
+
+
+def test_every_run_removes_its_log_handler(run):
+    handlers = list(logging.getLogger().handlers)
+    run("inbox", output="case_inbox.jsonl")
+    run("inbox", output="case_inbox.jsonl")
+    assert logging.getLogger().handlers == handlers
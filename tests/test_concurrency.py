@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mcxapi.concurrency import AdaptiveLimiter, DaemonThreadPool, RequestAbandoned, SingleFlight
+
+
+def complete(limiter, count, latency=0.1, failed=False):
+    for _ in range(count):
+        generation = limiter.acquire()
+        limiter.release(generation, latency, failed)
+
+
+def test_limit_grows_by_one_per_healthy_window():
+    limiter = AdaptiveLimiter(initial_limit=4, max_limit=6)
+    complete(limiter, 4)
+    assert limiter.limit == 5
+    complete(limiter, 5 + 6 + 6)
+    assert limiter.limit == 6
+
+
+def test_server_errors_halve_the_limit_once_per_generation():
+    limiter = AdaptiveLimiter(initial_limit=8, window=2, error_threshold=0.5)
+    generations = [limiter.acquire() for _ in range(4)]
+    for generation in generations:
+        limiter.release(generation, 0.1, failed=True)
+    assert limiter.limit == 4
+
+    # a new window of failures
+    complete(limiter, 1, failed=True)
+    assert limiter.limit == 4
+    complete(limiter, 1, failed=True)
+    assert limiter.limit == 2
+
+
+def test_only_a_sustained_error_rate_lowers_the_limit():
+    limiter = AdaptiveLimiter(initial_limit=8, window=10, error_threshold=0.2)
+    for _ in range(2):
+        complete(limiter, 10)
+        complete(limiter, 1, failed=True)
+    # one failure in each window
+    assert limiter.limit == 10
+
+    complete(limiter, 3)
+    complete(limiter, 1, failed=True)
+    assert limiter.limit == 5
+
+
+def test_slow_responses_lower_the_limit():
+    limiter = AdaptiveLimiter(initial_limit=8, window=2, error_threshold=0.5)
+    complete(limiter, 1, latency=1.0)
+    complete(limiter, 1, latency=5.0)
+    assert limiter.limit == 4
+
+
+def test_slot_records_exceptions_as_failures():
+    limiter = AdaptiveLimiter(initial_limit=8, min_limit=2, window=1)
+    try:
+        with limiter.slot():
+            raise TimeoutError()
+    except TimeoutError:
+        pass
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_abandoned_request_frees_its_slot_without_a_latency_sample():
+    limiter = AdaptiveLimiter(initial_limit=1)
+    request = limiter.request()
+    with limiter.slot(request):
+        request.abandon()
+        assert limiter.in_flight == 0
+        # the slot is free for another request while the abandoned one is still running
+        with limiter.slot():
+            pass
+        average_latency = limiter.average_latency
+        time.sleep(0.01)
+    assert limiter.average_latency == average_latency
+    assert limiter.in_flight == 0
+
+    waiting = limiter.request()
+    waiting.abandon()
+    with pytest.raises(RequestAbandoned):
+        with limiter.slot(waiting):
+            pass
+    assert limiter.in_flight == 0
+
+
+def test_daemon_thread_pool_reuses_idle_threads():
+    pool = DaemonThreadPool()
+    threads = {pool.submit(threading.current_thread).result() for _ in range(5)}
+    assert len(threads) == 1
+    assert threads.pop().daemon
+
+    # a busy thread isn't waited for
+    release = threading.Event()
+    busy = pool.submit(release.wait)
+    assert pool.submit(threading.current_thread).result(timeout=1) is not None
+    release.set()
+    assert busy.result(timeout=1)
+
+    def fail():
+        raise TimeoutError()
+
+    with pytest.raises(TimeoutError):
+        pool.submit(fail).result()
+
+
+def test_single_flight_shares_one_call_between_threads():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch(case_id):
+        calls.append(case_id)
+        started.set()
+        release.wait(5)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(single_flight.do, 7, fetch, 7)
+        started.wait(5)
+        followers = [executor.submit(single_flight.do, 7, fetch, 7) for _ in range(3)]
+        # the followers are waiting on the leader's call
+        while single_flight.shared < 3:
+            pass
+        release.set()
+        results = {id(f.result()) for f in [leader] + followers}
+    assert calls == [7]
+    assert len(results) == 1
+
+    # a completed call isn't reused
+    single_flight.do(7, fetch, 7)
+    assert calls == [7, 7]
+
+
+def test_single_flight_shares_exceptions_between_coroutines():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def fetch(case_id):
+        calls.append(case_id)
+        await asyncio.sleep(0.01)
+        raise TimeoutError()
+
+    async def run():
+        return await asyncio.gather(*[single_flight.do_async(7, fetch, 7) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert calls == [7]
+    assert single_flight.shared == 2
+    assert all(isinstance(result, TimeoutError) for result in results)
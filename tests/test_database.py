@@ -0,0 +1,53 @@
+import sqlite3
+
+from conftest import make_case_view, make_inbox_page
+from mcxapi.api import Case, InboxBuilder, McxApiBase
+from mcxapi.database import CaseDatabase
+
+
+def make_case(case_id, **options):
+    return Case(make_case_view(case_id, **options)["GetCaseViewResult"])
+
+
+def query(path, sql):
+    with sqlite3.connect(path) as connection:
+        return connection.execute(sql).fetchall()
+
+
+def test_cases_are_normalised_and_updated_in_place(tmp_path):
+    path = str(tmp_path / "cases.sqlite")
+    with CaseDatabase(path, batch_size=2) as database:
+        for case_id in (1, 2, 3):
+            database.write_case(make_case(case_id))
+
+    assert query(path, "SELECT case_id, status, priority, survey_id FROM cases ORDER BY case_id") == [
+        (1, "Open", "High", 10), (2, "Open", "High", 10), (3, "Open", "High", 10)]
+    assert query(path, "SELECT display_answer FROM items WHERE case_id = 1 AND case_item_id = 4") == [("Email",)]
+    assert query(path, "SELECT text_value FROM answers WHERE case_id = 2 AND case_item_id = 3") == [("Late delivery 2",)]
+    assert query(path, "SELECT path, is_leaf FROM root_cause_answers WHERE case_id = 1 ORDER BY tree_id") == [
+        ("Product", 0), ("Product > Quality", 0), ("Product > Quality > Broken", 1)]
+    assert query(path, "SELECT note_date FROM activity_notes WHERE case_id = 1") == [("2017-02-10T10:09:50.423000-06:00",)]
+    assert len(query(path, "SELECT * FROM source_responses WHERE case_id = 3")) == 2
+    indexes = {name for name, in query(path, "SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"cases_survey_id", "cases_status"} <= indexes
+
+    # the answers of case 1 have been cleared since the last export
+    with CaseDatabase(path) as database:
+        database.write_case(make_case(1, answers=False))
+
+    assert query(path, "SELECT count(*) FROM cases") == [(3,)]
+    assert query(path, "SELECT count(*) FROM answers WHERE case_id = 1") == [(0,)]
+    assert query(path, "SELECT count(*) FROM root_cause_answers WHERE case_id = 1") == [(0,)]
+    assert query(path, "SELECT count(*) FROM answers WHERE case_id = 2") == [(2,)]
+
+
+def test_inbox_rows_are_stored_as_columns(tmp_path):
+    path = str(tmp_path / "inbox.sqlite")
+    inbox = InboxBuilder()
+    McxApiBase("test", "company", "alice", "password").parse_case_inbox(make_inbox_page([1, 2]), inbox)
+    with CaseDatabase(path) as database:
+        for row in inbox.cases:
+            database.write(row)
+
+    assert query(path, "SELECT column_name, column_value FROM inbox WHERE case_id = 2 ORDER BY column_name") == [
+        ("CaseId", 2), ("Inbox Owner", "alice"), ("Modified", "/Date(1486742990423-0600)/"), ("Status", "Open")]
@@ -1,21 +1,264 @@
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 import requests
-from requests.packages.urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
 
-s = requests.Session()
-retries = Retry(total=3,
-                backoff_factor=0.1,
-                status_forcelist=[ 500, 502, 503, 504 ])
-s.mount('http://', HTTPAdapter(max_retries=retries))
+from mcxapi.api import McxApi
+from mcxapi.concurrency import AdaptiveLimiter
+from mcxapi.exceptions import McxCircuitOpenError, McxNetworkError
+from mcxapi.resilience import CircuitBreaker, HedgePolicy, RetryBudget, RetryPolicy
+
+
+class FakeServer:
+    """A local HTTP server answering each POST with the next programmed (status, headers, delay) response"""
+
+    def __init__(self):
+        self.responses = []
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                server.requests += 1
+                status, headers, delay = server.responses.pop(0) if server.responses else (200, {}, 0)
+                time.sleep(delay)
+                body = json.dumps({"ok": True}).encode()
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    # the client timed out and went away
+                    pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1]) + "{}/CaseManagement.svc/{}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def respond(self, status, headers=None, delay=0, times=1):
+        self.responses.extend([(status, headers or {}, delay)] * times)
+
+
+@pytest.fixture
+def server():
+    server = FakeServer()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+def make_api(server, **policy_options):
+    policy_options.setdefault("backoff_base", 0.001)
+    policy = RetryPolicy(**policy_options)
+    policy.delays = []
+    policy.sleep = policy.delays.append
+    api = McxApi("test", "company", "user", "password", retry_policy=policy)
+    api.BASE_URL = server.base_url
+
+    return api
+
+
+def post(api, endpoint="getCaseView"):
+    return api._post(api._url(endpoint), json={"caseId": 1})
+
+
+def test_retries_server_errors(server):
+    api = make_api(server)
+    server.respond(503, times=2)
+    assert post(api) == {"ok": True}
+    assert server.requests == 3
+    summary = api.metrics.summary()["endpoints"]["getCaseView"]
+    assert summary["retries"] == 2
+    assert summary["responses"] == {"503": 2, "200": 1}
+
+
+def test_gives_up_after_retries(server):
+    api = make_api(server, retries=2)
+    server.respond(500, times=5)
+    with pytest.raises(McxNetworkError):
+        post(api)
+    assert server.requests == 3
+
+
+def test_backoff_honours_retry_after(server):
+    api = make_api(server)
+    server.respond(503, headers={"Retry-After": "2"})
+    server.respond(429, headers={"Retry-After": "60"})
+    post(api)
+    assert api.retry_policy.delays[0] == 2
+    # Retry-After is capped by backoff_cap
+    assert api.retry_policy.delays[1] == api.retry_policy.backoff_cap
+
+
+def test_full_jitter_backoff_stays_within_exponential_bound():
+    policy = RetryPolicy(backoff_base=1.0, backoff_cap=5.0)
+    for attempt in range(6):
+        delays = [policy.backoff(attempt) for _ in range(50)]
+        assert all(0 <= d <= min(5.0, 2 ** attempt) for d in delays)
+
+
+def test_timeout_is_retried_then_raised(server):
+    api = make_api(server, retries=1)
+    api.TIMEOUT = 0.2
+    server.respond(200, delay=1, times=2)
+    with pytest.raises(McxNetworkError):
+        post(api)
+    assert server.requests == 2
+
+
+def test_client_errors_are_not_retried(server):
+    api = make_api(server)
+    server.respond(404)
+    with pytest.raises(McxNetworkError):
+        post(api)
+    assert server.requests == 1
+
+
+def test_exhausted_retry_budget_stops_retries(server):
+    api = make_api(server, budget=RetryBudget(ratio=0, min_retries=1))
+    server.respond(503, times=10)
+    with pytest.raises(McxNetworkError):
+        post(api)
+    # one retry from the budget
+    assert server.requests == 2
+
+    with pytest.raises(McxNetworkError):
+        post(api)
+    assert server.requests == 3
+
+
+def test_circuit_opens_per_endpoint_and_fails_fast(server):
+    api = make_api(server, retries=0, failure_threshold=2, reset_timeout=60)
+    server.respond(503, times=2)
+    for _ in range(2):
+        with pytest.raises(McxNetworkError):
+            post(api)
+
+    with pytest.raises(McxCircuitOpenError):
+        post(api)
+    assert server.requests == 2
+
+    # other endpoints have their own circuit
+    assert post(api, "getMobileCaseInboxItems") == {"ok": True}
+
+
+def test_circuit_half_opens_after_reset_timeout(server):
+    api = make_api(server, retries=0, failure_threshold=1, reset_timeout=0.1)
+    server.respond(503)
+    with pytest.raises(McxNetworkError):
+        post(api)
+    with pytest.raises(McxCircuitOpenError):
+        post(api)
+
+    time.sleep(0.15)
+    assert post(api) == {"ok": True}
+    assert post(api) == {"ok": True}
+
+
+def test_cancelled_trial_request_lets_the_next_request_through():
+    breaker = CircuitBreaker("getCaseView", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.release_trial()
+    assert breaker.allow_request()
+
+
+def test_circuit_reopens_when_the_trial_request_fails_without_a_response(server, monkeypatch):
+    api = make_api(server, retries=0, failure_threshold=1, reset_timeout=0.1)
+    server.respond(503)
+    with pytest.raises(McxNetworkError):
+        post(api)
+
+    def broken_post(*args, **kwargs):
+        raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+    session_post = api.session.post
+    monkeypatch.setattr(api.session, "post", broken_post)
+    time.sleep(0.15)
+    with pytest.raises(McxNetworkError):
+        post(api)
+    assert api._breaker(api._url("getCaseView")).state == "open"
+
+    monkeypatch.setattr(api.session, "post", session_post)
+    time.sleep(0.15)
+    assert post(api) == {"ok": True}
+
+
+@pytest.mark.parametrize("max_ratio, hedged", [(1.0, True), (0.0, False)])
+def test_hedges_slow_requests_within_the_budget(server, max_ratio, hedged):
+    api = make_api(server)
+    api.hedge_policy = HedgePolicy(max_ratio=max_ratio, min_samples=5)
+    for _ in range(5):
+        api.metrics.observe_request("getCaseView", 0.01)
+    server.respond(200)
+    server.respond(200, delay=0.5)
+
+    # answered before the p95 latency
+    post(api)
+    start = time.monotonic()
+    assert post(api) == {"ok": True}
+    assert (time.monotonic() - start < 0.4) == hedged
+    summary = api.metrics.summary()["endpoints"]["getCaseView"]
+    assert (summary["hedges"], summary["hedges_won"]) == ((1, 1) if hedged else (0, 0))
+
+
+def test_losing_hedge_frees_its_limiter_slot_without_a_latency_sample(server):
+    api = make_api(server)
+    api.limiter = AdaptiveLimiter(initial_limit=4)
+    api.hedge_policy = HedgePolicy(max_ratio=1.0, min_samples=5)
+    for _ in range(5):
+        api.metrics.observe_request("getCaseView", 0.01)
+    server.respond(200, delay=0.5)
+
+    assert post(api) == {"ok": True}
+    # the original request is still waiting on the server
+    assert server.requests == 2
+    assert api.limiter.in_flight == 0
+    time.sleep(0.6)
+    assert api.limiter.average_latency < 0.4
+
+
+def test_latency_excludes_time_queued_for_a_limiter_slot(server):
+    api = make_api(server)
+    api.limiter = AdaptiveLimiter(initial_limit=1)
+    server.respond(200, delay=0.3, times=2)
 
+    threads = [threading.Thread(target=post, args=(api,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = api.metrics.summary()["endpoints"]["getCaseView"]
+    assert summary["latency_seconds"]["count"] == 2
+    assert summary["latency_seconds"]["max"] < 0.5
+    assert summary["queue_wait_seconds"]["max"] >= 0.25
 
-def test_timeout_with_retry():
-    
-    with pytest.raises(requests.exceptions.ConnectionError):
-        s.get('http://httpbin.org/delay/5', timeout=3)
 
-def test_timeout_without_retry():
+def test_hedge_delay_starts_once_the_request_has_a_limiter_slot(server):
+    api = make_api(server)
+    api.limiter = AdaptiveLimiter(initial_limit=1)
+    api.hedge_policy = HedgePolicy(max_ratio=1.0, min_samples=5)
+    for _ in range(5):
+        api.metrics.observe_request("getCaseView", 0.01)
+    server.respond(200, delay=0.4)
+    inbox = threading.Thread(target=post, args=(api, "getMobileCaseInboxItems"))
+    inbox.start()
+    time.sleep(0.1)
 
-    with pytest.raises(requests.exceptions.Timeout):
-        requests.get('http://httpbin.org/delay/5', timeout=3)
\ No newline at end of file
+    # queued behind the inbox request for longer than the hedge delay, but answered straight away once sent
+    assert post(api) == {"ok": True}
+    inbox.join()
+    assert server.requests == 2
+    assert api.metrics.summary()["endpoints"]["getCaseView"]["hedges"] == 0
@@ -0,0 +1,41 @@
+from mcxapi.journal import CaseJournal
+
+
+def test_resumed_journal_has_flushed_cases_and_skips_a_torn_line(tmp_path):
+    path = str(tmp_path / "cases.csv.journal")
+    flushes = []
+    with CaseJournal(path, before_flush=lambda: flushes.append(1)) as journal:
+        journal.add(1, {"Case ID": 1})
+        journal.add_error(2, "timed out")
+        journal.add_error(3, "timed out")
+        journal.flush()
+        assert flushes == [1]
+        journal.add(4, {"Case ID": 4})
+    # killed while writing a line
+    with open(path, 'a') as journal_file:
+        journal_file.write('{"case_id": 5, "ro')
+
+    with CaseJournal(path, resume=True) as journal:
+        # case 4 wasn't flushed
+        assert journal.rows == [(1, {"Case ID": 1})]
+        assert journal.errors == {2, 3}
+        journal.add(2, {"Case ID": 2})
+        journal.flush()
+
+    journal = CaseJournal(path, resume=True)
+    assert journal.completed == {1, 2}
+    assert journal.errors == {3}
+    journal.remove()
+    assert not (tmp_path / "cases.csv.journal").exists()
+
+
+def test_journal_without_resume_starts_over(tmp_path):
+    path = str(tmp_path / "cases.csv.journal")
+    with CaseJournal(path) as journal:
+        journal.add(1, {"Case ID": 1})
+        journal.flush()
+
+    with CaseJournal(path) as journal:
+        assert journal.rows == []
+    with CaseJournal(path, resume=True) as journal:
+        assert journal.rows == []
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from mcxapi.metrics import Histogram, Metrics
+
+
+def test_histogram_quantiles_interpolate_within_buckets():
+    histogram = Histogram((0.1, 1.0, 10.0))
+    for value in [0.05] * 90 + [0.5] * 9 + [20.0]:
+        histogram.observe(value)
+    assert histogram.quantile(0.45) == pytest.approx(0.05)
+    assert histogram.quantile(0.95) == pytest.approx(0.6)
+    # the overflow bucket reports the largest observation
+    assert histogram.quantile(1.0) == 20.0
+    assert list(histogram.cumulative_counts()) == [90, 99, 99]
+
+
+def test_report_is_written_as_json_and_prometheus_text(tmp_path):
+    metrics = Metrics()
+    metrics.observe_request("getCaseView", 0.2, 1000, 200)
+    metrics.observe_request("getCaseView", 0.3, 10, 503)
+    metrics.observe_request("getCaseView", 5.0)
+    metrics.record_retry("getCaseView")
+    with metrics.time_parse("case"):
+        pass
+    metrics.observe_write(10, 0.5)
+    metrics.set_gauge("concurrency_limit", 12)
+
+    metrics.write(str(tmp_path / "metrics"))
+    summary = json.loads((tmp_path / "metrics.json").read_text())
+    endpoint = summary["endpoints"]["getCaseView"]
+    assert endpoint["latency_seconds"]["count"] == 3
+    assert endpoint["bytes_received"] == 1010
+    assert endpoint["retries"] == 1
+    assert endpoint["responses"] == {"200": 1, "503": 1, "error": 1}
+    assert summary["parse_seconds"]["case"]["count"] == 1
+    assert summary["rows_per_second"] == 20
+    assert summary["gauges"] == {"concurrency_limit": 12}
+
+    prom = (tmp_path / "metrics.prom").read_text()
+    assert 'mcx_request_duration_seconds_bucket{endpoint="getCaseView",le="0.25"} 1' in prom
+    assert 'mcx_request_duration_seconds_bucket{endpoint="getCaseView",le="+Inf"} 3' in prom
+    assert 'mcx_responses_total{endpoint="getCaseView",status="503"} 1' in prom
+    assert 'mcx_retries_total{endpoint="getCaseView"} 1' in prom
+    assert "mcx_rows_written_total 10" in prom
+    assert "mcx_concurrency_limit 12" in prom
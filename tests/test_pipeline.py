@@ -0,0 +1,64 @@
+import json
+
+from collections import namedtuple
+
+import pytest
+
+from conftest import make_case_view
+from mcxapi.exceptions import McxNetworkError, McxParsingError
+from mcxapi.metrics import Metrics
+from mcxapi.pipeline import CaseParser, CasePipeline
+
+Fetch = namedtuple('Fetch', 'case_id')
+
+
+@pytest.fixture(scope="module")
+def parser():
+    with CaseParser(2, metrics=Metrics()) as parser:
+        yield parser
+
+
+def test_pipeline_parses_rows_in_worker_processes_and_reports_errors(parser):
+    def fetch_case_view(fetch):
+        if fetch.case_id == 3:
+            raise McxNetworkError("getCaseView")
+        if fetch.case_id == 4:
+            return {"GetCaseViewResult": {}}
+        if fetch.case_id == 6:
+            return b'{"GetCaseViewResult": '
+        # undecoded, as McxApi.get_case_view(raw=True) returns it
+        return json.dumps(make_case_view(fetch.case_id)).encode()
+
+    results = {fetch.case_id: (case, error) for fetch, case, error in
+               CasePipeline(parser, fetch_workers=2).run([Fetch(i) for i in range(1, 7)], fetch_case_view)}
+    assert sorted(results) == [1, 2, 3, 4, 5, 6]
+    assert results[1][0]["Summary"] == "Late delivery 1"
+    assert results[5][0]["Root Cause"] == "Product > Quality > Broken\n"
+    assert isinstance(results[3][1], McxNetworkError)
+    assert isinstance(results[4][1], McxParsingError)
+    assert str(results[4][1]) == "Unable to parse case 4"
+    assert str(results[6][1]) == "Unable to parse case 6"
+    assert parser.metrics.parse_time["case"].count == 3
+
+
+def test_pipeline_stops_fetching_while_max_pending_cases_are_unwritten(parser):
+    fetched = []
+
+    def fetch_case_view(fetch):
+        fetched.append(fetch.case_id)
+        return make_case_view(fetch.case_id)
+
+    written = 0
+    for fetch, case, error in CasePipeline(parser, fetch_workers=4, max_pending=3).run([Fetch(i) for i in range(20)],
+                                                                                         fetch_case_view):
+        assert error is None
+        assert len(fetched) - written <= 3
+        written += 1
+    assert written == 20
+
+
+def test_parser_returns_cases_without_flatten():
+    with CaseParser(1, flatten=False) as parser:
+        case = parser.result(parser.submit(make_case_view(7), 7))
+    assert case.case_id == 7
+    assert case._find_item(5)._find_root_cause("a1x").parent.root_cause_name == "Quality"
@@ -0,0 +1,35 @@
+from mcxapi.snapshot import InboxSnapshot, change_rows
+
+
+def rows(*statuses):
+    return [{"CaseId": case_id, "Status": status} for case_id, status in statuses]
+
+
+def test_diff_reports_added_changed_and_removed_cases(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    snapshot = InboxSnapshot(path)
+    changes = snapshot.diff(rows((1, "Open"), (2, "Open"), (3, "Open")))
+    assert [r["CaseId"] for r in changes.added] == [1, 2, 3]
+    snapshot.save()
+
+    snapshot = InboxSnapshot(path)
+    changes = snapshot.diff(rows((1, "Open"), (2, "Closed"), (4, "Open")))
+    assert [r["CaseId"] for r in changes.added] == [4]
+    assert [r["CaseId"] for r in changes.changed] == [2]
+    assert changes.removed == [3]
+    assert [(r["CaseId"], r["Change"]) for r in change_rows(changes)] == [(4, "added"), (2, "changed"), (3, "removed")]
+
+
+def test_excluded_cases_are_reported_again(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    snapshot = InboxSnapshot(path)
+    snapshot.diff(rows((1, "Open"), (2, "Open")))
+    snapshot.save()
+
+    snapshot = InboxSnapshot(path)
+    snapshot.diff(rows((1, "Closed"), (2, "Open"), (3, "Open")))
+    snapshot.save(exclude=[1, 3])
+
+    changes = InboxSnapshot(path).diff(rows((1, "Closed"), (2, "Open"), (3, "Open")))
+    assert [r["CaseId"] for r in changes.added] == [3]
+    assert [r["CaseId"] for r in changes.changed] == [1]
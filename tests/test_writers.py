@@ -0,0 +1,115 @@
+import csv
+import json
+import re
+import zipfile
+
+import pytest
+
+from mcxapi.writers import (FORMAT_CSV, FORMAT_JSON, FORMAT_JSONL, FORMAT_EXCEL, FORMAT_PARQUET, FORMAT_ARROW, open_stream_writer,
+                            ColumnarStreamWriter, CsvStreamWriter, ExcelStreamWriter, JsonArrayWriter, JsonLinesWriter,
+                            write_to_columnar, write_to_excel)
+
+ROWS = [{"Case ID": 1, "Status": "Open"},
+        {"Case ID": 2, "Status": "Closed", "Activity Note 1": "Called"},
+        {"Case ID": 3, "Priority": "High"}]
+
+
+def write_rows(writer):
+    with writer:
+        for row in ROWS:
+            writer.write(row)
+
+
+def test_csv_stream_writer_includes_late_fieldnames(tmp_path):
+    file = str(tmp_path / "cases.csv")
+    write_rows(CsvStreamWriter(file))
+
+    with open(file, encoding="utf-8-sig") as csvfile:
+        reader = csv.DictReader(csvfile)
+        assert reader.fieldnames == ["Activity Note 1", "Case ID", "Priority", "Status"]
+        rows = list(reader)
+    assert [r["Case ID"] for r in rows] == ["1", "2", "3"]
+    assert rows[1]["Activity Note 1"] == "Called"
+    assert rows[2]["Status"] == ""
+
+
+def test_json_lines_writer(tmp_path):
+    file = str(tmp_path / "cases.jsonl")
+    write_rows(JsonLinesWriter(file))
+
+    with open(file) as jsonfile:
+        assert [json.loads(line) for line in jsonfile] == ROWS
+
+
+def test_json_array_writer(tmp_path):
+    file = str(tmp_path / "cases.json")
+    write_rows(JsonArrayWriter(file))
+
+    with open(file) as jsonfile:
+        assert json.load(jsonfile) == ROWS
+
+    empty = str(tmp_path / "empty.json")
+    JsonArrayWriter(empty).close()
+    with open(empty) as jsonfile:
+        assert json.load(jsonfile) == []
+
+
+def test_open_stream_writer_picks_writer_for_format(tmp_path):
+    expected = {FORMAT_CSV: CsvStreamWriter, FORMAT_JSON: JsonArrayWriter, FORMAT_JSONL: JsonLinesWriter,
+                FORMAT_EXCEL: ExcelStreamWriter, FORMAT_PARQUET: ColumnarStreamWriter, FORMAT_ARROW: ColumnarStreamWriter}
+    for format, writer_class in expected.items():
+        writer = open_stream_writer(format, str(tmp_path / "cases.{}".format(format)))
+        writer.close()
+        assert isinstance(writer, writer_class)
+
+
+def sheet_names(file):
+    with zipfile.ZipFile(file) as xlsx:
+        return re.findall(r'<sheet name="([^"]+)"', xlsx.read("xl/workbook.xml").decode())
+
+
+def test_constant_memory_excel_splits_worksheets_at_max_rows(tmp_path):
+    file = str(tmp_path / "cases.xlsx")
+    rows = [{"Case ID": i, "Status": "Open"} for i in range(5)]
+    # two data rows and a header per sheet
+    write_to_excel(file, ["Case ID", "Status"], rows, constant_memory=True, max_rows=3)
+    assert sheet_names(file) == ["Cases", "Cases 2", "Cases 3"]
+
+
+def test_excel_without_rows_has_a_header_sheet(tmp_path):
+    file = str(tmp_path / "cases.xlsx")
+    write_to_excel(file, ["Case ID"], [], constant_memory=True)
+    assert sheet_names(file) == ["Cases"]
+
+
+def test_columnar_writer_infers_typed_columns_in_row_groups(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    file = str(tmp_path / "cases.parquet")
+    rows = [{"CaseId": i, "Modified": "/Date(1486742990423-0600)/", "Score": 1 if i else 0.5, "Note": "" if i else "x"}
+            for i in range(5)]
+    rows.append({"CaseId": 5, "Modified": "", "Mixed": True})
+    with ColumnarStreamWriter(file, FORMAT_PARQUET, row_group_size=2) as writer:
+        for row in rows:
+            writer.write(row)
+
+    parquet = pq.ParquetFile(file)
+    assert parquet.num_row_groups == 3
+    schema = parquet.schema_arrow
+    assert str(schema.field("CaseId").type) == "int64"
+    assert str(schema.field("Score").type) == "double"
+    assert str(schema.field("Modified").type) == "timestamp[ms, tz=UTC]"
+    assert str(schema.field("Note").type) == "string"
+    assert str(schema.field("Mixed").type) == "bool"
+    table = parquet.read().to_pylist()
+    assert table[0]["Modified"].timestamp() == 1486742990.423
+    assert table[5]["Modified"] is None
+    assert table[1]["Note"] == ""
+
+
+def test_arrow_ipc_matches_rows(tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    file = str(tmp_path / "cases.arrow")
+    write_to_columnar(file, ROWS, FORMAT_ARROW)
+    table = pyarrow.ipc.open_file(file).read_all()
+    assert table.column_names == ["Activity Note 1", "Case ID", "Priority", "Status"]
+    assert table.to_pylist()[1] == {"Activity Note 1": "Called", "Case ID": 2, "Priority": None, "Status": "Closed"}